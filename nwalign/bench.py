@@ -0,0 +1,268 @@
+"""
+benchmark nwalign. each case is a function, an alphabet, a sequence length
+and a matrix (or none); pairs of random, related sequences are aligned
+until --min_time has passed and the GCUPS (10^9 DP cells per second) and
+peak RSS are reported. for score_alignment, the "cells" are the columns
+of the alignments. each case runs in its own process so the memory is
+that of the case.
+
+the functions are global_align, global_align_no_matrix, global_score
+(the same DP as global_align, without the traceback), aligner (an
+Aligner for the first sequence of the pairs, with all of the second
+ones as targets), score_alignment and server, which sends the pairs to an nwserver (started in the case's
+process, with --processes workers) in BATCH requests; its memory includes
+the workers. the small sizes (10 and 40, the length of barcodes and
+short reads) mostly measure the cost of a call rather than the DP.
+
+with --json, the results and the versions they came from are written to
+that file; --compare reads the file from an earlier run (another release,
+say) and adds the ratio of the GCUPS of each case to the one in it.
+
+    $ python bench.py
+    $ python bench.py --sizes 5000,10000 --funcs global_align --alphabets protein
+    $ python bench.py --json new.json --compare old.json
+    $ python bench.py --matrix BLOSUM62 --split_min_len 1000000000  # scalar kernel
+"""
+import sys
+import os
+sys.path.insert(0, os.path.abspath("."))
+import time
+import random
+import resource
+import platform
+import threading
+import optparse
+import subprocess
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import numpy as np
+import nwalign as nw
+try:
+    from nwalign import cnwalign as impl
+except ImportError:
+    from nwalign import pairwise as impl
+
+FUNCS = ['global_align', 'global_align_no_matrix', 'global_score', 'aligner',
+         'score_alignment', 'server']
+
+ALPHABETS = {'dna': 'ACGT', 'protein': 'ACDEFGHIKLMNPQRSTVWY'}
+
+# the matrix for each alphabet when there's no --matrix. there's no
+# built-in matrix for DNA, so it's the +5/-4 of blastn.
+MATRICES = {'dna': 'DNA', 'protein': 'BLOSUM62'}
+DNA_MATRIX = np.zeros((256, 256), dtype=np.int8)
+for x in 'ACGT':
+    for y in 'ACGT':
+        DNA_MATRIX[ord(x), ord(y)] = 5 if x == y else -4
+nw.register_matrix("DNA", DNA_MATRIX)
+
+GAP_OPEN, GAP_EXTEND = -5, -1
+
+def random_pair(n, rng, alphabet):
+    """
+    a random sequence of length `n` and a copy with about 1 in 10 of its
+    letters substituted, inserted or deleted.
+    """
+    a = [rng.choice(alphabet) for i in xrange(n)]
+    b = list(a)
+    for _ in xrange(max(1, n // 10)):
+        i = rng.randint(0, len(b) - 1)
+        r = rng.random()
+        if r < 0.8:
+            b[i] = rng.choice(alphabet)
+        elif r < 0.9 or len(b) == 1:
+            b.insert(i, rng.choice(alphabet))
+        else:
+            del b[i]
+    return "".join(a), "".join(b)
+
+def n_pairs(n):
+    # enough pairs that a round isn't all call overhead.
+    return int(max(1, min(1000, 1e6 / (n * n))))
+
+def peak_rss():
+    """
+    the peak RSS in KB of this process and of its children that have
+    exited (the server's workers), whichever is larger.
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def _repeat(f, min_time):
+    """
+    call f() until min_time has passed; the number of calls and the time.
+    """
+    reps = 0
+    t = time.time()
+    while True:
+        f()
+        reps += 1
+        elapsed = time.time() - t
+        if elapsed >= min_time:
+            return reps, elapsed
+
+def run_one(func, alphabet, n, matrix=None, linear_threshold=None,
+            min_time=1.0, processes=None):
+    """
+    time one case in this process. `matrix` is the matrix name, or None
+    for global_align_no_matrix; it's needed by the others.
+    """
+    rng = random.Random(n)
+    pairs = [random_pair(n, rng, ALPHABETS[alphabet])
+             for _ in xrange(n_pairs(n))]
+    cells = sum(len(a) * len(b) for a, b in pairs)
+    params = dict(gap_open=GAP_OPEN, gap_extend=GAP_EXTEND,
+                  linear_threshold=linear_threshold)
+    if func == 'global_align':
+        def f():
+            for a, b in pairs:
+                nw.global_align(a, b, matrix=matrix, **params)
+    elif func == 'global_align_no_matrix':
+        def f():
+            for a, b in pairs:
+                nw.global_align_no_matrix(a, b, 1, **params)
+    elif func == 'global_score':
+        def f():
+            for a, b in pairs:
+                nw.global_score(a, b, matrix=matrix, gap_open=GAP_OPEN,
+                                gap_extend=GAP_EXTEND)
+    elif func == 'aligner':
+        aligner = nw.Aligner(pairs[0][0], matrix=matrix, gap_open=GAP_OPEN,
+                             gap_extend=GAP_EXTEND)
+        cells = sum(len(pairs[0][0]) * len(b) for a, b in pairs)
+        def f():
+            for a, b in pairs:
+                aligner.align(b)
+    elif func == 'score_alignment':
+        pairs = [nw.global_align(a, b, matrix=matrix, **params)
+                 for a, b in pairs]
+        cells = sum(len(a) for a, b in pairs)
+        def f():
+            for a, b in pairs:
+                nw.score_alignment(a, b, GAP_OPEN, GAP_EXTEND, matrix)
+    elif func == 'server':
+        from nwalign import nwserver
+        from nwalign.client import Client
+        server = nwserver.Server(port=0, processes=processes, cache_bytes=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        client = Client(*server.address)
+        def f():
+            for r in client.align_batch(pairs, ordered=False, matrix=matrix,
+                                        gap_open=GAP_OPEN,
+                                        gap_extend=GAP_EXTEND):
+                pass
+    else:
+        raise ValueError("unknown function: %r" % func)
+
+    rss0 = peak_rss()
+    try:
+        reps, t = _repeat(f, min_time)
+    finally:
+        if func == 'server':
+            client.shutdown()
+            thread.join()
+    rss = peak_rss()
+    return dict(func=func, alphabet=alphabet, n=n, matrix=matrix,
+                alignments=reps * len(pairs), seconds=round(t, 4),
+                gcups=cells * reps / t / 1e9, peak_rss_kb=rss,
+                delta_kb=rss - rss0)
+
+def cases(funcs, alphabets, sizes, matrix=None):
+    for func in funcs:
+        for alphabet in alphabets:
+            m = None if func == 'global_align_no_matrix' \
+                     else (matrix or MATRICES[alphabet])
+            for n in sizes:
+                yield func, alphabet, n, m
+
+def key(r):
+    return (r['func'], r['alphabet'], r['n'], r['matrix'])
+
+def meta():
+    try:
+        import pkg_resources
+        version = pkg_resources.get_distribution('nwalign').version
+    except Exception:
+        version = None
+    return dict(nwalign=version, implementation=impl.__name__.split(".")[-1],
+                python=platform.python_version(), numpy=np.__version__,
+                platform=platform.platform(), machine=platform.machine(),
+                time=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+def main():
+    parser = optparse.OptionParser(__doc__)
+    parser.add_option("--funcs", dest="funcs", default=",".join(FUNCS),
+                      help="comma-separated functions [%default]")
+    parser.add_option("--alphabets", dest="alphabets", default="dna,protein",
+                      help="comma-separated alphabets [%default]")
+    parser.add_option("--sizes", dest="sizes", default="10,40,100,1000,5000,20000",
+                      help="comma-separated sequence lengths [%default]")
+    parser.add_option("--matrix", dest="matrix", default=None,
+                      help="use this matrix for every alphabet")
+    parser.add_option("--min_time", dest="min_time", type="float", default=1.0,
+                      help="seconds to repeat each case for [%default]")
+    parser.add_option("--processes", dest="processes", type="int",
+                      default=None, help="server workers [cpu count]")
+    parser.add_option("--linear_threshold", dest="linear_threshold",
+                      type="int", default=None)
+    parser.add_option("--split_min_len", dest="split_min_len", type="int",
+                      default=None, help="set cnwalign.SPLIT_MIN_LEN")
+    parser.add_option("--json", dest="json", default=None,
+                      help="write the results to this file")
+    parser.add_option("--compare", dest="compare", default=None,
+                      help="the --json file of an earlier run to compare to")
+    parser.add_option("--one", dest="one", action="store_true", default=False,
+                      help="(internal) run a single case in this process")
+    options, args = parser.parse_args()
+    if options.split_min_len is not None:
+        impl.SPLIT_MIN_LEN = options.split_min_len
+
+    if options.one:
+        func, alphabet, n, matrix = args
+        print json.dumps(run_one(func, alphabet, int(n),
+                                 None if matrix == "-" else matrix,
+                                 options.linear_threshold, options.min_time,
+                                 options.processes))
+        return
+
+    old = {}
+    if options.compare:
+        old = dict((key(r), r) for r in json.load(open(options.compare))['results'])
+
+    results = []
+    print "%-22s %-8s %6s %-9s %10s %8s %12s %12s%s" % (
+        "func", "alphabet", "n", "matrix", "alignments", "GCUPS",
+        "peak_rss_kb", "delta_kb", " %8s" % "ratio" if old else "")
+    for func, alphabet, n, matrix in cases(
+            options.funcs.split(","), options.alphabets.split(","),
+            [int(n) for n in options.sizes.split(",")], options.matrix):
+        cmd = [sys.executable, os.path.abspath(__file__), "--one",
+               func, alphabet, str(n), matrix or "-",
+               "--min_time", str(options.min_time)]
+        for opt in ("processes", "linear_threshold", "split_min_len"):
+            if getattr(options, opt) is not None:
+                cmd.extend(["--" + opt, str(getattr(options, opt))])
+        out = subprocess.Popen(cmd, stdout=subprocess.PIPE).communicate()[0]
+        r = json.loads(out)
+        ratio = ""
+        if key(r) in old:
+            r['ratio'] = r['gcups'] / old[key(r)]['gcups']
+            ratio = " %8.2f" % r['ratio']
+        results.append(r)
+        print "%-22s %-8s %6i %-9s %10i %8.4f %12i %12i%s" % (
+            func, alphabet, n, matrix or "-", r['alignments'], r['gcups'],
+            r['peak_rss_kb'], r['delta_kb'], ratio)
+        sys.stdout.flush()
+
+    if options.json:
+        fh = open(options.json, "w")
+        json.dump(dict(meta=meta(), results=results), fh, indent=1,
+                  sort_keys=True)
+        fh.close()
+
+if __name__ == "__main__":
+    main()
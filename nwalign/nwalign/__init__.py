@@ -35,6 +35,16 @@ with specified penalties
     ASDFF
     AS-FF
 
+align every sequence of a FASTA file against every one of another (or
+each pair of a file with 2 sequences, or 2 record names, per line) on all
+cores; a tab-separated row of the score, identity (the fraction of the
+columns that match) and CIGAR is written for each pair, in order. with
+pyfasta installed, the FASTA files are memory-mapped.
+::
+
+    $ nwalign --matrix BLOSUM62 --query reads.fa --target refs.fa > hits.tsv
+    $ nwalign --pairs pairs.txt --threads 4
+
 
 Python Usage
 ============
@@ -51,9 +61,100 @@ Alignment
     ('CEELECANTH', '-PELICAN--')
 
 
-the `matrix` is specified as the full path to an `scoring matrix`_ as
-is distributed with the NCBI toolset or directly `here`_
-via a simple 
+the `matrix` is the name of a built-in `scoring matrix`_ (see
+`nwalign.matrices.builtin_matrices()`), the full path to one as is
+distributed with the NCBI toolset or directly `here`_, or a square array
+of scores indexed by the ord() of each character. the built-in matrices
+are stored as int8 .npy files and memory-mapped, so loading one is nearly
+free and processes share its pages. `register_matrix` gives a name to
+another matrix and `save_matrix` writes one in that format, so a path to
+it can be passed to worker processes.
+
+    >>> import numpy as np
+    >>> m = np.where(np.eye(256, dtype=bool), 2, -1)
+    >>> nw.global_align("CEELECANTH", "PELICAN", matrix=m)
+    ('CEELECANTH', 'P-ELICAN--')
+
+Similar Sequences
+-----------------
+with `band`, only the cells near the diagonal are filled: those within
+`band` diagonals (beyond the difference in length) of it, or
+`nwalign.cnwalign.BAND_MARGIN` if band is True. if the alignment reaches
+the edge of the band, the band is doubled and the alignment redone.
+::
+
+    >>> nw.global_align("CEELECANTH", "PELICAN", matrix='PAM250', band=True)
+    ('CEELECANTH', '-PELICAN--')
+
+Local and Semi-Global Alignment
+-------------------------------
+`semiglobal_align` doesn't charge for gaps at the ends of the sequences,
+for a read against a longer reference or 2 reads that overlap.
+`local_align` finds the best matching parts of the 2 sequences
+(smith-waterman) and also gives where they start and end.
+::
+
+    >>> nw.semiglobal_align("TTTTACGTACGT", "ACGTACGTGGGG")
+    ('TTTTACGTACGT----', '----ACGTACGTGGGG')
+    >>> nw.local_align("GGGGACGTACGTCC", "TTACGTACGTAA")
+    ('ACGTACGT', 'ACGTACGT', (4, 2), (12, 10))
+
+Edit Distance
+-------------
+with match=0 and gap_open == gap_extend (unit cost), the alignment is
+done 64 cells at a time with a bit-parallel kernel. `edit_distance` gives
+just the levenshtein distance.
+::
+
+    >>> nw.edit_distance("kitten", "sitting")
+    3
+    >>> nw.global_align("kitten", "sitting", match=0)
+    ('kitten-', 'sitting')
+
+Many Alignments
+---------------
+`align_many` aligns a sequence of pairs on a pool of threads (the DP runs
+without the GIL) or processes, and `align_all_vs_all` gives a matrix of
+scores (or distances) from the upper triangle of all pairs.
+::
+
+    >>> list(nw.align_many([("CEELECANTH", "PELICAN"), ("ACGT", "AGT")],
+    ...                    matrix='PAM250'))
+    [('CEELECANTH', '-PELICAN--'), ('ACGT', '-AGT')]
+
+`align_stream` gives (score, identity, cigar) instead and reads the pairs
+only as fast as they're aligned, so it can be fed from a generator over
+huge files. `align_files` does that for FASTA files (it's what the
+command line uses).
+
+One Query, Many Targets
+-----------------------
+an `Aligner` reads the matrix and builds a profile of the query (the
+matrix row for each position) once, so aligning it to each entry of a
+database costs less than a call to `global_align` per target.
+`align_many` runs it on a pool of threads; targets can be anything with
+a str(), e.g. the records of a pyfasta.Fasta.
+::
+
+    >>> a = nw.Aligner("PELICAN", matrix='PAM250')
+    >>> a.align("CEELECANTH")
+    ('-PELICAN--', 'CEELECANTH')
+    >>> list(a.align_many(["CEELECANTH", "PELICAN"], score_only=True))
+    [20, 37]
+
+Long Sequences
+--------------
+the traceback is stored in 2 bits per cell of the DP matrix, which has
+(len(a) + 1) * (len(b) + 1) cells, and the scores in 2 rows. above
+`nwalign.cnwalign.LINEAR_THRESHOLD` cells, only every sqrt(len)-th row is
+kept and the traceback is recomputed a block at a time, so memory is
+O(sqrt(n) * m). the alignment is identical; the threshold can be set per
+call:
+::
+
+    >>> nw.global_align("CEELECANTH", "PELICAN", matrix='PAM250',
+    ...                 linear_threshold=0)
+    ('CEELECANTH', '-PELICAN--')
 
 Scoring
 -------
@@ -69,9 +170,30 @@ and must have the same length.
     ...                     gap_extend=-2, matrix='PAM250')
     6
 
+if only the score is needed, `global_score` takes the same arguments as
+`global_align` and returns the score of the final cell of the DP without
+doing the traceback. it uses O(n) memory and releases the GIL.
+::
+
+    >>> nw.global_score('CEELECANTH', 'PELICAN', gap_open=-5,
+    ...                 gap_extend=-2, matrix='PAM250')
+    8
+
 
 """
-from cnwalign import global_align, global_align_no_matrix, score_alignment
+try:
+    from cnwalign import global_align, global_align_no_matrix, global_score, \
+            semiglobal_align, local_align, edit_distance, score_alignment, \
+            score_alignments, Aligner
+except ImportError:
+    # the extension isn't built, so use the numpy version, which gives the
+    # same results more slowly.
+    from pairwise import global_align, global_align_no_matrix, global_score, \
+            semiglobal_align, local_align, edit_distance, score_alignment, \
+            score_alignments, Aligner
+from batch import align_many, align_all_vs_all, align_stream, align_files
+from cache import AlignmentCache
+from matrices import load_matrix, register_matrix, save_matrix
 
 
 def main():
@@ -83,10 +205,24 @@ def main():
     parser.add_option("--gap_extend", dest="gap_extend", help="gap extend penalty (must be integer <= 0)", type="int", default=-1)
     parser.add_option("--gap_open", dest="gap_open", help="gap open penalty (must be integer <= 0)", type="int", default=-1)
     parser.add_option("--match", dest="match", help="match score (must be integer > 0)", type="int", default=1)
-    parser.add_option("--matrix", dest="matrix", help="scoring matrix in ncbi/data/ format,\
+    parser.add_option("--matrix", dest="matrix", help="name of a built-in scoring matrix or a path to one in ncbi/data/ format,\
                                       if not specificied, match/mismatch are used", default=None)
     parser.add_option("--server", dest="server", default=0, type='int',
                       help="if non-zero integer, a server is started")
+    parser.add_option("--processes", dest="processes", default=None, type='int',
+                      help="number of processes for the server (default: number of cpus)"
+                           " or for --query/--pairs (default: use threads)")
+    parser.add_option("--query", dest="query", default=None,
+                      help="a FASTA file of sequences to align to each in --target")
+    parser.add_option("--target", dest="target", default=None,
+                      help="a FASTA file of sequences (default: --query)")
+    parser.add_option("--pairs", dest="pairs", default=None,
+                      help="a file of pairs to align, 2 sequences per line, or "
+                           "the names of 2 records in --query and --target")
+    parser.add_option("--threads", dest="threads", default=None, type='int',
+                      help="number of threads for --query/--pairs (default: number of cpus)")
+    parser.add_option("--cache_mb", dest="cache_mb", default=64, type='int',
+                      help="MB of results the server caches (0 for no cache)")
 
     try:
         options, args = parser.parse_args()
@@ -94,8 +230,14 @@ def main():
         sys.exit(parser.print_help())
     if options.server != 0:
         import nwserver
-        nwserver.main(sys.argv[2])
-        
+        nwserver.main(options.server, options.processes,
+                      cache_bytes=options.cache_mb * 1024 * 1024)
+
+    elif options.query or options.pairs:
+        align_files(sys.stdout, options.query, options.target, options.pairs,
+                    match=options.match, gap_open=options.gap_open,
+                    gap_extend=options.gap_extend, matrix=options.matrix,
+                    threads=options.threads, processes=options.processes)
     elif len(args) != 2:
         sys.exit(parser.print_help())
     else:
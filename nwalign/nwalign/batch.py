@@ -0,0 +1,259 @@
+"""
+align many pairs of sequences at once on a pool of threads or processes.
+the DP loops in cnwalign run without the GIL, so a pool of threads is
+usually enough to use all cores; use `processes` to get a process pool
+instead.
+"""
+import sys
+import itertools
+import collections
+import numpy as np
+from multiprocessing import cpu_count, Pool
+from multiprocessing.pool import ThreadPool
+
+try:
+    from cnwalign import global_align, global_score, OP_MATCH, OP_INS, \
+            OP_DEL, _cigar
+except ImportError:
+    from pairwise import global_align, global_score, OP_MATCH, OP_INS, \
+            OP_DEL, _cigar
+from fasta import fasta_records, fasta_index
+
+__all__ = ['align_many', 'align_all_vs_all', 'aligner_many', 'align_stream',
+           'align_files']
+
+def _make_pool(threads, processes, initializer=None, initargs=()):
+    if processes:
+        return Pool(processes, initializer, initargs)
+    return ThreadPool(threads or cpu_count(), initializer, initargs)
+
+def _align_pair(args):
+    idx, a, b, score_only, kwargs = args
+    if score_only:
+        return idx, global_score(a, b, **kwargs)
+    return idx, global_align(a, b, **kwargs)
+
+def align_many(pairs, match=1, gap_open=-1, gap_extend=-1, matrix=None,
+               score_only=False, ordered=True, threads=None, processes=None,
+               chunksize=8):
+    """
+    align each (seqj, seqi) in `pairs` with global_align (or global_score
+    if `score_only`). yields the results in the order of `pairs`; if
+    `ordered` is False, yields (index, result) as each finishes.
+    `threads` (default: number of cpus) or `processes` sets the pool size.
+
+    >>> from nwalign import align_many
+    >>> pairs = [('COELANCANTH', 'PELICAN'), ('ACGT', 'AGT')]
+    >>> list(align_many(pairs))
+    [('COELANCANTH', '-PEL-ICAN--'), ('ACGT', 'A-GT')]
+    >>> list(align_many(pairs, score_only=True, threads=2))
+    [-1, 2]
+    >>> sorted(align_many(pairs, score_only=True, ordered=False))
+    [(0, -1), (1, 2)]
+
+    """
+    kwargs = dict(match=match, gap_open=gap_open, gap_extend=gap_extend,
+                  matrix=matrix)
+    jobs = ((i, a, b, score_only, kwargs) for i, (a, b) in enumerate(pairs))
+    pool = _make_pool(threads, processes)
+    try:
+        if ordered:
+            for idx, r in pool.imap(_align_pair, jobs, chunksize):
+                yield r
+        else:
+            for idx_r in pool.imap_unordered(_align_pair, jobs, chunksize):
+                yield idx_r
+    finally:
+        pool.terminate()
+
+def aligner_many(aligner, targets, score_only=False, ordered=True,
+                 threads=None, chunksize=8):
+    """
+    align_many for an Aligner: the query of `aligner` against each of
+    `targets` (which can be anything with a str(), so records from a
+    pyfasta.Fasta work too).
+    """
+    f = aligner.score if score_only else aligner.align
+    jobs = enumerate(targets)
+    pool = _make_pool(threads, None)
+    try:
+        if ordered:
+            for r in pool.imap(lambda (i, t): f(t), jobs, chunksize):
+                yield r
+        else:
+            for idx_r in pool.imap_unordered(lambda (i, t): (i, f(t)), jobs,
+                                             chunksize):
+                yield idx_r
+    finally:
+        pool.terminate()
+
+# set in each worker of a process pool by _init_seqs so the sequences are
+# only sent once.
+_SEQS = None
+
+def _init_seqs(seqs):
+    global _SEQS
+    _SEQS = seqs
+
+def _score_row(args, seqs=None):
+    i, kwargs = args
+    if seqs is None: seqs = _SEQS
+    a = seqs[i]
+    return i, np.array([global_score(a, seqs[j], **kwargs)
+                        for j in xrange(i, len(seqs))], dtype=np.int32)
+
+def align_all_vs_all(seqs, match=1, gap_open=-1, gap_extend=-1, matrix=None,
+                     distance=False, threads=None, processes=None):
+    """
+    global_score of every sequence in `seqs` against every other. only
+    the upper triangle (including the diagonal) is computed; the returned
+    int32 array has the score of seqs[i] vs seqs[j] (i <= j) at [i, j] and
+    at [j, i].
+    if `distance` is True, a float array of
+        (score[i, i] + score[j, j]) / 2 - score[i, j]
+    is returned instead, which is 0 on the diagonal.
+
+    >>> from nwalign import align_all_vs_all
+    >>> seqs = ['ACGT', 'AGT', 'ACGTT']
+    >>> align_all_vs_all(seqs, match=2)
+    array([[ 8,  5,  7],
+           [ 5,  6,  4],
+           [ 7,  4, 10]], dtype=int32)
+    >>> align_all_vs_all(seqs, match=2, distance=True)
+    array([[0., 2., 2.],
+           [2., 0., 4.],
+           [2., 4., 0.]])
+
+    """
+    seqs = [str(s) for s in seqs]
+    n = len(seqs)
+    kwargs = dict(match=match, gap_open=gap_open, gap_extend=gap_extend,
+                  matrix=matrix)
+    scores = np.empty((n, n), dtype=np.int32)
+    if processes:
+        pool = _make_pool(None, processes, _init_seqs, (seqs,))
+        f = _score_row
+    else:
+        pool = _make_pool(threads, None)
+        f = lambda args: _score_row(args, seqs)
+    try:
+        # rows get shorter as i increases, so hand them out one at a time.
+        for i, row in pool.imap_unordered(f, ((i, kwargs) for i in xrange(n))):
+            scores[i, i:] = row
+            scores[i:, i] = row
+    finally:
+        pool.terminate()
+    if not distance:
+        return scores
+    d = np.diag(scores).astype(np.float64)
+    return (d[:, None] + d[None, :]) / 2.0 - scores
+
+def _identity(ops, seqj, seqi):
+    """
+    the fraction of the columns of an alignment (given by its ops) that
+    pair identical characters.
+    """
+    if len(ops) == 0:
+        return 0.0
+    m = ops == OP_MATCH
+    pj = np.cumsum(ops != OP_INS)[m] - 1
+    pi = np.cumsum(ops != OP_DEL)[m] - 1
+    a = np.frombuffer(seqj, dtype=np.uint8)
+    b = np.frombuffer(seqi, dtype=np.uint8)
+    return (a[pj] == b[pi]).sum() / float(len(ops))
+
+def _align_chunk(args):
+    chunk, kwargs = args
+    rows = []
+    for a, b in chunk:
+        score, ops = global_align(a, b, output='ops', **kwargs)
+        rows.append((score, _identity(ops, a, b), _cigar(ops)))
+    return rows
+
+def align_stream(pairs, match=1, gap_open=-1, gap_extend=-1, matrix=None,
+                 threads=None, processes=None, chunksize=64, window=None):
+    """
+    align each (seqj, seqi) in `pairs` and yield (score, identity, cigar)
+    in the order of `pairs`, where identity is the fraction of the columns
+    of the alignment with the same character in both sequences.
+    unlike align_many, `pairs` is read only as the results are used: at
+    most `window` (default: twice the pool size) chunks of `chunksize`
+    pairs are in flight, so the memory used doesn't grow with the number
+    of pairs.
+
+    >>> from nwalign import align_stream
+    >>> pairs = [('COELANCANTH', 'PELICAN'), ('ACGT', 'AGT')]
+    >>> list(align_stream(pairs, chunksize=1))
+    [(-1, 0.45454545454545453, '1D3M1D4M2D'), (2, 0.75, '1M1D2M')]
+
+    """
+    kwargs = dict(match=match, gap_open=gap_open, gap_extend=gap_extend,
+                  matrix=matrix)
+    size = processes or threads or cpu_count()
+    window = window or 2 * size
+    pairs = ((str(a), str(b)) for a, b in pairs)
+    pool = _make_pool(threads, processes)
+    try:
+        sent = collections.deque()
+        while True:
+            while len(sent) < window:
+                chunk = list(itertools.islice(pairs, chunksize))
+                if not chunk: break
+                sent.append(pool.apply_async(_align_chunk, ((chunk, kwargs),)))
+            if not sent: break
+            for row in sent.popleft().get():
+                yield row
+    finally:
+        pool.terminate()
+
+def _pairs(query, target, pairs):
+    """
+    (name_j, name_i, seqj, seqi) for align_files.
+    """
+    if pairs is not None:
+        seqs_j = seqs_i = None
+        if query is not None:
+            seqs_j = fasta_index(query)
+            seqs_i = fasta_index(target) if target else seqs_j
+        for n, line in enumerate(open(pairs)):
+            toks = line.split()
+            if not toks or toks[0].startswith("#"): continue
+            if len(toks) != 2:
+                raise ValueError("line %i of %s doesn't have 2 columns"
+                                 % (n + 1, pairs))
+            if seqs_j is None:
+                yield str(n + 1), str(n + 1), toks[0], toks[1]
+            else:
+                yield toks[0], toks[1], seqs_j[toks[0]], seqs_i[toks[1]]
+        return
+    # the targets are read again for each query, so neither file needs to
+    # fit in memory.
+    for qname, qseq in fasta_records(query):
+        qseq = str(qseq)
+        for tname, tseq in fasta_records(target or query):
+            yield qname, tname, qseq, tseq
+
+def align_files(out=None, query=None, target=None, pairs=None,
+                **kwargs):
+    """
+    align each record in the FASTA file `query` against each in `target`
+    (default: `query`), or the pairs in the file `pairs`, and write a row
+    of
+        query target score identity cigar
+    separated by tabs to `out` (default: stdout) for each pair, in order. a line of `pairs`
+    has the names of 2 records in `query` and `target` or, if there is no
+    `query`, 2 sequences, which are named by their line number.
+    the other keyword arguments are those of align_stream. returns the
+    number of pairs.
+    """
+    if query is None and pairs is None:
+        raise ValueError("align_files needs query or pairs")
+    if out is None: out = sys.stdout
+    names, seqs = itertools.tee(_pairs(query, target, pairs))
+    n = 0
+    out.write("query\ttarget\tscore\tidentity\tcigar\n")
+    for (nj, ni, _, _), (score, identity, cigar) in itertools.izip(
+            names, align_stream(((a, b) for _, _, a, b in seqs), **kwargs)):
+        out.write("%s\t%s\t%i\t%.4f\t%s\n" % (nj, ni, score, identity, cigar))
+        n += 1
+    return n
@@ -0,0 +1,147 @@
+"""
+a cache of alignments keyed on a digest of the sequences and the scoring
+parameters, bounded by the bytes it holds and evicting the least recently
+used entries. it's used by nwserver and can wrap global_align (or any
+function with the same arguments) in-process.
+"""
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+try:
+    from cnwalign import global_align
+except ImportError:
+    from pairwise import global_align
+from matrices import load_matrix
+
+__all__ = ['AlignmentCache', 'cache_key']
+
+# the cost of an entry beyond the bytes of its value: the key, the dict
+# and list slots and the objects themselves.
+ENTRY_OVERHEAD = 200
+# the bytes counted for a value that isn't a string, array or tuple: a
+# score, or the None of an alignment that was cut off.
+SCALAR_SIZE = 16
+
+# returned by get() for a key that isn't there, as None can be cached.
+_MISSING = object()
+
+def cache_key(seqj, seqi, match=1, gap_open=-1, gap_extend=-1, matrix=None,
+              **kwargs):
+    """
+    the sha1 digest of the sequences and parameters (including any other
+    keyword arguments to the aligner).
+
+    >>> cache_key('ACGT', 'AGT') == cache_key(bytearray('ACGT'), 'AGT')
+    True
+    >>> cache_key('ACGT', 'AGT') == cache_key('AGT', 'ACGT')
+    False
+
+    """
+    if matrix is not None and not isinstance(matrix, basestring):
+        matrix = hashlib.sha1(load_matrix(matrix).tostring()).hexdigest()
+    h = hashlib.sha1(repr((len(seqj), len(seqi), match, gap_open, gap_extend,
+                           matrix, sorted(kwargs.items()))))
+    for s in (seqj, seqi):
+        try:
+            h.update(s)
+        except TypeError:
+            h.update(str(s))
+    return h.digest()
+
+def _nbytes(value):
+    if isinstance(value, (basestring, bytearray)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return SCALAR_SIZE
+
+def _size(value):
+    return _nbytes(value) + ENTRY_OVERHEAD
+
+
+class AlignmentCache(object):
+    """
+    an LRU cache holding at most `maxbytes` of results. calling it is the
+    same as calling `func` (global_align by default) but the result for a
+    given set of arguments is only computed once while it's in the cache.
+    that includes a None from min_score or xdrop, and the (score, cigar)
+    or (score, ops) of the other outputs.
+
+    >>> from nwalign.cache import AlignmentCache
+    >>> align = AlignmentCache(maxbytes=1 << 20)
+    >>> align('COELANCANTH', 'PELICAN')
+    ('COELANCANTH', '-PEL-ICAN--')
+    >>> align('COELANCANTH', 'PELICAN')
+    ('COELANCANTH', '-PEL-ICAN--')
+    >>> s = align.stats()
+    >>> s['hits'], s['misses'], s['entries']
+    (1, 1, 1)
+
+    """
+    def __init__(self, maxbytes=64 * 1024 * 1024, func=global_align):
+        self.maxbytes = maxbytes
+        self.func = func
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        """
+        the value for `key` (marking it as recently used) or `default`.
+        counts as a hit or miss.
+        """
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = _size(value)
+        if size > self.maxbytes: return
+        with self.lock:
+            old = self.data.pop(key, _MISSING)
+            if old is not _MISSING:
+                self.nbytes -= _size(old)
+            self.data[key] = value
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                k, v = self.data.popitem(last=False)
+                self.nbytes -= _size(v)
+                self.evictions += 1
+
+    def __call__(self, seqj, seqi, match=1, gap_open=-1, gap_extend=-1,
+                 matrix=None, **kwargs):
+        key = cache_key(seqj, seqi, match, gap_open, gap_extend, matrix,
+                        **kwargs)
+        r = self.get(key, _MISSING)
+        if r is _MISSING:
+            r = self.func(seqj, seqi, match, gap_open, gap_extend, matrix,
+                          **kwargs)
+            self.put(key, r)
+        return r
+
+    def stats(self):
+        """
+        a dict of the counts, size and hit-rate of the cache.
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.data),
+                'bytes': self.nbytes, 'maxbytes': self.maxbytes,
+                'hit_rate': self.hits / float(lookups) if lookups else None}
@@ -0,0 +1,167 @@
+"""
+a client for nwserver.
+
+    >>> from nwalign.client import Client
+    >>> c = Client(port=1233)                               # doctest: +SKIP
+    >>> c.align('COELANCANTH', 'PELICAN')                   # doctest: +SKIP
+    ('COELANCANTH', '-PEL-ICAN--')
+    >>> list(c.align_batch([('ACGT', 'AGT')], gap_open=-2)) # doctest: +SKIP
+    [('ACGT', 'A-GT')]
+
+"""
+import socket
+import collections
+import itertools
+
+from nwserver import frame, recv_frame
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+__all__ = ['Client', 'ServerError']
+
+class ServerError(Exception):
+    pass
+
+def _opts(params):
+    return " ".join("--%s %s" % (k, v) for k, v in sorted(params.iteritems())
+                                       if v is not None)
+
+def _result(data):
+    if data.startswith("ERROR:"):
+        raise ServerError(data[6:])
+    return tuple(data.split(" "))
+
+
+class Client(object):
+    """
+    a connection to an nwserver. the keyword arguments of align and
+    align_batch (match, gap_open, gap_extend, matrix) are the same as for
+    global_align; the matrix is a name or path on the server.
+    """
+    def __init__(self, host='localhost', port=1233, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # the number of requests from send() not yet read, and the
+        # responses that were read early (to get to a batch or stats).
+        self.unread = 0
+        self.early = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def _read_early(self):
+        while self.unread:
+            self.early.append(self._recv())
+            self.unread -= 1
+
+    def _recv(self):
+        data = recv_frame(self.sock)
+        if data is None:
+            raise ServerError("connection closed by the server")
+        return data
+
+    def send(self, seqj, seqi, **params):
+        """
+        send a request without waiting for the result; see `recv`. many
+        requests can be sent before the results are read.
+        """
+        opts = _opts(params)
+        self.sock.sendall(frame("%s %s %s" % (opts, seqj, seqi) if opts
+                                else "%s %s" % (seqj, seqi)))
+        self.unread += 1
+
+    def recv(self):
+        """
+        the alignment for the oldest request from `send`.
+        """
+        if self.early:
+            return _result(self.early.popleft())
+        self.unread -= 1
+        return _result(self._recv())
+
+    def align(self, seqj, seqi, **params):
+        self.send(seqj, seqi, **params)
+        return self.recv()
+
+    def align_batch(self, pairs, ordered=True, batch_size=1000, window=2,
+                    **params):
+        """
+        align each (seqj, seqi) in `pairs`, sent in BATCH requests of
+        `batch_size` pairs with up to `window` of them in flight. yields
+        the alignments in the order of `pairs`, or (index, alignment) as
+        they arrive if `ordered` is False. a ServerError is raised for a
+        pair that can't be aligned.
+        """
+        head = ("BATCH " + _opts(params)).rstrip()
+        pairs = iter(pairs)
+        # the start index of each batch that has been sent.
+        sent = collections.deque()
+        n = 0
+        error = None
+        # the batch being read, if its END hasn't been.
+        reading = False
+        try:
+            while error is None:
+                while len(sent) < window:
+                    chunk = ["%s %s" % p for p in itertools.islice(pairs, batch_size)]
+                    if not chunk: break
+                    self.sock.sendall(frame("\n".join([head] + chunk)))
+                    sent.append(n)
+                    n += len(chunk)
+                if not sent: break
+                self._read_early()
+                start = sent.popleft()
+                reading = True
+                results = {}
+                while True:
+                    data = self._recv()
+                    if data.startswith("END ") or data.startswith("ERROR:"):
+                        break
+                    i, r = data.split(" ", 1)
+                    if r.startswith("ERROR:"):
+                        error = error or r[6:]
+                    elif ordered:
+                        results[int(i)] = tuple(r.split(" "))
+                    else:
+                        yield start + int(i), tuple(r.split(" "))
+                reading = False
+                if data.startswith("ERROR:"):
+                    error = error or data[6:]
+                if error is None:
+                    for i in xrange(len(results)):
+                        yield results[i]
+        finally:
+            # read what's left so the connection stays in step if this
+            # stopped early.
+            if reading: self._skip_batch()
+            for _ in sent: self._skip_batch()
+        if error is not None:
+            raise ServerError(error)
+
+    def _skip_batch(self):
+        data = ""
+        while not (data.startswith("END ") or data.startswith("ERROR:")):
+            data = self._recv()
+
+    def stats(self):
+        """
+        the STATS of the server, as a dict.
+        """
+        self.sock.sendall(frame("STATS"))
+        self._read_early()
+        return json.loads(self._recv())
+
+    def shutdown(self):
+        """
+        stop the server.
+        """
+        self.sock.sendall(frame("EXIT"))
+        self.close()
@@ -3,12 +3,15 @@ cimport numpy as np
 
 
 cimport cython
+from cpython.buffer cimport PyObject_CheckBuffer, PyObject_GetBuffer, \
+        PyBuffer_Release, PyBUF_SIMPLE
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
 import sys
 import os.path
+from matrices import load_matrix
 
 cdef extern from "stdlib.h":
     ctypedef unsigned int size_t
-    size_t strlen(char *s)
 
 cdef extern from "Python.h":
     ctypedef void PyObject
@@ -16,78 +19,1372 @@ cdef extern from "Python.h":
     int _PyString_Resize(PyObject **, size_t)
     char * PyString_AS_STRING(PyObject *)
 
+cdef extern from "string.h":
+    void *memcpy(void *dest, void *src, size_t n) nogil
+
+cdef extern from "math.h":
+    double sqrt(double x) nogil
+
+cdef extern from *:
+    int __builtin_popcountll(unsigned long long x) nogil
+
 ctypedef np.int_t DTYPE_INT
 ctypedef np.uint_t DTYPE_UINT
 ctypedef np.int8_t DTYPE_BOOL
+ctypedef np.int32_t DTYPE_SCORE
+ctypedef np.uint8_t DTYPE_PTR
+ctypedef unsigned long long word_t
+
+# alignments with more than this many cells in the DP matrix are done
+# with the linear-memory (checkpointed) kernel. can be set per call with
+# the linear_threshold argument. at 2 bits per cell, the default is 64MB
+# of traceback pointers.
+LINEAR_THRESHOLD = 256 * 1024 * 1024
+
+# with a matrix, rows at least this long use the 2-pass (vectorized) row
+# kernel.
+SPLIT_MIN_LEN = 512
+
+# the number of diagonals on each side added to a band (beyond the
+# difference in length of the sequences) for band=True.
+BAND_MARGIN = 32
 
 cdef size_t UP = 1, LEFT = 2, DIAG = 3, NONE = 4
+# the pointer of a cell where a local alignment starts.
+cdef size_t STOP = 0
+
+# the kinds of alignment done by _align: end to end, with free gaps at the
+# ends of both sequences (semi-global) and local (smith-waterman).
+cdef enum:
+    GLOBAL, SEMIGLOBAL, LOCAL
+
+# the edit operations of output='ops': a match or mismatch, a character of
+# the second sequence against a gap (an insertion, relative to the first
+# sequence) and a character of the first against a gap (a deletion).
+OP_MATCH, OP_INS, OP_DEL = 0, 1, 2
+# the op for each traceback pointer (UP, LEFT, DIAG), when the first
+# sequence is along j and when it's along i.
+_OPS = np.array([255, OP_INS, OP_DEL, OP_MATCH], dtype=np.uint8)
+_OPS_FLIP = np.array([255, OP_DEL, OP_INS, OP_MATCH], dtype=np.uint8)
+_OUTPUTS = ('strings', 'cigar', 'ops')
+_NO_OPS = np.empty(0, dtype=np.uint8)
+# the score of cells outside a band. low enough to never be chosen, high
+# enough not to overflow when a gap penalty is added.
+cdef int NEG = -(1 << 28)
+
+cdef class _Seq:
+    """
+    the bytes of a sequence, held (without a copy) from any object with a
+    contiguous buffer of 1-byte items until the _Seq is released.
+    """
+    cdef Py_buffer view
+    cdef char *data
+    cdef size_t n
+    cdef object obj
+
+    def __dealloc__(self):
+        if self.obj is not None:
+            PyBuffer_Release(&self.view)
+
+cdef _Seq _seq(object s):
+    """
+    str, bytearray, memoryview, S1/uint8 arrays (like the memmaps of a
+    pyfasta NpyFastaRecord) are used as-is; other objects with an
+    __array_interface__ go through np.asarray and anything else through
+    str(). the length comes from the buffer, so NUL bytes are allowed.
+    """
+    cdef _Seq r = _Seq.__new__(_Seq)
+    if not PyObject_CheckBuffer(s):
+        s = np.asarray(s) if hasattr(s, '__array_interface__') else str(s)
+    if isinstance(s, np.ndarray):
+        if s.dtype.itemsize != 1:
+            raise ValueError("sequence arrays must have 1-byte items, not %s"
+                             % s.dtype)
+        if not s.flags.c_contiguous:
+            s = np.ascontiguousarray(s)
+    PyObject_GetBuffer(s, &r.view, PyBUF_SIMPLE)
+    r.obj = s
+    if r.view.itemsize != 1:
+        raise ValueError("sequence buffers must have 1-byte items")
+    r.data = <char *>r.view.buf
+    r.n = r.view.len
+    return r
 
 cdef inline int imax2(int a, int b):
     if a >= b: return a
     return b
 
+@cython.boundscheck(False)
+cdef inline int _score_row(unsigned char *al, unsigned char *bl, size_t l,
+                           int *mat, int gap_open, int gap_extend) nogil:
+    # without branches, as gaps are too irregular to predict.
+    cdef size_t i
+    cdef int score = 0, s, g, gap_started = 0
+    for i in range(l):
+        g = (al[i] == c"-") | (bl[i] == c"-")
+        s = mat[(<size_t>al[i] << 8) | bl[i]]
+        s += g * (gap_open + gap_started * (gap_extend - gap_open) - s)
+        score += s
+        gap_started = g
+    return score
+
 def score_alignment(a, b, int gap_open, int gap_extend, matrix):
-    cdef char *al = a
-    cdef char *bl = b
-    cdef size_t l = strlen(al), i 
-    cdef int score = 0, this_score
-    assert strlen(bl) == l, "alignment lengths must be the same"
-    cdef np.ndarray[DTYPE_INT, ndim=2] mat
-    mat = read_matrix(matrix)
+    cdef _Seq sa = _seq(a), sb = _seq(b)
+    assert sb.n == sa.n, "alignment lengths must be the same"
+    cdef np.ndarray mat = _matrix_table(matrix)
+    return _score_row(<unsigned char *>sa.data, <unsigned char *>sb.data,
+                      sa.n, <int *>mat.data, gap_open, gap_extend)
 
-    cdef bint gap_started = 0
+cdef inline bint _is_rows(x):
+    return isinstance(x, np.ndarray) and x.dtype.itemsize == 1
 
-    for i in range(l):
-        if al[i] == c"-" or bl[i] == c"-":
-            score += gap_extend if gap_started else gap_open
-            gap_started = 1
+cdef _rows(x):
+    """
+    a C-contiguous 2-D uint8 array of the aligned rows in array x.
+    """
+    rows = np.ascontiguousarray(x).view(np.uint8)
+    if rows.ndim == 1: rows = rows[None]
+    if rows.ndim != 2:
+        raise ValueError("aligned rows must be a 1-D or 2-D array")
+    return rows
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def score_alignments(a, b, int gap_open, int gap_extend, matrix):
+    """
+    score_alignment for many aligned pairs at once: a[k] vs b[k] for each
+    k, where `a` and `b` are lists of aligned strings or 2-D S1 (or uint8)
+    arrays with one row per alignment. if b is a single row (a string or
+    1-D array), every row of `a` is scored against it, as for the rows of
+    a multiple alignment vs a reference. returns an int32 array.
+
+    >>> from nwalign import score_alignments, score_alignment
+    >>> pairs = [('COELANCANTH', '-PEL-ICAN--'), ('CEELECANTH', '-PELICAN--')]
+    >>> a, b = zip(*pairs)
+    >>> score_alignments(a, b, -5, -2, 'PAM250')
+    array([ 7, 11], dtype=int32)
+    >>> [score_alignment(x, y, -5, -2, 'PAM250') for x, y in pairs]
+    [7, 11]
+    >>> msa = np.array([list('AC-GT'), list('ACCGT'), list('--CGT')], dtype='S1')
+    >>> score_alignments(msa, msa[1], -5, -2, 'BLOSUM62')
+    array([19, 33, 13], dtype=int32)
+
+    """
+    cdef np.ndarray mat = _matrix_table(matrix)
+    cdef int *pmat = <int *>mat.data
+    cdef np.ndarray[DTYPE_SCORE, ndim=1] scores
+    cdef np.ndarray[np.uint8_t, ndim=2] x, y
+    cdef size_t n, k, L, xs, ys
+    cdef unsigned char *px
+    cdef unsigned char *py
+    cdef _Seq sa, sb
+    if _is_rows(a) and _is_rows(b):
+        # all the rows have the same length, so they're done without the GIL.
+        x = _rows(a)
+        y = _rows(b)
+        L = x.shape[1]
+        n = max(x.shape[0], y.shape[0])
+        if x.shape[0] != y.shape[0] and 1 not in (x.shape[0], y.shape[0]):
+            raise ValueError("a and b must have the same number of rows")
+        assert y.shape[1] == L, "alignment lengths must be the same"
+        # a single row is used for every alignment.
+        xs = L if x.shape[0] > 1 else 0
+        ys = L if y.shape[0] > 1 else 0
+        scores = np.empty(n, dtype=np.int32)
+        px = <unsigned char *>x.data
+        py = <unsigned char *>y.data
+        with nogil:
+            for k in range(n):
+                scores[k] = _score_row(px + k * xs, py + k * ys, L, pmat,
+                                       gap_open, gap_extend)
+        return scores
+
+    cdef bint one = isinstance(b, basestring) or _is_rows(b) and b.ndim == 1
+    if one:
+        sb = _seq(b)
+    elif len(b) != len(a):
+        raise ValueError("a and b must have the same number of rows")
+    n = len(a)
+    scores = np.empty(n, dtype=np.int32)
+    for k in range(n):
+        sa = _seq(a[k])
+        if not one:
+            sb = _seq(b[k])
+        assert sa.n == sb.n, "alignment lengths must be the same"
+        scores[k] = _score_row(<unsigned char *>sa.data,
+                               <unsigned char *>sb.data, sa.n, pmat,
+                               gap_open, gap_extend)
+    return scores
+
+
+cdef _table(np.ndarray amatrix):
+    """
+    copy a 256 x 256 matrix from load_matrix into an int32 array, which
+    is what the DP loops read.
+    """
+    return amatrix.astype(np.int32)
+
+cdef tuple _matrix_entry(matrix, dict cache={}):
+    """
+    the _table for `matrix` (see nwalign.matrices.load_matrix) and the best
+    score of each character (the max of each row), which the cutoffs need.
+    cached by name or path, as they're used for every alignment. for an
+    array, the row maxes are None: they're only found if there is a
+    cutoff (see _make_cutoff).
+    """
+    m = load_matrix(matrix)
+    if not isinstance(matrix, basestring):
+        return _table(m), None
+    r = cache.get(matrix)
+    # a name can be given a new matrix with register_matrix.
+    if r is None or r[0] is not m:
+        t = _table(m)
+        r = cache[matrix] = (m, t, _row_max(t))
+    return r[1], r[2]
+
+cdef inline _row_max(np.ndarray table):
+    return np.ascontiguousarray(table.max(axis=1), dtype=np.int32)
+
+cdef inline _matrix_table(matrix):
+    return _matrix_entry(matrix)[0]
+
+cdef inline unsigned char _pick(int d, int u, int l, int tie_left,
+                                int tie_up, int *score) nogil:
+    """
+    the choice made by _row_matrix for a cell with diag, up and left scores
+    d, u and l. the score goes in `score`. this is done with arithmetic on
+    the comparisons instead of branches, which are hard to predict here.
+    """
+    cdef int eq_l = d == l, eq_u = d == u
+    cdef int m = d if d > u else u
+    m = m if m > l else l
+    score[0] = m + (eq_l | eq_u) * (d - m)
+    # UP is 1, LEFT 2, DIAG 3.
+    cdef int p_up = 2 - (u > l)
+    cdef int p_diag = 3 - (l > d)
+    cdef int p = p_diag + (u > d) * (p_up - p_diag)
+    p += eq_u * (tie_up - p)
+    p += eq_l * (tie_left - p)
+    return p
+
+cdef inline int _row_matrix(int *prev, int *cur, unsigned char *ptr,
+                            char *seqj, size_t max_j, int *mrow, size_t i,
+                            size_t max_i, int agap_prev, int gap_open,
+                            int gap_extend, size_t j0, size_t j1,
+                            int col0) nogil:
+    """
+    fill columns j0 .. j1 of row i of the DP for global_align given row
+    i - 1 in prev. `mrow` is the row of the scoring table for seqi[i - 1].
+    returns the gap flag for the row: 0 if any cell in it took the diagonal.
+    the cells just outside j0 .. j1 are set to NEG (unless j0 is 1, then
+    cur[0] is the first column, with score col0, see _col0) so a band can
+    be filled one row at a time.
+    this must make exactly the same choices as the loop in global_align.
+    """
+    cdef size_t j
+    cdef int diag_score, up_score, left_score, agap = 1
+    cdef int up_gap = gap_open if agap_prev == 0 else gap_extend
+    if j0 == 1:
+        cur[0] = col0
+        ptr[0] = UP
+    else:
+        cur[j0 - 1] = NEG
+    if j1 < max_j:
+        cur[j1 + 1] = NEG
+    cdef int tie_left = LEFT if (i == max_i or i == 1) else DIAG
+    cdef int p
+    for j in range(j0, j1 + 1):
+        p = _pick(prev[j - 1] + mrow[<unsigned char>seqj[j - 1]], prev[j] + up_gap,
+                  cur[j - 1] + (gap_open if j == 1 else gap_extend), tie_left,
+                  UP if (j == 1 or j == max_j) else DIAG, cur + j)
+        ptr[j] = p
+        agap &= p != DIAG
+    return agap
+
+cdef inline int _row_matrix_split(int *prev, int *cur, unsigned char *ptr,
+                                  size_t max_j, np.int16_t *prow, int *diag,
+                                  int *up,
+                                  size_t i, size_t max_i, int agap_prev,
+                                  int gap_open, int gap_extend,
+                                  int col0) nogil:
+    """
+    the same as _row_matrix (for the whole row), in 2 passes. the first has
+    no dependencies between cells, so the compiler vectorizes it: the diag
+    and up scores of every cell, using `prow`, the query profile for
+    seqi[i - 1] (prow[j] is the score of seqi[i - 1] vs seqj[j - 1]).
+    the second is a scalar scan that adds the left score and picks the
+    pointer. diag and up are scratch rows.
+    """
+    cdef size_t j
+    cdef unsigned char p
+    cdef int agap = 1
+    cdef int up_gap = gap_open if agap_prev == 0 else gap_extend
+    # on a tie with diag, the first and last rows take left and the first
+    # and last columns take up.
+    cdef unsigned char tie_left = LEFT if (i == max_i or i == 1) else DIAG
+    for j in range(1, max_j + 1):
+        diag[j] = prev[j - 1] + prow[j]
+        up[j] = prev[j] + up_gap
+
+    cdef int v = col0
+    cur[0] = v
+    ptr[0] = UP
+    if max_j == 0:
+        return agap
+    # the score of the cell to the left stays in v. the first and last
+    # columns are done outside the loop so it has no special cases.
+    p = _pick(diag[1], up[1], v + gap_open, tie_left, UP, &v)
+    cur[1] = v
+    ptr[1] = p
+    agap &= p != DIAG
+    for j in range(2, max_j):
+        p = _pick(diag[j], up[j], v + gap_extend, tie_left, DIAG, &v)
+        cur[j] = v
+        ptr[j] = p
+        agap &= p != DIAG
+    if max_j > 1:
+        p = _pick(diag[max_j], up[max_j], v + gap_extend, tie_left, UP, &v)
+        cur[max_j] = v
+        ptr[max_j] = p
+        agap &= p != DIAG
+    return agap
+
+cdef inline int _row_no_matrix(int *prev, int *cur, unsigned char *ptr,
+                               char *seqj, size_t max_j, char ci, size_t i,
+                               int match, int agap_prev, int gap_open,
+                               int gap_extend, size_t j0, size_t j1,
+                               int col0) nogil:
+    """
+    fill columns j0 .. j1 of row i of the DP for global_align_no_matrix.
+    see _row_matrix.
+    """
+    cdef size_t j
+    cdef int diag_score, up_score, left_score, agap = 1
+    # agap_j is the gap flag of the cell to the left. a cell outside a
+    # band gets whichever flag makes a mismatch next to it cost more.
+    cdef int agap_j = 0 if j0 == 1 else <int>(gap_extend < gap_open)
+    cdef int up_gap = gap_extend if agap_prev == 1 else gap_open
+    if j0 == 1:
+        cur[0] = col0
+        ptr[0] = UP
+    else:
+        cur[j0 - 1] = NEG
+    if j1 < max_j:
+        cur[j1 + 1] = NEG
+    for j in range(j0, j1 + 1):
+        if seqj[j - 1] == ci:
+            diag_score = prev[j - 1] + match
         else:
-            this_score = mat[al[i], bl[i]]
-            score += this_score
-            gap_started = 0
+            diag_score = prev[j - 1] + \
+                    (gap_extend if (agap_prev == 1 and agap_j == 1) else gap_open)
+        up_score   = prev[j] + up_gap
+        left_score = cur[j - 1] + (gap_extend if agap_j == 1 else gap_open)
+
+        if diag_score >= up_score and diag_score >= left_score:
+            cur[j] = diag_score
+            ptr[j] = DIAG
+            agap = 0
+            agap_j = 0
+        else:
+            agap_j = 1
+            if diag_score < up_score and up_score >= left_score:
+                cur[j] = up_score
+                ptr[j] = UP
+            else:
+                cur[j] = left_score
+                ptr[j] = LEFT
+    return agap
+
+cdef struct Cutoff:
+    # stop once no path from the current row can reach min_score.
+    bint use_min
+    int min_score
+    # stop once the best score in a row is more than xdrop below the best
+    # of an earlier row.
+    bint use_xdrop
+    int xdrop
+    int best
+    # the most a diagonal step and a gap step can add to a score.
+    int smax
+    int gmax
+    # suffix[i]: the most rows i + 1 .. max_i can add (see _suffix_bound).
+    int *suffix
+    # the best score of each character in the table, if it's known.
+    int *row_max
+
+# rows between checks of the min_score and xdrop cutoffs.
+cdef size_t CUTOFF_EVERY = 8
+
+cdef bint _make_cutoff(Cutoff *c, object min_score, object xdrop,
+                       object table, int match, int gap_open, int gap_extend,
+                       np.ndarray row_max=None):
+    """
+    fill `c` and return whether there is any cutoff to check. `row_max`
+    is the best score of each character in `table`, if it's known (see
+    _matrix_entry); it must be kept while c is used.
+    """
+    c.use_min = min_score is not None
+    c.min_score = min_score if c.use_min else 0
+    c.use_xdrop = xdrop is not None
+    c.xdrop = xdrop if c.use_xdrop else 0
+    assert c.xdrop >= 0, "xdrop must be >= 0"
+    c.best = NEG
+    c.suffix = NULL
+    c.row_max = NULL
+    if not (c.use_min or c.use_xdrop):
+        return 0
+    c.gmax = max(gap_open, gap_extend)
+    # without a matrix, a mismatch costs a gap penalty.
+    if table is None:
+        c.smax = max(match, c.gmax)
+    elif row_max is None:
+        c.smax = table.max()
+    else:
+        c.smax = row_max.max()
+        c.row_max = <int *>row_max.data
+    return 1
+
+cdef np.ndarray _suffix_bound(Cutoff *c, char *seqi, size_t max_i,
+                              object table, int match):
+    """
+    set c.suffix from the best score of each character of seqi: a step
+    into row k adds at most max(best score of seqi[k - 1], gmax). returns
+    the array, which must be kept while c is used.
+    """
+    cdef size_t k
+    cdef np.ndarray[DTYPE_SCORE, ndim=1] rbest
+    si = np.frombuffer(seqi[:max_i], dtype=np.uint8)
+    if c.row_max != NULL:
+        rbest = np.empty(max_i, dtype=np.int32)
+        for k in range(max_i):
+            rbest[k] = c.row_max[<unsigned char>seqi[k]]
+        best = rbest
+    elif table is not None:
+        best = np.asarray(table).max(axis=1)[si]
+    else:
+        best = np.empty(max_i, dtype=np.int32)
+        best[:] = match
+    cdef np.ndarray[DTYPE_SCORE, ndim=1] suffix = np.zeros(max_i + 1, dtype=np.int32)
+    suffix[:max_i] = np.maximum(best, c.gmax)[::-1].cumsum()[::-1]
+    c.suffix = <int *>suffix.data
+    return suffix
+
+cdef inline bint _cut(Cutoff *c, int *row, size_t j0, size_t j1,
+                      size_t max_j, size_t i, size_t max_i) nogil:
+    """
+    whether the DP can stop after row i (with scores in row[j0..j1]). every
+    step adds a diagonal score <= smax or a gap penalty <= gmax <= 0, so the
+    best a path through (i, j) can end with is row[j] plus the best mix of
+    min(di, dj) diagonal steps and the gaps that are left, and at most
+    suffix[i] plus a gap for each column beyond di.
+    """
+    cdef size_t j, di = max_i - i, dj, m
+    cdef int v, v2, bound, best = NEG, row_max = NEG
+    for j in range(j0, j1 + 1):
+        v = row[j]
+        if v > row_max: row_max = v
+        if c.use_min and best < c.min_score:
+            dj = max_j - j
+            m = di if di < dj else dj
+            bound = c.smax * <int>m + c.gmax * <int>(di + dj - 2 * m)
+            if c.gmax * <int>(di + dj) > bound:
+                bound = c.gmax * <int>(di + dj)
+            if c.suffix != NULL:
+                v2 = c.suffix[i] + (c.gmax * <int>(dj - di) if dj > di else 0)
+                if v2 < bound: bound = v2
+            if v + bound > best: best = v + bound
+        elif not c.use_xdrop:
+            break
+    if c.use_min and best < c.min_score:
+        return 1
+    if c.use_xdrop:
+        if row_max > c.best:
+            c.best = row_max
+        elif row_max < c.best - c.xdrop:
+            return 1
+    return 0
+
+cdef inline int _col0(size_t i, int gap_open, int gap_extend,
+                      bint use_matrix, int mode) nogil:
+    """
+    the score of the cell in column 0 of row i (or row 0 of column i): a
+    gap of i. end gaps are free, except in a global alignment.
+    """
+    if mode != GLOBAL or i == 0:
+        return 0
+    if use_matrix:
+        return gap_open + gap_extend * <int>(i - 1)
+    return gap_open * <int>i
+
+cdef inline void _init_row(int *row, size_t max_j, int gap_open,
+                           int gap_extend, bint use_matrix,
+                           int mode=GLOBAL) nogil:
+    cdef size_t j
+    for j in range(max_j + 1):
+        row[j] = _col0(j, gap_open, gap_extend, use_matrix, mode)
+
+cdef inline bint _use_linear(size_t max_i, size_t max_j, object linear_threshold):
+    if linear_threshold is None:
+        linear_threshold = LINEAR_THRESHOLD
+    return (max_i + 1) * (max_j + 1) > linear_threshold
+
+cdef inline void _pack_row(unsigned char *ptr, unsigned char *packed,
+                           size_t n) nogil:
+    """
+    pack n 2-bit pointer codes (UP, LEFT, DIAG) from ptr, 4 to a byte.
+    ptr must be zero-padded to a multiple of 4.
+    """
+    cdef size_t b
+    for b in range((n + 3) >> 2):
+        packed[b] = ptr[4 * b] | (ptr[4 * b + 1] << 2) | \
+                    (ptr[4 * b + 2] << 4) | (ptr[4 * b + 3] << 6)
+
+cdef _profile(np.ndarray table, char *seqj, size_t max_j):
+    """
+    the query profile for _row_matrix_split: for each character c in the
+    matrix, an int16 row with the score of c against each character of seqj
+    (offset by 1 to line up with the DP columns). the last row is all 0 for
+    characters not in the matrix. returns the profile and an array that
+    gives the row of the profile for each character, or None if the matrix
+    values don't fit in 16 bits.
+    """
+    if table.min() < -32768 or table.max() > 32767:
+        return None
+    sj = np.frombuffer(seqj[:max_j], dtype=np.uint8)
+    chars = np.flatnonzero((table != 0).any(axis=1))
+    index = np.empty((256,), dtype=np.int32)
+    index[:] = len(chars)
+    index[chars] = np.arange(len(chars), dtype=np.int32)
+    prof = np.zeros((len(chars) + 1, max_j + 1), dtype=np.int16)
+    prof[:len(chars), 1:] = table[chars][:, sj]
+    return prof, index
+
+cdef inline bint _use_split(bint use_matrix, size_t max_j):
+    return use_matrix and max_j >= SPLIT_MIN_LEN
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _strings(np.ndarray ops, char *seqj, char *seqi):
+    """
+    the aligned strings for the pointers of a traceback, which go from the
+    end of the alignment back to the start.
+    """
+    cdef size_t n = ops.shape[0], k, i = 0, j = 0
+    cdef unsigned char *p = <unsigned char *>ops.data
+    cdef unsigned char c
+    aj = PyBytes_FromStringAndSize(NULL, n)
+    ai = PyBytes_FromStringAndSize(NULL, n)
+    cdef char *a = PyBytes_AS_STRING(aj)
+    cdef char *b = PyBytes_AS_STRING(ai)
+    with nogil:
+        for k in range(n):
+            c = p[n - 1 - k]
+            if c == UP:
+                a[k] = c"-"
+            else:
+                a[k] = seqj[j]
+                j += 1
+            if c == LEFT:
+                b[k] = c"-"
+            else:
+                b[k] = seqi[i]
+                i += 1
+    return aj, ai
+
+def _cigar(np.ndarray ops):
+    """
+    the run-length CIGAR string of an array of ops.
+
+    >>> _cigar(np.array([0, 0, 1, 0, 2, 2], dtype=np.uint8))
+    '2M1I1M2D'
+
+    """
+    if len(ops) == 0:
+        return ""
+    starts = np.flatnonzero(ops[1:] != ops[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, len(ops)))
+    return "".join(["%i%s" % (n, "MID"[o]) for n, o
+                                          in zip(lengths, ops[starts])])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _rescore(np.ndarray ops, char *seqj, char *seqi, bint flip,
+                  int *mat, int gap_open, int gap_extend):
+    """
+    score_alignment of the aligned strings for the pointers of a traceback,
+    without building them.
+    """
+    cdef size_t n = ops.shape[0], k, i = 0, j = 0
+    cdef unsigned char *p = <unsigned char *>ops.data
+    cdef unsigned char c, x, y
+    cdef int score = 0, s, g, gap_started = 0
+    with nogil:
+        for k in range(n):
+            c = p[n - 1 - k]
+            if c == UP:
+                x = c"-"
+            else:
+                x = seqj[j]
+                j += 1
+            if c == LEFT:
+                y = c"-"
+            else:
+                y = seqi[i]
+                i += 1
+            if flip:
+                x, y = y, x
+            g = (x == c"-") | (y == c"-")
+            s = mat[(<size_t>x << 8) | y]
+            s += g * (gap_open + gap_started * (gap_extend - gap_open) - s)
+            score += s
+            gap_started = g
     return score
 
+cdef _output(object r, char *seqj, char *seqi, bint flip, object output,
+             np.ndarray table=None, int gap_open=0, int gap_extend=0):
+    """
+    the result of global_align from the (pointers, score) of a traceback
+    of seqj (along j) and seqi. if `flip`, seqj is the second sequence.
+    with a `table`, the score of cigar and ops output is that of
+    score_alignment for the alignment, not the DP score.
+    """
+    if r is None:
+        return None
+    ptrs, score = r
+    if output == 'strings':
+        aj, ai = _strings(ptrs, seqj, seqi)
+        return (ai, aj) if flip else (aj, ai)
+    if table is not None:
+        score = _rescore(ptrs, seqj, seqi, flip, <int *>table.data,
+                         gap_open, gap_extend)
+    ops = (_OPS_FLIP if flip else _OPS)[ptrs[::-1]]
+    if output == 'ops':
+        return score, ops
+    return score, _cigar(ops)
+
+cdef inline _check_output(object output):
+    if output not in _OUTPUTS:
+        raise ValueError("output must be one of %s, not %r" % (
+                         ", ".join(_OUTPUTS), output))
+
+cdef inline int _row(int *prev, int *cur, unsigned char *ptr, char *seqj,
+                     size_t max_j, char ci, size_t i, size_t max_i,
+                     int agap_prev, int *tab, np.int16_t *pprof, int *pindex,
+                     int *pdiag, int match, int gap_open, int gap_extend,
+                     int col0) nogil:
+    """
+    fill all of row i (for the character ci of seqi) with the split kernel
+    if there is a profile, _row_matrix if there is a table, or else
+    _row_no_matrix. returns the gap flag of the row.
+    """
+    cdef size_t W = max_j + 1
+    if pprof != NULL:
+        return _row_matrix_split(prev, cur, ptr, max_j,
+                                 pprof + W * pindex[<unsigned char>ci],
+                                 pdiag, pdiag + W, i, max_i, agap_prev,
+                                 gap_open, gap_extend, col0)
+    if tab != NULL:
+        return _row_matrix(prev, cur, ptr, seqj, max_j,
+                           tab + 256 * <unsigned char>ci, i, max_i,
+                           agap_prev, gap_open, gap_extend, 1, max_j, col0)
+    return _row_no_matrix(prev, cur, ptr, seqj, max_j, ci, i, match,
+                          agap_prev, gap_open, gap_extend, 1, max_j, col0)
+
+cdef inline int _pick_score(int d, int u, int l, int tie_left_diag,
+                            int tie_up_diag, int *took_diag) nogil:
+    """
+    the score _pick gives a cell, without the pointer: `took_diag` is set
+    to whether the pointer would be DIAG. tie_left_diag and tie_up_diag
+    are whether the ties of _pick go to DIAG.
+    """
+    cdef int eq_l = d == l, eq_u = d == u
+    cdef int m = d if d > u else u
+    m = m if m > l else l
+    cdef int t = (d > u) & (d > l)
+    t += eq_u * (tie_up_diag - t)
+    t += eq_l * (tie_left_diag - t)
+    took_diag[0] = t
+    return m + (eq_l | eq_u) * (d - m)
+
+cdef inline int _row_score_matrix(int *prev, int *cur, char *seqj,
+                                  size_t max_j, int *mrow, np.int16_t *prow,
+                                  int *diag, size_t i, size_t max_i,
+                                  int agap_prev, int gap_open, int gap_extend,
+                                  int col0) nogil:
+    """
+    the scores and gap flag of row i as _row_matrix (or, with the profile
+    row `prow`, _row_matrix_split) gives them, for global_score. no
+    pointers are kept, so there's nothing to write but the row of scores.
+    with a profile, the diag scores are done first, in a loop the compiler
+    vectorizes, into the scratch row `diag`.
+    """
+    cdef size_t j
+    cdef int v = col0, t, took = 0
+    cdef int up_gap = gap_open if agap_prev == 0 else gap_extend
+    cdef int tie_left_diag = not (i == max_i or i == 1)
+    cur[0] = v
+    if max_j == 0:
+        return 1
+    if prow != NULL:
+        for j in range(1, max_j + 1):
+            diag[j] = prev[j - 1] + prow[j]
+    else:
+        for j in range(1, max_j + 1):
+            diag[j] = prev[j - 1] + mrow[<unsigned char>seqj[j - 1]]
+    # the first and last columns are done outside the loop, as in
+    # _row_matrix_split.
+    v = _pick_score(diag[1], prev[1] + up_gap, v + gap_open, tie_left_diag,
+                    0, &t)
+    cur[1] = v
+    took |= t
+    for j in range(2, max_j):
+        v = _pick_score(diag[j], prev[j] + up_gap, v + gap_extend,
+                        tie_left_diag, 1, &t)
+        cur[j] = v
+        took |= t
+    if max_j > 1:
+        v = _pick_score(diag[max_j], prev[max_j] + up_gap, v + gap_extend,
+                        tie_left_diag, 0, &t)
+        cur[max_j] = v
+        took |= t
+    return not took
+
+cdef inline int _row_score_no_matrix(int *prev, int *cur, char *seqj,
+                                     size_t max_j, char ci, int match,
+                                     int agap_prev, int gap_open,
+                                     int gap_extend, int col0) nogil:
+    """
+    the scores and gap flag of row i as _row_no_matrix gives them, without
+    the pointers, for global_score. a cell that doesn't take the diagonal
+    gets the larger of up and left, so the score is the max of the 3 and
+    the loop has no branches.
+    """
+    cdef size_t j
+    cdef int d, u, l, mis, t, agap = 1, agap_j = 0
+    cdef int up_gap = gap_extend if agap_prev == 1 else gap_open
+    cdef int v = col0
+    cur[0] = v
+    for j in range(1, max_j + 1):
+        mis = gap_open + (agap_prev & agap_j) * (gap_extend - gap_open)
+        d = prev[j - 1] + mis + (seqj[j - 1] == ci) * (match - mis)
+        u = prev[j] + up_gap
+        l = v + gap_open + agap_j * (gap_extend - gap_open)
+        t = (d >= u) & (d >= l)
+        v = d if d > u else u
+        v = v if v > l else l
+        cur[j] = v
+        agap &= 1 - t
+        agap_j = 1 - t
+    return agap
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _align(char *seqj, char *seqi, size_t max_j, size_t max_i,
+            object table, int match, int gap_open, int gap_extend,
+            bint linear, object profile=None, Cutoff *cut=NULL,
+            int mode=GLOBAL):
+    """
+    the DP and traceback for global_align and global_align_no_matrix.
+    if table is None, the scoring is that of global_align_no_matrix.
+    `profile` is the query profile of seqj from _profile, if it's already
+    been made.
+    scores are kept in rolling int32 rows and the traceback pointers are
+    packed 2 bits per cell.
+    if `linear`, memory is O(sqrt(max_i) * max_j) and the alignment is
+    exactly the same. the gap flags in these kernels depend on whole rows,
+    so the alignment can not be split Hirschberg-style. instead, the forward
+    pass keeps only every k-th row of scores (and the per-row gap flag),
+    then the traceback recomputes the pointers for one block of k rows at a
+    time, from the nearest saved row, as it walks up the matrix. otherwise
+    there is a single block of max_i rows and nothing is recomputed.
+    with mode=SEMIGLOBAL, the first row and column score 0 and the
+    alignment ends at the best cell of the last row or column (the last
+    cell if it's as good as any), followed by the gaps to the end.
+    returns the pointers of the traceback (see _output) and the score, or
+    None if the DP was stopped by `cut` or the final score is below its
+    min_score.
+    """
+    cdef bint use_matrix = table is not None
+    cdef bint stopped = 0
+    cdef int final, col_best = 0
+    cdef size_t k = max(1, <size_t>sqrt(<double>max_i) if linear else max_i)
+    cdef size_t W = max_j + 1
+    # bytes per row of packed pointers.
+    cdef size_t PW = (W + 3) >> 2
+    cdef size_t i, j, r, b, blk, blk_end, seqlen, align_counter = 0
+    # the cell the traceback starts from, and the row of the best cell of
+    # the last column.
+    cdef size_t end_i = max_i, end_j = max_j, col_i = 0
+    cdef unsigned char p
+    cdef int *prev
+    cdef int *cur
+    cdef int *tab = NULL
+
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] checkpoints = np.empty((max_i // k + 1, W), dtype=np.int32)
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] rows = np.empty((2, W), dtype=np.int32)
+    cdef np.ndarray[DTYPE_PTR, ndim=1] scratch = np.zeros((4 * PW,), dtype=np.uint8)
+    cdef np.ndarray[DTYPE_PTR, ndim=2] block = np.empty((k, PW), dtype=np.uint8)
+    cdef np.ndarray[DTYPE_BOOL, ndim=1] agap_i = np.ones((max_i + 1,), dtype=np.int8)
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] atable
+    if use_matrix:
+        atable = table
+        tab = <int *>atable.data
+    cdef int *pcheck = <int *>checkpoints.data
+    cdef int *prows = <int *>rows.data
+    cdef unsigned char *pscratch = <unsigned char *>scratch.data
+    cdef unsigned char *pblock = <unsigned char *>block.data
+    cdef np.int8_t *agap = <np.int8_t *>agap_i.data
+
+    cdef np.ndarray[np.int16_t, ndim=2] prof
+    cdef np.ndarray[DTYPE_SCORE, ndim=1] prof_index
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] split_rows
+    cdef np.int16_t *pprof = NULL
+    cdef int *pindex = NULL
+    cdef int *pdiag = NULL
+    if profile is None and _use_split(use_matrix, max_j):
+        profile = _profile(table, seqj, max_j)
+    if profile is not None:
+        prof, prof_index = profile
+        split_rows = np.empty((2, W), dtype=np.int32)
+        pprof = <np.int16_t *>prof.data
+        pindex = <int *>prof_index.data
+        pdiag = <int *>split_rows.data
+    if cut != NULL:
+        suffix = _suffix_bound(cut, seqi, max_i, table, match)
+
+    with nogil:
+        agap[0] = 0
+        _init_row(pcheck, max_j, gap_open, gap_extend, use_matrix, mode)
+        prev = pcheck
+        for i in range(1, max_i + 1):
+            cur = prows + (i & 1) * W
+            agap[i] = _row(prev, cur, pscratch, seqj, max_j, seqi[i - 1], i,
+                           max_i, agap[i - 1], tab, pprof, pindex, pdiag,
+                           match, gap_open, gap_extend,
+                           _col0(i, gap_open, gap_extend, use_matrix, mode))
+            # the pointers of the last block are all still here at the end.
+            _pack_row(pscratch, pblock + ((i - 1) % k) * PW, W)
+            if i % k == 0:
+                memcpy(pcheck + (i // k) * W, cur, W * sizeof(int))
+            if mode == SEMIGLOBAL and i < max_i and cur[max_j] > col_best:
+                col_best = cur[max_j]
+                col_i = i
+            prev = cur
+            if cut != NULL and i % CUTOFF_EVERY == 0 and \
+                    _cut(cut, cur, 0, max_j, max_j, i, max_i):
+                stopped = 1
+                break
+    if cut != NULL and (stopped or (cut.use_min and prev[max_j] < cut.min_score)):
+        return None
+    final = prev[max_j]
+    if mode == SEMIGLOBAL:
+        if col_best > final:
+            final = col_best
+            end_i = col_i
+        for j in range(max_j):
+            if prev[j] > final:
+                final = prev[j]
+                end_i, end_j = max_i, j
+
+    seqlen = max_i + max_j
+    ops = np.empty(seqlen, dtype=np.uint8)
+    cdef unsigned char *pops = <unsigned char *>(<np.ndarray>ops).data
+
+    # the free gaps after the end cell.
+    for i in range(max_i - end_i):
+        pops[align_counter] = UP
+        align_counter += 1
+    for j in range(max_j - end_j):
+        pops[align_counter] = LEFT
+        align_counter += 1
+    i, j = end_i, end_j
+    # the block whose pointers are in pblock.
+    blk = (max_i - 1) // k if max_i > 0 else 0
+    with nogil:
+        while i != 0 or j != 0:
+            if i == 0:
+                p = LEFT
+            else:
+                b = (i - 1) // k
+                if b != blk:
+                    # recompute the pointers for rows b * k + 1 .. blk_end
+                    blk = b
+                    blk_end = min(b * k + k, max_i)
+                    prev = pcheck + b * W
+                    for r in range(b * k + 1, blk_end + 1):
+                        cur = prows + (r & 1) * W
+                        _row(prev, cur, pscratch, seqj, max_j, seqi[r - 1], r,
+                             max_i, agap[r - 1], tab, pprof, pindex, pdiag,
+                             match, gap_open, gap_extend,
+                             _col0(r, gap_open, gap_extend, use_matrix, mode))
+                        _pack_row(pscratch, pblock + (r - b * k - 1) * PW, W)
+                        prev = cur
+                p = (pblock[(i - b * k - 1) * PW + (j >> 2)] >> ((j & 3) << 1)) & 3
+
+            pops[align_counter] = p
+            align_counter += 1
+            if p != LEFT: i -= 1
+            if p != UP: j -= 1
+
+    return ops[:align_counter], final
+
+cdef inline int _local_row(int *cur, unsigned char *ptr, np.int64_t *oprev,
+                           np.int64_t *ocur, size_t i, size_t max_j,
+                           int *best, np.int64_t *best_cell,
+                           np.int64_t *best_start) nogil:
+    """
+    make row i of the DP (filled by _row) a row of a local alignment: the
+    cells that don't score above 0 get 0 and the pointer STOP. ocur gets
+    the cell (as i * (max_j + 1) + j) that the path of each cell starts
+    from, given those of row i - 1 in oprev, and the first cell that beats
+    `best` is recorded. returns the gap flag of the row.
+    """
+    cdef size_t j, W = max_j + 1
+    cdef int agap = 1
+    cur[0] = 0
+    ptr[0] = STOP
+    ocur[0] = i * W
+    for j in range(1, max_j + 1):
+        if cur[j] <= 0:
+            cur[j] = 0
+            ptr[j] = STOP
+            ocur[j] = i * W + j
+            continue
+        if ptr[j] == DIAG:
+            ocur[j] = oprev[j - 1]
+            agap = 0
+        elif ptr[j] == UP:
+            ocur[j] = oprev[j]
+        else:
+            ocur[j] = ocur[j - 1]
+        if cur[j] > best[0]:
+            best[0] = cur[j]
+            best_cell[0] = i * W + j
+            best_start[0] = ocur[j]
+    return agap
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _align_local(char *seqj, char *seqi, size_t max_j, size_t max_i,
+                  object table, int match, int gap_open, int gap_extend,
+                  object profile=None):
+    """
+    the DP and traceback for local_align: each row is filled by the kernels
+    of _align (with free end gaps) and then floored at 0 by _local_row.
+    the forward pass keeps 2 rows of scores and, for each cell, the cell
+    its path starts from, so at the end the best cell and the start of
+    its alignment are known. every k-th row is kept too, as in the linear
+    mode of _align, so the rows before the start are not recomputed, and
+    pointers are kept only for the rectangle between the 2 cells.
+    returns the pointers of the traceback (see _output), the score and the
+    (i, j) of the start and end cells.
+    """
+    cdef bint use_matrix = table is not None
+    cdef size_t k = max(1, <size_t>sqrt(<double>max_i))
+    cdef size_t W = max_j + 1
+    cdef size_t i, j, r, b, si, sj, bi, bj, PR, align_counter = 0
+    cdef int best = 0, ignore = 0
+    cdef np.int64_t best_cell = 0, best_start = 0, ignore_cell
+    cdef unsigned char p
+    cdef int *prev
+    cdef int *cur
+    cdef np.int64_t *oprev
+    cdef np.int64_t *ocur
+    cdef int *tab = NULL
+
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] checkpoints = np.empty((max_i // k + 1, W), dtype=np.int32)
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] rows = np.empty((2, W), dtype=np.int32)
+    cdef np.ndarray[np.int64_t, ndim=2] origins = np.empty((2, W), dtype=np.int64)
+    # _pack_row reads up to 3 pointers past the end of the rectangle.
+    cdef np.ndarray[DTYPE_PTR, ndim=1] scratch = np.zeros((W + 4,), dtype=np.uint8)
+    cdef np.ndarray[DTYPE_BOOL, ndim=1] agap_i = np.ones((max_i + 1,), dtype=np.int8)
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] atable
+    if use_matrix:
+        atable = table
+        tab = <int *>atable.data
+    cdef int *pcheck = <int *>checkpoints.data
+    cdef int *prows = <int *>rows.data
+    cdef np.int64_t *porig = <np.int64_t *>origins.data
+    cdef unsigned char *pscratch = <unsigned char *>scratch.data
+    cdef np.int8_t *agap = <np.int8_t *>agap_i.data
+
+    cdef np.ndarray[np.int16_t, ndim=2] prof
+    cdef np.ndarray[DTYPE_SCORE, ndim=1] prof_index
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] split_rows
+    cdef np.int16_t *pprof = NULL
+    cdef int *pindex = NULL
+    cdef int *pdiag = NULL
+    if profile is None and _use_split(use_matrix, max_j):
+        profile = _profile(table, seqj, max_j)
+    if profile is not None:
+        prof, prof_index = profile
+        split_rows = np.empty((2, W), dtype=np.int32)
+        pprof = <np.int16_t *>prof.data
+        pindex = <int *>prof_index.data
+        pdiag = <int *>split_rows.data
+
+    with nogil:
+        agap[0] = 0
+        _init_row(pcheck, max_j, gap_open, gap_extend, use_matrix, LOCAL)
+        for j in range(W):
+            porig[j] = j
+        prev = pcheck
+        oprev = porig
+        for i in range(1, max_i + 1):
+            cur = prows + (i & 1) * W
+            ocur = porig + (i & 1) * W
+            _row(prev, cur, pscratch, seqj, max_j, seqi[i - 1], i, max_i,
+                 agap[i - 1], tab, pprof, pindex, pdiag, match, gap_open,
+                 gap_extend, 0)
+            agap[i] = _local_row(cur, pscratch, oprev, ocur, i, max_j, &best,
+                                 &best_cell, &best_start)
+            if i % k == 0:
+                memcpy(pcheck + (i // k) * W, cur, W * sizeof(int))
+            prev = cur
+            oprev = ocur
+
+    if best == 0:
+        return _NO_OPS, 0, (0, 0), (0, 0)
+    bi, bj = best_cell // W, best_cell % W
+    si, sj = best_start // W, best_start % W
+    # the path is in rows si + 1 .. bi (it enters row si at its start) and
+    # columns sj .. bj.
+    PR = (bj - sj + 1 + 3) >> 2
+    cdef np.ndarray[DTYPE_PTR, ndim=2] block = np.empty((bi - si, PR), dtype=np.uint8)
+    cdef unsigned char *pblock = <unsigned char *>block.data
+    ops = np.empty(bi - si + bj - sj, dtype=np.uint8)
+    cdef unsigned char *pops = <unsigned char *>(<np.ndarray>ops).data
+
+    with nogil:
+        # from the last row kept at or before the start.
+        b = si // k
+        prev = pcheck + b * W
+        for r in range(b * k + 1, bi + 1):
+            cur = prows + (r & 1) * W
+            ocur = porig + (r & 1) * W
+            _row(prev, cur, pscratch, seqj, max_j, seqi[r - 1], r, max_i,
+                 agap[r - 1], tab, pprof, pindex, pdiag, match, gap_open,
+                 gap_extend, 0)
+            _local_row(cur, pscratch, ocur, ocur, r, max_j, &ignore,
+                       &ignore_cell, &ignore_cell)
+            if r > si:
+                _pack_row(pscratch + sj, pblock + (r - si - 1) * PR, bj - sj + 1)
+            prev = cur
+
+        i, j = bi, bj
+        while i > si:
+            p = (pblock[(i - si - 1) * PR + ((j - sj) >> 2)] >> (((j - sj) & 3) << 1)) & 3
+            pops[align_counter] = p
+            align_counter += 1
+            if p != LEFT: i -= 1
+            if p != UP: j -= 1
+
+    return ops[:align_counter], best, (si, sj), (bi, bj)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _align_banded(char *seqj, char *seqi, size_t max_j, size_t max_i,
+                   object table, int match, int gap_open, int gap_extend,
+                   int lo, int hi, Cutoff *cut=NULL):
+    """
+    like _align, but only the cells with lo <= j - i <= hi are filled and
+    the pointers are packed for just those hi - lo + 1 cells of each row.
+    the gap flag of a row only sees the cells in the band.
+    returns the pointers of the traceback, the score and whether the
+    traceback went along an edge of the band that is not also an edge of
+    the matrix or a row before the last had no diagonal in a band that
+    doesn't cover it, or None if the DP was stopped by `cut`.
+    """
+    cdef bint use_matrix = table is not None
+    cdef bint stopped = 0
+    cdef int final
+    cdef size_t B = hi - lo + 1
+    cdef size_t PB = (B + 3) >> 2
+    cdef size_t W = max_j + 1
+    # the pointer for column j of a row goes in scratch[pad + j], so a row
+    # can be packed starting from a (negative) column i + lo.
+    cdef size_t pad = B
+    cdef size_t i, j, j0, j1, seqlen, align_counter = 0
+    cdef int off
+    cdef unsigned char p
+    cdef bint touched = 0
+    cdef int *prev
+    cdef int *cur
+    cdef int *tab = NULL
+
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] rows = np.empty((2, W), dtype=np.int32)
+    cdef np.ndarray[DTYPE_PTR, ndim=1] scratch = np.zeros((pad + W + 4 * PB,), dtype=np.uint8)
+    cdef np.ndarray[DTYPE_PTR, ndim=2] block = np.empty((max(1, max_i), PB), dtype=np.uint8)
+    cdef np.ndarray[DTYPE_BOOL, ndim=1] agap_i = np.ones((max_i + 1,), dtype=np.int8)
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] atable
+    if use_matrix:
+        atable = table
+        tab = <int *>atable.data
+    cdef int *prows = <int *>rows.data
+    cdef unsigned char *pscratch = <unsigned char *>scratch.data
+    cdef unsigned char *pblock = <unsigned char *>block.data
+    cdef np.int8_t *agap = <np.int8_t *>agap_i.data
+    if cut != NULL:
+        suffix = _suffix_bound(cut, seqi, max_i, table, match)
+
+    with nogil:
+        agap[0] = 0
+        _init_row(prows, max_j, gap_open, gap_extend, use_matrix)
+        if hi < <int>max_j:
+            prows[hi + 1] = NEG
+        prev = prows
+        for i in range(1, max_i + 1):
+            cur = prows + (i & 1) * W
+            off = <int>i + lo
+            j0 = 1 if off <= 1 else <size_t>off
+            off = <int>i + hi
+            j1 = max_j if off >= <int>max_j else <size_t>off
+            if use_matrix:
+                agap[i] = _row_matrix(prev, cur, pscratch + pad, seqj, max_j,
+                                      tab + 256 * <unsigned char>seqi[i - 1],
+                                      i, max_i, agap[i - 1], gap_open,
+                                      gap_extend, j0, j1,
+                                      _col0(i, gap_open, gap_extend, 1, GLOBAL))
+            else:
+                agap[i] = _row_no_matrix(prev, cur, pscratch + pad, seqj, max_j,
+                                         seqi[i - 1], i, match, agap[i - 1],
+                                         gap_open, gap_extend, j0, j1,
+                                         _col0(i, gap_open, gap_extend, 0, GLOBAL))
+            _pack_row(pscratch + <int>pad + <int>i + lo, pblock + (i - 1) * PB, B)
+            # a row with no diagonal in the band might have one outside it,
+            # which would change the gap penalty of the next row.
+            if agap[i] and i < max_i and (j0 > 1 or j1 < max_j):
+                touched = 1
+            prev = cur
+            if cut != NULL and i % CUTOFF_EVERY == 0 and \
+                    _cut(cut, cur, j0, j1, max_j, i, max_i):
+                stopped = 1
+                break
+    if cut != NULL and (stopped or (cut.use_min and prev[max_j] < cut.min_score)):
+        return None
+    final = prev[max_j]
+
+    seqlen = max_i + max_j
+    ops = np.empty(seqlen, dtype=np.uint8)
+    cdef unsigned char *pops = <unsigned char *>(<np.ndarray>ops).data
+
+    i, j = max_i, max_j
+    with nogil:
+        while i != 0 or j != 0:
+            off = <int>j - <int>i
+            if (off <= lo and lo > -<int>max_i) or (off >= hi and hi < <int>max_j):
+                if i != max_i or j != max_j:
+                    touched = 1
+            if i == 0:
+                p = LEFT
+            elif j == 0:
+                p = UP
+            else:
+                off -= lo
+                p = (pblock[(i - 1) * PB + (off >> 2)] >> ((off & 3) << 1)) & 3
+
+            pops[align_counter] = p
+            align_counter += 1
+            if p != LEFT: i -= 1
+            if p != UP: j -= 1
+
+    return ops[:align_counter], final, touched
+
+cdef _align_band(char *seqj, char *seqi, size_t max_j, size_t max_i,
+                 object table, int match, int gap_open, int gap_extend,
+                 object band, object linear_threshold, Cutoff *cut=NULL):
+    """
+    banded alignment: the band covers the diagonals between the corners of
+    the matrix plus `band` more on each side (BAND_MARGIN if band is True).
+    if the traceback runs along the edge of the band (or a gap flag may
+    depend on the cells outside it), the margin is doubled and the
+    alignment redone, until the band covers the whole matrix and
+    the full kernel is used. a `cut` applies to each banded pass.
+    """
+    cdef int dm = <int>max_j - <int>max_i
+    cdef int w = BAND_MARGIN if band is True else band
+    cdef int lo, hi
+    assert w >= 0, "band must be >= 0"
+    while True:
+        if cut != NULL: cut.best = NEG
+        lo = max(min(0, dm) - w, -<int>max_i)
+        hi = min(max(0, dm) + w, <int>max_j)
+        if lo == -<int>max_i and hi == <int>max_j:
+            return _align(seqj, seqi, max_j, max_i, table, match, gap_open,
+                          gap_extend, _use_linear(max_i, max_j, linear_threshold),
+                          None, cut)
+        r = _align_banded(seqj, seqi, max_j, max_i, table, match, gap_open,
+                          gap_extend, lo, hi, cut)
+        if r is None:
+            return None
+        ops, score, touched = r
+        if not touched:
+            return ops, score
+        w = max(1, 2 * w)
+
+
+cdef inline int _myers_block(word_t *pv, word_t *mv, word_t eq, int hin) nogil:
+    """
+    advance one 64-row block of the bit-parallel edit distance (Myers 1999,
+    with Hyyro's block carries) by a column. pv/mv hold the +1/-1 vertical
+    differences, eq the rows that match the column's character and hin
+    the horizontal difference coming in at the top of the block.
+    updates pv/mv and returns the horizontal difference out of the bottom.
+    """
+    cdef word_t Pv = pv[0], Mv = mv[0]
+    cdef word_t hneg = 1 if hin < 0 else 0
+    cdef word_t Xv = eq | Mv
+    cdef word_t Xh, Ph, Mh
+    cdef int hout
+    eq |= hneg
+    Xh = (((eq & Pv) + Pv) ^ Pv) | eq
+    Ph = Mv | ~(Xh | Pv)
+    Mh = Pv & Xh
+    hout = <int>(Ph >> 63) - <int>(Mh >> 63)
+    Ph = (Ph << 1) | (1 if hin > 0 else 0)
+    Mh = (Mh << 1) | hneg
+    pv[0] = Mh | ~(Xv | Ph)
+    mv[0] = Ph & Xv
+    return hout
+
+cdef inline int _vsum(word_t *pv, word_t *mv, size_t i) nogil:
+    """
+    the sum of the vertical differences in rows 1 .. i of a column.
+    """
+    cdef size_t b, nfull = i >> 6
+    cdef int s = 0
+    cdef word_t mask
+    for b in range(nfull):
+        s += __builtin_popcountll(pv[b]) - __builtin_popcountll(mv[b])
+    if i & 63:
+        mask = ((<word_t>1) << (i & 63)) - 1
+        s += __builtin_popcountll(pv[nfull] & mask) - \
+             __builtin_popcountll(mv[nfull] & mask)
+    return s
+
+cdef inline int _vbit(word_t *pv, word_t *mv, size_t i) nogil:
+    """
+    the vertical difference D[i] - D[i - 1] of a column.
+    """
+    cdef word_t bit = (<word_t>1) << ((i - 1) & 63)
+    if pv[(i - 1) >> 6] & bit: return 1
+    if mv[(i - 1) >> 6] & bit: return -1
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _myers(char *seqj, char *seqi, size_t max_j, size_t max_i, bint traceback):
+    """
+    unit-cost (levenshtein) global alignment of seqi (down the rows, 64 to a
+    word) against seqj (across the columns). if not traceback, returns the
+    distance. otherwise, the vertical differences of every column are kept
+    (2 bits per cell) and the traceback makes the same choices as
+    global_align_no_matrix with match=0 and gap_open == gap_extend, since
+    the score there is just -distance * gap. returns the pointers of the
+    traceback (see _output) and the distance.
+    """
+    cdef size_t nb = max(1, (max_i + 63) >> 6)
+    cdef size_t i, j, b, seqlen, align_counter = 0
+    cdef int hin, d, up, left, diag, dist
+    cdef unsigned char p = 0
+    cdef np.ndarray[np.uint64_t, ndim=2] peq = np.zeros((256, nb), dtype=np.uint64)
+    cdef np.ndarray[np.uint64_t, ndim=2] cols = np.empty(
+                         ((max_j + 1) if traceback else 1, 2 * nb), dtype=np.uint64)
+    cdef word_t *ppeq = <word_t *>peq.data
+    cdef word_t *pcols = <word_t *>cols.data
+    cdef word_t *pv
+    cdef word_t *mv
+    cdef word_t *eq
+
+    for i in range(max_i):
+        ppeq[<unsigned char>seqi[i] * nb + (i >> 6)] |= (<word_t>1) << (i & 63)
+
+    with nogil:
+        # column 0: D[i] = i.
+        for b in range(nb):
+            pcols[b] = ~(<word_t>0)
+            pcols[nb + b] = 0
+        pv = pcols
+        for j in range(1, max_j + 1):
+            if traceback:
+                memcpy(pcols + j * 2 * nb, pv, 2 * nb * sizeof(word_t))
+                pv = pcols + j * 2 * nb
+            mv = pv + nb
+            eq = ppeq + <unsigned char>seqj[j - 1] * nb
+            # the top row is D[0][j] = j.
+            hin = 1
+            for b in range(nb):
+                hin = _myers_block(pv + b, mv + b, eq[b], hin)
+
+    if not traceback:
+        return <int>max_j + _vsum(pv, pv + nb, max_i)
+
+    seqlen = max_i + max_j
+    ops = np.empty(seqlen, dtype=np.uint8)
+    cdef unsigned char *pops = <unsigned char *>(<np.ndarray>ops).data
+
+    i, j = max_i, max_j
+    with nogil:
+        pv = pcols + j * 2 * nb
+        d = dist = <int>j + _vsum(pv, pv + nb, i)
+        while i != 0 or j != 0:
+            if i == 0:
+                p = LEFT
+            elif j == 0:
+                p = UP
+            else:
+                pv = pcols + j * 2 * nb
+                up = d - _vbit(pv, pv + nb, i)
+                pv = pcols + (j - 1) * 2 * nb
+                left = <int>j - 1 + _vsum(pv, pv + nb, i)
+                diag = left - _vbit(pv, pv + nb, i)
+                if seqj[j - 1] != seqi[i - 1]:
+                    diag += 1
+                if diag <= up + 1 and diag <= left + 1:
+                    p = DIAG
+                    d = left - _vbit(pv, pv + nb, i)
+                elif up <= left:
+                    p = UP
+                    d = up
+                else:
+                    p = LEFT
+                    d = left
+
+            pops[align_counter] = p
+            align_counter += 1
+            if p != LEFT: i -= 1
+            if p != UP: j -= 1
+
+    return ops[:align_counter], dist
+
+def edit_distance(object _seqj, object _seqi):
+    """
+    the levenshtein distance between 2 sequences, computed 64 cells at a
+    time with a bit-parallel kernel.
+
+    >>> from nwalign import edit_distance
+    >>> edit_distance('kitten', 'sitting')
+    3
+    >>> edit_distance('', 'ACGT')
+    4
+
+    """
+    cdef _Seq sj = _seq(_seqj), si = _seq(_seqi)
+    return _myers(sj.data, si.data, sj.n, si.n, 0)
+
+cdef inline bint _unit_cost(int match, int gap_open, int gap_extend):
+    return match == 0 and gap_open == gap_extend and gap_open < 0
 
-cdef read_matrix(path, dict cache={}):
-    """
-    so here, we read a matrix in the NCBI format and put
-    it into a numpy array. so the score for a 'C' changing
-    to an 'A' is stored in the matrix as:
-        mat[ord('C'), ord('A')] = score
-    as such, it's a direct array lookup from each pair in the alignment
-    to a score. this makes if very fast. the cost is in terms of space.
-    though it's usually less than 100*100.
-    """
-    if path in cache: return cache[path]
-    cdef np.ndarray[DTYPE_INT, ndim=2] a
-    cdef size_t ai = 0, i
-    cdef int v, mat_size
-
-    fh = open(path)
-    headers = None
-    while headers is None:
-        line = fh.readline().strip()
-        if line[0] == '#': continue
-        headers = [ord(x) for x in line.split(' ') if x]
-    mat_size = max(headers) + 1
-
-    a = np.zeros((mat_size, mat_size), dtype=np.int)
-
-    line = fh.readline()
-    while line:
-        line_vals = [int(x) for x in line[:-1].split(' ')[1:] if x]
-        for ohidx, val in zip(headers, line_vals):
-            a[headers[ai], ohidx] = val
-        ai += 1
-        line = fh.readline()
-        
-    cache[path] = a
-    return a
 
 @cython.boundscheck(False)
 @cython.nonecheck(False)
 def global_align(object _seqj, object _seqi, int match=1, 
-                 int gap_open=-1, int gap_extend=-1, object matrix=None):
+                 int gap_open=-1, int gap_extend=-1, object matrix=None,
+                 object linear_threshold=None, object band=None,
+                 object min_score=None, object xdrop=None,
+                 object output='strings'):
     """
     perform a global sequence alignment (needleman-wunsch) on seq and and 2. using
     the matrix for nucleotide transition from matrix if available.
@@ -97,154 +1394,122 @@ def global_align(object _seqj, object _seqi, int match=1,
     >>> global_align('COELANCANTH', 'PELICAN')
     ('COELANCANTH', '-PEL-ICAN--')
 
-    """
-    if matrix is None:
-        return global_align_no_matrix(_seqj, _seqi, match, gap_open, gap_extend)
+    if the DP matrix would have more than `linear_threshold` cells (default:
+    nwalign.cnwalign.LINEAR_THRESHOLD) the alignment is done in linear-ish
+    memory. the result is the same.
 
-    cdef bint flip = 0
-    
-    cdef char* seqj = _seqj
-    cdef char* seqi = _seqi
+    >>> global_align('COELANCANTH', 'PELICAN', linear_threshold=0)
+    ('COELANCANTH', '-PEL-ICAN--')
 
-    cdef size_t max_j = strlen(seqj) 
-    cdef size_t max_i = strlen(seqi) 
-    if max_i == max_j == 0:
-        return "", ""
+    for similar sequences, `band` limits the DP to the diagonals between
+    the corners of the matrix, plus `band` on each side (or BAND_MARGIN if
+    band is True). if the alignment runs along the edge of the band, it's
+    redone with twice the band, as it is if a row has no diagonal step in
+    the band (one outside it would change the gap penalty of the next row).
+    this is a heuristic: the cells just inside the band don't see the ones
+    outside it, and, as a tie with the diagonal picks it even when another
+    step scores more, a change to any of them can change the rest. for
+    similar sequences, the result is nearly always the full alignment. for
+    dissimilar ones, it's often a different one (without a matrix, one
+    whose score is no higher than the full alignment's).
 
+    >>> global_align('ACGTACGTACGTACGT', 'ACGTACGACGTACGT', band=2)
+    ('ACGTACGTACGTACGT', 'ACGTACG-ACGTACGT')
 
-    if max_j > max_i:
-        flip = 1
-        seqi, seqj = seqj, seqi
-        max_i, max_j = max_j, max_i
+    the sequences can be str or anything with a buffer of 1-byte items:
+    bytearray, memoryview or S1/uint8 numpy arrays (so the memmaps from
+    pyfasta's NpyFastaRecord can be used without a copy). the length is
+    taken from the buffer, not from a NUL.
 
-    # need to initialize j for the case when it's a zero-length string.
-    cdef size_t i = 0, j = 0, seqlen, align_counter = 0, p
-    cdef int diag_score, up_score, left_score, tscore
+    >>> import numpy as np
+    >>> global_align(bytearray('COELANCANTH'), np.array(list('PELICAN'), dtype='S1'))
+    ('COELANCANTH', '-PEL-ICAN--')
 
-    cdef char *align_j, *align_i
-    cdef char ci, cj
-    cdef PyObject *ai, *aj
-    cdef int zero=0, one=1
+    to only get the alignment of pairs that score at least `min_score`
+    (see global_score), pass min_score; None is returned for the others.
+    every few rows, the DP stops if no path through the current row can
+    reach min_score, so dissimilar pairs are rejected early. with `xdrop`,
+    it also stops (and returns None) once the best score in a row is more
+    than xdrop below the best score of an earlier row. unlike min_score,
+    xdrop is a heuristic: a pair that would recover later is dropped too.
 
-    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
-    assert gap_open <= 0, "gap_open must be <= 0"
+    >>> global_align('COELANCANTH', 'PELICAN', min_score=-1)
+    ('COELANCANTH', '-PEL-ICAN--')
+    >>> global_align('COELANCANTH', 'PELICAN', min_score=0) is None
+    True
 
-    cdef np.ndarray[DTYPE_BOOL, ndim=1] agap_i = np.ones((max_i + 1,), dtype=np.int8)
-    cdef np.ndarray[DTYPE_BOOL, ndim=1] agap_j = np.ones((max_j + 1,), dtype=np.int8)
+    for long sequences, building the gapped strings can cost as much as the
+    DP. with output='cigar', (score, cigar) is returned instead, where the
+    cigar has the runs of M (match or mismatch), I (a character of the
+    second sequence against a gap) and D (a character of the first against
+    a gap). output='ops' gives (score, ops): a uint8 array with OP_MATCH,
+    OP_INS or OP_DEL for each column of the alignment.
 
-    cdef np.ndarray[DTYPE_INT, ndim=2] score = np.empty((max_i + 1, max_j + 1), dtype=np.int)
-    cdef np.ndarray[DTYPE_UINT, ndim=2] pointer = np.empty((max_i + 1, max_j + 1), dtype=np.uint)
-    cdef np.ndarray[DTYPE_INT, ndim=2] amatrix
+    >>> global_align('COELANCANTH', 'PELICAN', output='cigar')
+    (-1, '1D3M1D4M2D')
+    >>> global_align('COELANCANTH', 'PELICAN', output='ops')
+    (-1, array([2, 0, 0, 0, 2, 0, 0, 0, 0, 2, 2], dtype=uint8))
 
-    amatrix = read_matrix(matrix)
-  
-    pointer[0, 0] = NONE
-    score[0, 0] = 0
-    
-    pointer[0, 1:] = LEFT
-    pointer[1:, 0] = UP
+    with a matrix, the score is score_alignment of the alignment. it can
+    differ from global_score (the score of the DP, which min_score is
+    checked against), as the DP only tracks whether the best path to a
+    cell ends in a gap. without a matrix, there's no score_alignment, and
+    the score is that of global_score.
 
-    score[0, 1:] = gap_open + gap_extend * np.arange(0, max_j, dtype=np.int)
-    score[1:, 0] = gap_open + gap_extend * np.arange(0, max_i, dtype=np.int)
+    >>> global_score('CEELECANTH', 'PELICAN', gap_open=-5, gap_extend=-2, matrix='PAM250')
+    8
+    >>> global_align('CEELECANTH', 'PELICAN', gap_open=-5, gap_extend=-2, matrix='PAM250', output='cigar')
+    (11, '1D7M2D')
 
-    agap_i[0] = zero
+    """
+    if matrix is None:
+        return global_align_no_matrix(_seqj, _seqi, match, gap_open, gap_extend,
+                                      linear_threshold, band, min_score, xdrop,
+                                      output)
+    _check_output(output)
 
-    for i in range(1, max_i + 1):
-        ci = seqi[<size_t>(i - 1)]
+    cdef bint flip = 0
+    cdef Cutoff cutoff
+    cdef Cutoff *cut = NULL
 
-        agap_j[0] = zero
-        for j in range(1, max_j + 1):
-            agap_j[j] = one
-            cj = seqj[<size_t>(j - 1)]
-            tscore = amatrix[ci, cj]
-
-            diag_score = score[<size_t>(i - 1), <size_t>(j - 1)] + tscore
-            up_score   = score[<size_t>(i - 1), j] + (gap_open if agap_i[<size_t>(i - 1)] == zero else gap_extend)
-            left_score = score[i, <size_t>(j - 1)] + (gap_open if agap_j[<size_t>(j - 1)] == zero else gap_extend)
-
-            """
-            fix cases where scores are tied.
-            choose diagonal when not at the ends of either string.
-            and choose up/left (gap) when at the end of the string.
-            this forces gaps to the ends of the aligments.
-            """
-            if diag_score == left_score:
-                # so here. if we're at the end we choose a gap.
-                # otherwise, we choose diag
-                if i == max_i or i == 1:
-                    score[i, j] = left_score
-                    pointer[i, j] = LEFT
-                else: # we want a diagonal
-                    score[i, j] = diag_score
-                    pointer[i, j] = DIAG
-                    agap_i[i] = zero
-            elif diag_score == up_score:
-                if j == max_j or j == 1:
-                    score[i, j] = up_score
-                    pointer[i, j] = UP
-                else: # we want a diagonal
-                    score[i, j] = diag_score
-                    pointer[i, j] = DIAG
-                    agap_i[i] = zero
-            # end of ambiguous score checks.
-
-            elif up_score > diag_score: #checked.
-                if up_score > left_score:
-                    score[i, j]  = up_score
-                    pointer[i, j] = UP
-                else:
-                    score[i, j]   = left_score
-                    pointer[i, j] = LEFT
-            elif diag_score > up_score:
-                if left_score > diag_score:
-                    score[i, j] = left_score
-                    pointer[i, j] = LEFT
-                else:
-                    score[i, j] = diag_score
-                    pointer[i, j] = DIAG
-                    agap_i[i] = zero
+    cdef _Seq sj = _seq(_seqj), si = _seq(_seqi)
+    cdef char* seqj = sj.data
+    cdef char* seqi = si.data
 
-    seqlen = max_i + max_j
-    ai = PyString_FromStringAndSize(NULL, seqlen)
-    aj = PyString_FromStringAndSize(NULL, seqlen)
-
-    cdef int score_max #, = score[:, -1].max()
-
-    # had to use this and PyObject instead of assigning directly...
-    align_j = PyString_AS_STRING(aj)
-    align_i = PyString_AS_STRING(ai)
-
-    p = pointer[i, j]
-    while p != NONE:
-        if p == DIAG:
-            i -= 1
-            j -= 1
-            align_j[align_counter] = seqj[j]
-            align_i[align_counter] = seqi[i]
-        elif p == LEFT:
-            j -= 1
-            align_j[align_counter] = seqj[j]
-            align_i[align_counter] = c"-"
-        elif p == UP:
-            i -= 1
-            align_j[align_counter] = c"-"
-            align_i[align_counter] = seqi[i]
-        else:
-            raise Exception('wtf!:pointer: %i', p)
-        align_counter += 1
-        p = pointer[i, j]
+    cdef size_t max_j = sj.n
+    cdef size_t max_i = si.n
+    if max_i == max_j == 0:
+        if min_score is not None and min_score > 0:
+            return None
+        return _output((_NO_OPS, 0), seqj, seqi, 0, output)
 
-    _PyString_Resize(&aj, align_counter)
-    _PyString_Resize(&ai, align_counter)
-    if flip:
-        return (<object>ai)[::-1], (<object>aj)[::-1] #, score.max()
+    if max_j > max_i:
+        flip = 1
+        seqi, seqj = seqj, seqi
+        max_i, max_j = max_j, max_i
+
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+
+    table, row_max = _matrix_entry(matrix)
+    if _make_cutoff(&cutoff, min_score, xdrop, table, 0, gap_open, gap_extend,
+                    row_max):
+        cut = &cutoff
+    if band is not None:
+        r = _align_band(seqj, seqi, max_j, max_i, table, 0, gap_open,
+                        gap_extend, band, linear_threshold, cut)
     else:
-        return (<object>aj)[::-1], (<object>ai)[::-1] #, score.max()
+        r = _align(seqj, seqi, max_j, max_i, table, 0, gap_open, gap_extend,
+                   _use_linear(max_i, max_j, linear_threshold), None, cut)
+    return _output(r, seqj, seqi, flip, output, table, gap_open, gap_extend)
 
 
 @cython.boundscheck(False)
 @cython.nonecheck(False)
-cpdef global_align_no_matrix(object _seqj, object _seqi, int match, int gap_open, int gap_extend):
+cpdef global_align_no_matrix(object _seqj, object _seqi, int match, int gap_open, int gap_extend,
+                             object linear_threshold=None, object band=None,
+                             object min_score=None, object xdrop=None,
+                             object output='strings'):
     """
     perform a global sequence alignment (needleman-wunsch) on seq and and 2. using
     the matrix for nucleotide transition from matrix if available.
@@ -256,101 +1521,360 @@ cpdef global_align_no_matrix(object _seqj, object _seqi, int match, int gap_open
 
     """
 
-    cdef char* seqj = _seqj
-    cdef char* seqi = _seqi
+    cdef _Seq sj = _seq(_seqj), si = _seq(_seqi)
+    cdef char* seqj = sj.data
+    cdef char* seqi = si.data
 
-    cdef size_t max_j = strlen(seqj)
-    cdef size_t max_i = strlen(seqi)
+    cdef size_t max_j = sj.n
+    cdef size_t max_i = si.n
+    cdef Cutoff cutoff
+    cdef Cutoff *cut = NULL
+    _check_output(output)
     if max_i == max_j == 0:
-        return "", ""
-    cdef size_t i = 0, j = 0, seqlen, align_counter = 0, p
-    cdef int diag_score, up_score, left_score
-
-    cdef char *align_j, *align_i
-    cdef char ci, cj
-    cdef PyObject *ai, *aj
-    cdef int zero=0, one=1
+        if min_score is not None and min_score > 0:
+            return None
+        return _output((_NO_OPS, 0), seqj, seqi, 0, output)
 
     assert gap_extend <= 0, "gap penalty must be <= 0"
     assert gap_open <= 0, "gap_open must be <= 0"
 
+    if _make_cutoff(&cutoff, min_score, xdrop, None, match, gap_open, gap_extend):
+        cut = &cutoff
+    if band is not None:
+        r = _align_band(seqj, seqi, max_j, max_i, None, match, gap_open,
+                        gap_extend, band, linear_threshold, cut)
+    elif _unit_cost(match, gap_open, gap_extend) and xdrop is None and \
+            not _use_linear(max_i, max_j, linear_threshold):
+        # the distance alone is much cheaper than the alignment.
+        if min_score is not None and \
+                gap_open * _myers(seqj, seqi, max_j, max_i, 0) < min_score:
+            return None
+        ops, d = _myers(seqj, seqi, max_j, max_i, 1)
+        r = ops, gap_open * d
+    else:
+        r = _align(seqj, seqi, max_j, max_i, None, match, gap_open, gap_extend,
+                   _use_linear(max_i, max_j, linear_threshold), None, cut)
+    return _output(r, seqj, seqi, 0, output)
 
-    cdef np.ndarray[DTYPE_BOOL, ndim=1] agap_i = np.ones((max_i + 1,), dtype=np.int8)
-    cdef np.ndarray[DTYPE_BOOL, ndim=1] agap_j = np.ones((max_j + 1,), dtype=np.int8)
 
-    cdef np.ndarray[DTYPE_INT, ndim=2] score = np.zeros((max_i + 1, max_j + 1), dtype=np.int)
-    cdef np.ndarray[DTYPE_UINT, ndim=2] pointer = np.zeros((max_i + 1, max_j + 1), dtype=np.uint)
+def semiglobal_align(object _seqj, object _seqi, int match=1,
+                     int gap_open=-1, int gap_extend=-1, object matrix=None,
+                     object linear_threshold=None, object output='strings'):
+    """
+    like global_align, but the gaps at the start and end of both sequences
+    are free, so one can overhang the other at either end: a read against
+    the amplicon it came from, or the end of one read against the start of
+    the next. the alignment still covers both sequences, with the
+    overhangs against gaps. the arguments are those of global_align (or
+    global_align_no_matrix if there's no matrix).
 
-    pointer[0, 0] = NONE
-    score[0, 0] = 0
-    
-    pointer[0, 1:] = LEFT
-    pointer[1:, 0] = UP
+    >>> from nwalign import semiglobal_align
+    >>> semiglobal_align('TTTTACGTACGT', 'ACGTACGTGGGG')
+    ('TTTTACGTACGT----', '----ACGTACGTGGGG')
+    >>> global_align('TTTTACGTACGT', 'ACGTACGTGGGG')
+    ('TTTTACGTACGT', 'ACGTACGTGGGG')
+    >>> semiglobal_align('TTTTACGTACGT', 'ACGTACGTGGGG', output='cigar')
+    (8, '4D8M4I')
 
-    score[0, 1:] = gap_open * np.arange(1, max_j + 1, dtype=np.int)
-    score[1:, 0] = gap_open * np.arange(1, max_i + 1, dtype=np.int)
+    with a matrix, the score of cigar and ops output is score_alignment
+    of the columns from the first to the last that align two characters,
+    as for global_align; the overhangs are free. without a matrix, it's
+    the score of the DP.
 
-    agap_i[0] = zero
+    """
+    _check_output(output)
+    cdef _Seq sj = _seq(_seqj), si = _seq(_seqi)
+    cdef np.ndarray t
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    table = None if matrix is None else _matrix_table(matrix)
+    r = _align(sj.data, si.data, sj.n, si.n, table,
+               match if table is None else 0, gap_open, gap_extend,
+               _use_linear(si.n, sj.n, linear_threshold), None, NULL,
+               SEMIGLOBAL)
+    if r is not None and table is not None and output != 'strings':
+        # the end gaps are free, so only the columns from the first to
+        # the last that align two characters are scored.
+        ptrs, score = r
+        t = table
+        diag = np.flatnonzero(ptrs == DIAG)
+        lead = ptrs[diag[-1] + 1:] if len(diag) else ptrs
+        core = ptrs[diag[0]:diag[-1] + 1] if len(diag) else ptrs[:0]
+        score = _rescore(core, sj.data + <size_t>(lead == LEFT).sum(),
+                         si.data + <size_t>(lead == UP).sum(), 0,
+                         <int *>t.data, gap_open, gap_extend)
+        r = (ptrs, score)
+    return _output(r, sj.data, si.data, 0, output)
 
-    for i in range(1, max_i + 1):
-        ci = seqi[<size_t>(i - 1)]
-        agap_j[0] = zero
-        for j in range(1, max_j + 1):
-            agap_j[j] = one
-            cj = seqj[<size_t>(j - 1)]
-            if cj == ci:
-                diag_score = score[i - 1, j - 1] + match
-            else:
-                diag_score = score[i - 1, j - 1] + \
-                        (gap_extend if (agap_i[i - 1] == one and  agap_j[j - 1] == one) else gap_open)
-
-            up_score   = score[<size_t>(i - 1), j] + (gap_extend if agap_i[<size_t>(i - 1)] == one else gap_open)
-            left_score = score[i, <size_t>(j - 1)] + (gap_extend if agap_j[<size_t>(j - 1)] == one else gap_open)
-
-            if diag_score >= up_score:
-                if diag_score >= left_score:
-                    score[<size_t>i, <size_t>j] = diag_score
-                    pointer[<size_t>i, <size_t>j] = DIAG
-                    agap_i[i] = zero
-                    agap_j[j] = zero
-                else:
-                    score[<size_t>i, <size_t>j] = left_score
-                    pointer[<size_t>i, <size_t>j] = LEFT
+def local_align(object _seqj, object _seqi, int match=1, int gap_open=-1,
+                int gap_extend=-1, object matrix=None,
+                object output='strings'):
+    """
+    the best local (smith-waterman) alignment of a part of each sequence:
+    scores in the DP of semiglobal_align are floored at 0, which starts
+    a new alignment, and the alignment ends at the best cell. returns the
+    alignment as global_align does for `output`, followed by `start` and
+    `end`: the (position in seqj, position in seqi) of the first aligned
+    characters and of the ones just after the last. only the rows of the
+    DP from the start of the alignment to its end are done twice, and
+    the traceback pointers are kept for just those columns.
+
+    >>> from nwalign import local_align
+    >>> local_align('GGGGACGTACGTCC', 'TTACGTACGTAA')
+    ('ACGTACGT', 'ACGTACGT', (4, 2), (12, 10))
+    >>> local_align('GGGGACGTACGTCC', 'TTACGTACGTAA', output='cigar')
+    (8, '8M', (4, 2), (12, 10))
+
+    with a matrix, the score of cigar and ops output is score_alignment
+    of the aligned parts, as for global_align. without a matrix, it's the
+    score of the DP.
+
+    if nothing scores above 0, the alignment is empty.
+
+    >>> local_align('AAAA', 'TTTT')
+    ('', '', (0, 0), (0, 0))
+
+    """
+    _check_output(output)
+    cdef _Seq sj = _seq(_seqj), si = _seq(_seqi)
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    table = None if matrix is None else _matrix_table(matrix)
+    ops, score, (i0, j0), (i1, j1) = _align_local(
+                sj.data, si.data, sj.n, si.n, table,
+                match if table is None else 0, gap_open, gap_extend)
+    r = _output((ops, score), sj.data + <size_t>j0, si.data + <size_t>i0,
+                0, output, table, gap_open, gap_extend)
+    return r + ((j0, i0), (j1, i1))
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def global_score(object _seqj, object _seqi, int match=1,
+                 int gap_open=-1, int gap_extend=-1, object matrix=None,
+                 object min_score=None, object xdrop=None):
+    """
+    the score of the final cell of the DP used by global_align, with the
+    same arguments. only 2 rows of scores are kept and no traceback is
+    done, so this is faster than global_align and needs O(n) memory. the
+    GIL is released during the DP.
+
+    >>> from nwalign import global_score
+    >>> global_score('COELANCANTH', 'PELICAN')
+    -1
+    >>> global_score('CEELECANTH', 'PELICAN', gap_open=-5, gap_extend=-2,
+    ...              matrix='PAM250')
+    8
+
+    `min_score` and `xdrop` are as for global_align; None is returned for
+    a pair that is cut off.
+
+    >>> global_score('COELANCANTH', 'PELICAN', min_score=0) is None
+    True
+
+    """
+    cdef _Seq sj = _seq(_seqj), si = _seq(_seqi)
+    cdef char* seqj = sj.data
+    cdef char* seqi = si.data
+    cdef size_t max_j = sj.n
+    cdef size_t max_i = si.n
+    cdef bint use_matrix = matrix is not None
+    cdef Cutoff cutoff
+    cdef Cutoff *cut = NULL
+    cdef int score
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    if not use_matrix and _unit_cost(match, gap_open, gap_extend) and xdrop is None:
+        score = gap_open * _myers(seqj, seqi, max_j, max_i, 0)
+        return None if min_score is not None and score < min_score else score
+
+    table = row_max = None
+    if use_matrix:
+        table, row_max = _matrix_entry(matrix)
+        # global_align puts the longer sequence along i.
+        if max_j > max_i:
+            seqi, seqj = seqj, seqi
+            max_i, max_j = max_j, max_i
+    if _make_cutoff(&cutoff, min_score, xdrop, table, match, gap_open,
+                    gap_extend, row_max):
+        cut = &cutoff
+    score = _score(seqj, seqi, max_j, max_i, table, match, gap_open,
+                   gap_extend, None, cut)
+    if cut != NULL and (score == NEG or (cut.use_min and score < cut.min_score)):
+        return None
+    return score
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int _score(char *seqj, char *seqi, size_t max_j, size_t max_i,
+                object table, int match, int gap_open, int gap_extend,
+                object profile=None, Cutoff *cut=NULL) except? -1:
+    """
+    the final score of the DP done by _align, in 2 rows, or NEG if the DP
+    was stopped by `cut`. the rows are done by the _row_score_* kernels,
+    which make the same choices as the ones of _align but keep no
+    pointers.
+    """
+    cdef bint use_matrix = table is not None
+    cdef size_t i
+    cdef int agap = 0
+    cdef int *prev
+    cdef int *cur
+    cdef int *tab = NULL
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] atable
+    if use_matrix:
+        atable = table
+        tab = <int *>atable.data
+
+    cdef size_t W = max_j + 1
+    cdef np.ndarray[DTYPE_SCORE, ndim=2] rows = np.empty((3, W), dtype=np.int32)
+    cdef int *prows = <int *>rows.data
+
+    cdef np.ndarray[np.int16_t, ndim=2] prof
+    cdef np.ndarray[DTYPE_SCORE, ndim=1] prof_index
+    cdef np.int16_t *pprof = NULL
+    cdef int *pindex = NULL
+    if profile is None and _use_split(use_matrix, max_j):
+        profile = _profile(table, seqj, max_j)
+    if profile is not None:
+        prof, prof_index = profile
+        pprof = <np.int16_t *>prof.data
+        pindex = <int *>prof_index.data
+    if cut != NULL:
+        suffix = _suffix_bound(cut, seqi, max_i, table, match)
+
+    prev = prows
+    with nogil:
+        _init_row(prev, max_j, gap_open, gap_extend, use_matrix)
+        for i in range(1, max_i + 1):
+            cur = prows + (i & 1) * W
+            # row 2 is the scratch row of the diag scores.
+            if use_matrix:
+                agap = _row_score_matrix(prev, cur, seqj, max_j,
+                        tab + 256 * <unsigned char>seqi[i - 1],
+                        NULL if pprof == NULL else
+                            pprof + W * pindex[<unsigned char>seqi[i - 1]],
+                        prows + 2 * W, i, max_i, agap, gap_open, gap_extend,
+                        _col0(i, gap_open, gap_extend, 1, GLOBAL))
             else:
-                if up_score >= left_score:
-                    score[<size_t>i, <size_t>j]  = up_score
-                    pointer[<size_t>i, <size_t>j] = UP
-                else:
-                    score[<size_t>i, <size_t>j]   = left_score
-                    pointer[<size_t>i, <size_t>j] = LEFT
+                agap = _row_score_no_matrix(prev, cur, seqj, max_j,
+                        seqi[i - 1], match, agap, gap_open, gap_extend,
+                        _col0(i, gap_open, gap_extend, 0, GLOBAL))
+            prev = cur
+            if cut != NULL and i % CUTOFF_EVERY == 0 and \
+                    _cut(cut, cur, 0, max_j, max_j, i, max_i):
+                return NEG
+    return prev[max_j]
 
-    seqlen = max_i + max_j
-    ai = PyString_FromStringAndSize(NULL, seqlen)
-    aj = PyString_FromStringAndSize(NULL, seqlen)
-
-    # had to use this and PyObject instead of assigning directly...
-    align_j = PyString_AS_STRING(aj)
-    align_i = PyString_AS_STRING(ai)
-        
-    p = pointer[i, j]
-    while p != NONE:
-        if p == DIAG:
-            i -= 1
-            j -= 1
-            align_j[align_counter] = seqj[j]
-            align_i[align_counter] = seqi[i]
-        elif p == LEFT:
-            j -= 1
-            align_j[align_counter] = seqj[j]
-            align_i[align_counter] = c"-"
-        elif p == UP:
-            i -= 1
-            align_j[align_counter] = c"-"
-            align_i[align_counter] = seqi[i]
-        else:
-            raise Exception('wtf!')
-        align_counter += 1
-        p = pointer[i, j]
-    _PyString_Resize(&aj, align_counter)
-    _PyString_Resize(&ai, align_counter)
-    return (<object>aj)[::-1], (<object>ai)[::-1] #, score.max()
+
+cdef class Aligner:
+    """
+    align one query against many targets with the same scoring. the matrix
+    is read and the query profile is made once, up front, so there is much
+    less work per target than with global_align. align(target) gives the
+    same result as global_align(query, target, ...) and score(target) the
+    same as global_score(query, target, ...), including the min_score and
+    xdrop cutoffs.
+
+    >>> from nwalign import Aligner
+    >>> a = Aligner('PELICAN', gap_open=-5, gap_extend=-2, matrix='PAM250')
+    >>> a.align('CEELECANTH')
+    ('-PELICAN--', 'CEELECANTH')
+    >>> a.score('CEELECANTH')
+    8
+    >>> list(a.align_many(['PELICAN', 'PELLICAN'], score_only=True))
+    [37, 32]
+    >>> Aligner('PELICAN', output='cigar').align('PELLICAN')
+    (6, '2M1I5M')
+
+    """
+    cdef readonly object query, matrix, band, linear_threshold, min_score, xdrop
+    cdef readonly object output
+    cdef readonly int match, gap_open, gap_extend
+    cdef object table, row_max, profile
+    cdef _Seq q
+
+    def __init__(self, query, matrix=None, int match=1, int gap_open=-1,
+                 int gap_extend=-1, band=None, linear_threshold=None,
+                 min_score=None, xdrop=None, output='strings'):
+        assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+        assert gap_open <= 0, "gap_open must be <= 0"
+        _check_output(output)
+        self.query = query
+        self.q = _seq(query)
+        self.matrix = matrix
+        self.match = match
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+        self.band = band
+        self.linear_threshold = linear_threshold
+        self.min_score = min_score
+        self.xdrop = xdrop
+        self.output = output
+        self.table = self.row_max = self.profile = None
+        if matrix is not None:
+            self.table, self.row_max = _matrix_entry(matrix)
+            if self.row_max is None:
+                self.row_max = _row_max(self.table)
+            self.profile = _profile(self.table, self.q.data, self.q.n)
+
+    cdef bint _direct(self, size_t max_i):
+        # the query profile can only be used when the query is along j.
+        return self.profile is not None and self.band is None and \
+                max_i >= self.q.n and max_i > 0
+
+    def align(self, target):
+        """
+        the alignment of the query and `target`, as (query, target) or as
+        set by `output` (see global_align).
+        """
+        cdef _Seq t = _seq(target)
+        cdef size_t max_j = self.q.n, max_i = t.n
+        cdef Cutoff cutoff
+        cdef Cutoff *cut = NULL
+        if not self._direct(max_i):
+            return global_align(self.query, target, self.match, self.gap_open,
+                                self.gap_extend, self.matrix,
+                                self.linear_threshold, self.band,
+                                self.min_score, self.xdrop, self.output)
+        if _make_cutoff(&cutoff, self.min_score, self.xdrop, self.table, 0,
+                        self.gap_open, self.gap_extend, self.row_max):
+            cut = &cutoff
+        r = _align(self.q.data, t.data, max_j, max_i, self.table, 0,
+                   self.gap_open, self.gap_extend,
+                   _use_linear(max_i, max_j, self.linear_threshold),
+                   self.profile, cut)
+        return _output(r, self.q.data, t.data, 0, self.output, self.table,
+                       self.gap_open, self.gap_extend)
+
+    def score(self, target):
+        """
+        the score of the query vs `target`. see global_score.
+        """
+        cdef _Seq t = _seq(target)
+        cdef size_t max_j = self.q.n, max_i = t.n
+        cdef Cutoff cutoff
+        cdef Cutoff *cut = NULL
+        cdef int score
+        if not self._direct(max_i):
+            return global_score(self.query, target, self.match, self.gap_open,
+                                self.gap_extend, self.matrix, self.min_score,
+                                self.xdrop)
+        if _make_cutoff(&cutoff, self.min_score, self.xdrop, self.table, 0,
+                        self.gap_open, self.gap_extend, self.row_max):
+            cut = &cutoff
+        score = _score(self.q.data, t.data, max_j, max_i, self.table, 0,
+                       self.gap_open, self.gap_extend, self.profile, cut)
+        if cut != NULL and (score == NEG or (cut.use_min and score < cut.min_score)):
+            return None
+        return score
+
+    def align_many(self, targets, score_only=False, ordered=True,
+                   threads=None, chunksize=8):
+        """
+        align (or score) the query against each of `targets` on a pool of
+        threads. see nwalign.batch.align_many for the arguments.
+        """
+        from nwalign.batch import aligner_many
+        return aligner_many(self, targets, score_only, ordered, threads,
+                            chunksize)
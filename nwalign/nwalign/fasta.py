@@ -0,0 +1,85 @@
+"""
+read the records of FASTA files for the batch command line. a record's name
+is the first word of its header.
+
+if pyfasta is installed, a file is opened as a pyfasta.Fasta, which
+memory-maps it (after writing a flattened copy and an index next to it the
+first time), so a huge file is never read into memory and any record can
+be looked up by name. otherwise, the file is parsed a record at a time, and
+`fasta_index` reads all of it into a dict.
+
+    >>> import tempfile
+    >>> fh = tempfile.NamedTemporaryFile(suffix='.fa')
+    >>> fh.write(">a first\\nACGT\\nAC\\n>b\\nGGT\\n"); fh.flush()
+    >>> list(read_fasta(fh.name))
+    [('a', 'ACGTAC'), ('b', 'GGT')]
+
+"""
+try:
+    from pyfasta import Fasta
+except ImportError:
+    Fasta = None
+
+__all__ = ['read_fasta', 'fasta_records', 'fasta_index']
+
+def _key(header):
+    words = header.split(None, 1)
+    return words[0] if words else ""
+
+def read_fasta(path):
+    """
+    yield the (name, sequence) of each record in the file at `path`,
+    without pyfasta.
+    """
+    fh = open(path)
+    try:
+        name, seq = None, []
+        for line in fh:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(seq)
+                name, seq = _key(line[1:]), []
+            elif line and name is not None:
+                seq.append(line)
+        if name is not None:
+            yield name, "".join(seq)
+    finally:
+        fh.close()
+
+class _Index(object):
+    """
+    the records of a pyfasta.Fasta by name (the first word of the header),
+    where pyfasta has them by the whole header.
+    """
+    def __init__(self, f):
+        self.fasta = f
+        self.keys = dict((_key(k), k) for k in f.keys())
+
+    def __getitem__(self, name):
+        return self.fasta[self.keys[name]]
+
+    def __contains__(self, name):
+        return name in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+def fasta_records(path):
+    """
+    the (name, sequence) of each record in the file at `path`, in the
+    order of the file. with pyfasta, the sequences are memory-mapped
+    records, which give the sequence with str().
+    """
+    if Fasta is None:
+        return read_fasta(path)
+    f = Fasta(path)
+    return ((_key(k), f[k]) for k in sorted(f.keys(), key=lambda k: f.index[k][0]))
+
+def fasta_index(path):
+    """
+    a mapping of name => sequence for the records in the file at `path`.
+    """
+    if Fasta is None:
+        return dict(read_fasta(path))
+    return _Index(Fasta(path))
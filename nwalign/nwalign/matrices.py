@@ -0,0 +1,173 @@
+"""
+scoring matrices as 256 x 256 integer arrays, indexed by the (unsigned)
+chars of a pair: mat[ord('C'), ord('A')] is the score for a 'C' against an
+'A'. entries for characters not in the matrix are 0. a matrix is int8 if
+its scores fit (as all the built-in ones do), otherwise int16 or int32.
+
+the built-in matrices are shipped as .npy files in nwalign/data and are
+loaded by name with a memory map, so they're read in microseconds and the
+pages are shared by every process that uses them.
+
+    >>> from nwalign.matrices import load_matrix, builtin_matrices
+    >>> 'BLOSUM62' in builtin_matrices()
+    True
+    >>> m = load_matrix('PAM250')
+    >>> m.shape, m.dtype, m[ord('W'), ord('W')]
+    ((256, 256), dtype('int8'), 17)
+
+a matrix can also be the path to a file in the NCBI format (as in the
+ncbi/data directory), the path to a .npy file from `save_matrix`, or an
+array. `register_matrix` adds a name for one of those.
+"""
+import os
+import threading
+import numpy as np
+
+__all__ = ['load_matrix', 'parse_matrix', 'save_matrix', 'register_matrix',
+           'builtin_matrices', 'MATRIX_DIR']
+
+MATRIX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# name or path => loaded matrix. a path to a file is looked up before the
+# registered and built-in names.
+_LOADED = {}
+_NAMES = {}
+_lock = threading.Lock()
+
+def builtin_matrices():
+    """
+    the names of the matrices in MATRIX_DIR.
+    """
+    if not os.path.isdir(MATRIX_DIR): return []
+    return sorted(f[:-4] for f in os.listdir(MATRIX_DIR) if f.endswith('.npy'))
+
+def _dtype(values, what):
+    """
+    the smallest of int8, int16 and int32 that holds the scores in the
+    array `values`.
+    """
+    if not values.size:
+        return np.int8
+    lo, hi = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    raise ValueError("scores in %s don't fit in an int32" % what)
+
+def parse_matrix(path):
+    """
+    read a matrix in the NCBI format into a 256 x 256 array (see _dtype).
+    """
+    fh = open(path)
+    try:
+        headers = None
+        rows = []
+        for line in fh:
+            line = line.strip()
+            if not line or line[0] == '#': continue
+            if headers is None:
+                headers = [ord(x) for x in line.split()]
+                continue
+            toks = line.split()
+            rows.append((ord(toks[0]), [int(x) for x in toks[1:]]))
+    finally:
+        fh.close()
+    if headers is None:
+        raise ValueError("no matrix in %s" % path)
+    values = np.array([v for _, v in rows], dtype=np.int64)
+    a = np.zeros((256, 256), dtype=_dtype(values, path))
+    for (c, vals) in rows:
+        a[c, headers[:len(vals)]] = vals
+    return a
+
+def _as_matrix(array):
+    array = np.asarray(array)
+    if array.ndim != 2 or array.shape[0] != array.shape[1] \
+            or array.shape[0] > 256:
+        raise ValueError("a matrix must be square, at most 256 x 256")
+    dtype = _dtype(array, "the matrix")
+    if array.dtype == dtype and array.shape[0] == 256:
+        return array
+    a = np.zeros((256, 256), dtype=dtype)
+    n = array.shape[0]
+    a[:n, :n] = array
+    return a
+
+def save_matrix(matrix, path):
+    """
+    save `matrix` (anything load_matrix takes) as a .npy file, which can be
+    passed to load_matrix, or to global_align, in any process.
+    """
+    np.save(path, load_matrix(matrix))
+
+def register_matrix(name, matrix):
+    """
+    make `name` refer to `matrix` (anything load_matrix takes).
+    """
+    m = load_matrix(matrix)
+    with _lock:
+        _NAMES[name] = m
+        _LOADED.pop(name, None)
+
+def _load(matrix):
+    if os.path.isfile(matrix):
+        if matrix.endswith('.npy'):
+            return _as_matrix(np.load(matrix, mmap_mode='r'))
+        return parse_matrix(matrix)
+    if matrix in _NAMES:
+        return _NAMES[matrix]
+    builtin = os.path.join(MATRIX_DIR, matrix + '.npy')
+    if os.sep not in matrix and os.path.exists(builtin):
+        return np.load(builtin, mmap_mode='r')
+    raise ValueError("%r isn't a matrix name (%s) or a file"
+                     % (matrix, ", ".join(builtin_matrices())))
+
+def load_matrix(matrix):
+    """
+    the 256 x 256 array for `matrix`: a path to a .npy or NCBI format
+    file, a registered or built-in name, or an array. names and paths are
+    cached. the scores are int8 unless they need more bits.
+
+    >>> import numpy as np
+    >>> m = load_matrix(np.array([[1, -1], [-1, 1]]))
+    >>> m.shape, m.dtype, m[1, 1], m[1, 2]
+    ((256, 256), dtype('int8'), 1, 0)
+    >>> load_matrix(np.array([[1000, -1], [-1, 1000]])).dtype
+    dtype('int16')
+
+    """
+    if not isinstance(matrix, basestring):
+        return _as_matrix(matrix)
+    try:
+        return _LOADED[matrix]
+    except KeyError:
+        pass
+    m = _load(matrix)
+    with _lock:
+        _LOADED[matrix] = m
+    return m
+
+def main(args=None):
+    """
+    compile NCBI format matrices into MATRIX_DIR (or --out).
+
+        $ python -m nwalign.matrices /usr/share/ncbi/data/BLOSUM* PAM*
+    """
+    import optparse
+    p = optparse.OptionParser(main.__doc__)
+    p.add_option("--out", dest="out", default=MATRIX_DIR,
+                 help="directory for the .npy files")
+    options, paths = p.parse_args(args)
+    if not paths:
+        p.print_help()
+        return 1
+    if not os.path.isdir(options.out):
+        os.makedirs(options.out)
+    for path in paths:
+        out = os.path.join(options.out, os.path.basename(path) + '.npy')
+        np.save(out, parse_matrix(path))
+        print out
+
+if __name__ == "__main__":
+    main()
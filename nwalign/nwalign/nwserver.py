@@ -1,55 +1,473 @@
+"""
+a server for global_align. connections are handled in a single select()
+loop and the alignments are done on a pool of processes, so a long
+alignment does not hold up other requests or other clients.
+
+each message (both ways) is a 4-byte length in network byte order
+followed by that many bytes. a request is
+
+    [--match m] [--gap_open o] [--gap_extend e] [--matrix name] seqj seqi
+
+and the response is the 2 aligned sequences separated by a space, or
+"ERROR:" and a message. a client can send many requests before reading;
+the responses on each connection are sent in the order of the requests.
+the request EXIT stops the server and STATS returns the counters of the
+result cache as JSON.
+
+many pairs with the same parameters can be sent in one BATCH request:
+
+    BATCH [--match m] [--gap_open o] [--gap_extend e] [--matrix name]
+    seqj seqi
+    seqj seqi
+    ...
+
+the pairs are aligned in parallel and each result is sent as its own
+message, "i alignedj alignedi" (or "i ERROR:message") where i is the
+index of the pair in the batch, in the order they finish. the message
+"END n" follows the last one. results of a batch are only sent after
+the responses to all earlier requests on the connection.
+
+results are cached (see nwalign.cache) by the sequences and parameters,
+so a pair that is sent again is not re-aligned.
+
+    $ nwalign --server 1233 --processes 4
+"""
 import sys
+import os
+import socket
+import select
+import struct
+import errno
+import fcntl
+import Queue
+from multiprocessing import Pool, cpu_count
+
+try:
+    from cnwalign import global_align
+except ImportError:
+    from pairwise import global_align
+from cache import AlignmentCache, cache_key
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+HEADER = struct.Struct("!I")
+CHUNK = 32768 * 8
+# larger frames are an error in the stream and close the connection.
+MAX_FRAME = 256 * 1024 * 1024
+# stop reading from a connection with this many requests in flight.
+MAX_PENDING = 1024
+# the pairs of a BATCH go to the pool in jobs of this many.
+BATCH_JOB = 32
+
+def _get_kwargs(kwargs):
+    kw = {}
+    for i, k in enumerate(kwargs[::2]):
+        k = k.lstrip('-')
+        if k == 'matrix':
+            kw[k] = kwargs[2 * i + 1]
+        else:
+            kw[k] = int(kwargs[2 * i + 1])
+    return kw
+
+def get_args(astr):
+    kwargsab = astr.split(" ")
+    a, b = kwargsab[-2:]
+    return a, b, _get_kwargs(kwargsab[:-2])
+
+def get_batch(astr):
+    r"""
+    the pairs and the parameters of a BATCH request.
+
+    >>> get_batch("BATCH --gap_open -2\nACGT AGT\nTT T")
+    ([('ACGT', 'AGT'), ('TT', 'T')], {'gap_open': -2})
+
+    """
+    lines = astr.split("\n")
+    kw = _get_kwargs(lines[0].split(" ")[1:])
+    pairs = []
+    for line in lines[1:]:
+        if not line: continue
+        pair = tuple(line.split(" "))
+        if len(pair) != 2:
+            raise ValueError("expected 'seqj seqi', got %r" % line[:50])
+        pairs.append(pair)
+    return pairs, kw
+
+def handle(data):
+    """
+    the response to a single request.
+
+    >>> handle("--gap_open -2 TTAAT TT")
+    'TTAAT TT---'
+    >>> handle("TT")
+    'ERROR:need more than 1 value to unpack'
+
+    """
+    try:
+        a, b, kwargs = get_args(data)
+        return " ".join(global_align(a, b, **kwargs))
+    except Exception, e:
+        return "ERROR:" + str(e)
+
+def _handle(args):
+    key, data = args
+    return key, handle(data)
+
+def _handle_batch(args):
+    key, kwargs, pairs = args
+    out = []
+    for a, b in pairs:
+        try:
+            out.append(" ".join(global_align(a, b, **kwargs)))
+        except Exception, e:
+            out.append("ERROR:" + str(e))
+    return key, out
+
+def _error(args, e):
+    """
+    the result of a task for _handle or _handle_batch that raised `e`:
+    an error for its request, or for each pair of its batch.
+    """
+    key, idx, ckey = args[0]
+    msg = "ERROR:" + str(e)
+    if isinstance(ckey, list):
+        return (key, idx, [(i, None) for i, k in ckey]), [msg] * len(ckey)
+    return (key, idx, None), msg
+
+def _run(func_args):
+    """
+    func(args) for a task of the server. if it raises, the task still
+    gives a result, so the responses after it on the connection are not
+    held up.
+
+    >>> _run((_handle_batch, ((0, 3, [(0, None)]), {}, [('A', 'C', 'G')])))
+    ((0, 3, [(0, None)]), ['ERROR:too many values to unpack'])
+
+    """
+    func, args = func_args
+    try:
+        return func(args)
+    except Exception, e:
+        return _error(args, e)
+
+def frame(data):
+    return HEADER.pack(len(data)) + data
 
-def main(port=1233):
-    import socket
-    from __init__ import global_align
-    import atexit
-
-    CHUNK = 32768 * 8
-    HOST = 'localhost' 
-
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((HOST, int(port)))
-    server.listen(4)
-    print "\nstarted server on %s:%i\n" % (HOST, int(port))
-
-    def get_args(astr):
-        kwargsab = astr.split(" ")
-        a, b = kwargsab[-2:]
-        kwargs = kwargsab[:-2]
-        kw = {}
-        for i, k in enumerate(kwargs[::2]):
-            k = k.lstrip('-')
-            if k == 'matrix':
-                kw[k] = kwargs[2 * i + 1]
+def send_frame(sock, data):
+    sock.sendall(frame(data))
+
+def _recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, CHUNK))
+        if not chunk:
+            if chunks: raise EOFError("connection closed inside a frame")
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return "".join(chunks)
+
+def recv_frame(sock):
+    """
+    read a single message from a blocking socket. returns None if the
+    connection is closed.
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None: return None
+    n, = HEADER.unpack(header)
+    if n == 0: return ""
+    data = _recv_exactly(sock, n)
+    if data is None: raise EOFError("connection closed inside a frame")
+    return data
+
+
+class _Batch(object):
+    """
+    the results of a BATCH request that are ready to be sent.
+    """
+    def __init__(self, n):
+        self.n = self.left = n
+        self.frames = [] if n else ["END 0"]
+
+    def add(self, i, data):
+        self.frames.append("%i %s" % (i, data))
+        self.left -= 1
+        if not self.left:
+            self.frames.append("END %i" % self.n)
+
+
+class Connection(object):
+    """
+    the buffers of a client connection. requests are numbered as they
+    arrive and finished responses are held in `done` until all earlier
+    ones have been sent. a _Batch in `done` is sent as its results come
+    in.
+    """
+    def __init__(self, sock, key):
+        self.sock = sock
+        self.key = key
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.next_id = 0
+        self.next_out = 0
+        self.done = {}
+        self.closing = False
+
+    def pending(self):
+        return self.next_id - self.next_out
+
+    def frames(self):
+        """
+        take the complete messages off the input buffer.
+        """
+        buf, off, frames = self.inbuf, 0, []
+        while len(buf) - off >= HEADER.size:
+            n, = HEADER.unpack_from(buf, off)
+            if n > MAX_FRAME:
+                raise ValueError("frame of %i bytes is too large" % n)
+            if len(buf) - off - HEADER.size < n: break
+            off += HEADER.size
+            frames.append(str(buf[off:off + n]))
+            off += n
+        if off: del buf[:off]
+        return frames
+
+    def add_result(self, idx, data):
+        self.done[idx] = data
+        self.flush()
+
+    def flush(self):
+        """
+        move what can be sent (in order) to the output buffer.
+        """
+        while self.next_out in self.done:
+            r = self.done[self.next_out]
+            if isinstance(r, _Batch):
+                for f in r.frames:
+                    self.outbuf.extend(frame(f))
+                r.frames = []
+                if r.left: return
             else:
-                kw[k] = int(kwargs[2 * i + 1])
-        return a, b, kw
-
-    while True:
-        client, address = server.accept()
-        data = True 
-        while data:
-            try: 
-                data = client.recv(CHUNK).strip()
-                if data == "EXIT":
-                    client.close()
-                    server.close()
-                    print "EXITING service"
-                    sys.exit(0)
-
-                a,b, kwargs = get_args(data)
-                r = global_align(a, b, **kwargs)
-                client.send(" ".join(r))
-            except Exception, e:
+                self.outbuf.extend(frame(r))
+            del self.done[self.next_out]
+            self.next_out += 1
+
+
+class Server(object):
+    """
+    serve alignments on (host, port) with a pool of `processes` (default:
+    the number of cpus). with processes=0, requests are handled in the
+    server loop itself. port 0 picks a free port; see `address`.
+    up to `cache_bytes` of results are cached; 0 turns off the cache.
+    """
+    def __init__(self, host='localhost', port=1233, processes=None,
+                 cache_bytes=64 * 1024 * 1024):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, int(port)))
+        self.server.listen(128)
+        self.server.setblocking(0)
+        self.address = self.server.getsockname()
+        if processes is None: processes = cpu_count()
+        self.pool = Pool(processes) if processes else None
+        self.cache = AlignmentCache(cache_bytes) if cache_bytes else None
+        # results come back on a pool thread; they are queued and the
+        # select() is woken by a byte on the pipe.
+        self.results = Queue.Queue()
+        self.wake_r, self.wake_w = os.pipe()
+        fcntl.fcntl(self.wake_w, fcntl.F_SETFL, os.O_NONBLOCK)
+        # socket -> Connection, and the key of each connection (which is
+        # sent with its requests) -> Connection.
+        self.conns = {}
+        self.keys = {}
+        self.next_key = 0
+        self.running = False
+
+    def _callback(self, key_result):
+        self.results.put(key_result)
+        try:
+            os.write(self.wake_w, "x")
+        except OSError, e:
+            # the pipe is full, so the loop will wake up anyway.
+            if e.errno != errno.EAGAIN: raise
+
+    def submit(self, func, args):
+        if self.pool is None:
+            return self._callback(_run((func, args)))
+        try:
+            self.pool.apply_async(_run, ((func, args),),
+                                  callback=self._callback)
+        except Exception, e:
+            self._callback(_error(args, e))
+
+    def _accept(self):
+        try:
+            sock, address = self.server.accept()
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK): return
+            raise
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = self.conns[sock] = Connection(sock, self.next_key)
+        self.keys[conn.key] = conn
+        self.next_key += 1
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(CHUNK)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            return self._close(conn)
+        if not data:
+            # finish sending what was asked for, then close.
+            conn.closing = True
+            if not conn.pending() and not conn.outbuf: self._close(conn)
+            return
+        conn.inbuf.extend(data)
+        try:
+            frames = conn.frames()
+        except ValueError:
+            return self._close(conn)
+        for data in frames:
+            if data == "EXIT":
+                self.running = False
+                return
+            idx = conn.next_id
+            conn.next_id += 1
+            if data == "STATS":
+                conn.add_result(idx, json.dumps(self.stats()))
+                continue
+            if data.startswith(("BATCH ", "BATCH\n")):
+                self._batch(conn, idx, data)
+                continue
+            ckey = None
+            if self.cache is not None:
+                try:
+                    a, b, kwargs = get_args(data)
+                    ckey = cache_key(a, b, **kwargs)
+                except Exception:
+                    # let handle() report the error.
+                    pass
+                else:
+                    r = self.cache.get(ckey)
+                    if r is not None:
+                        conn.add_result(idx, r)
+                        continue
+            self.submit(_handle, ((conn.key, idx, ckey), data))
+
+    def _batch(self, conn, idx, data):
+        try:
+            pairs, kwargs = get_batch(data)
+        except Exception, e:
+            return conn.add_result(idx, "ERROR:" + str(e))
+        batch = conn.done[idx] = _Batch(len(pairs))
+        todo = []
+        for i, (a, b) in enumerate(pairs):
+            ckey = None
+            if self.cache is not None:
+                ckey = cache_key(a, b, **kwargs)
+                r = self.cache.get(ckey)
+                if r is not None:
+                    batch.add(i, r)
+                    continue
+            todo.append((i, ckey, (a, b)))
+        for start in xrange(0, len(todo), BATCH_JOB):
+            job = todo[start:start + BATCH_JOB]
+            self.submit(_handle_batch,
+                        ((conn.key, idx, [(i, ckey) for i, ckey, p in job]),
+                         kwargs, [p for i, ckey, p in job]))
+        conn.flush()
+
+    def _write(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            return self._close(conn)
+        del conn.outbuf[:sent]
+        if conn.closing and not conn.outbuf and not conn.pending():
+            self._close(conn)
+
+    def _close(self, conn):
+        self.conns.pop(conn.sock, None)
+        self.keys.pop(conn.key, None)
+        conn.sock.close()
+
+    def _drain_results(self):
+        os.read(self.wake_r, 4096)
+        while True:
+            try:
+                (key, idx, ckey), data = self.results.get_nowait()
+            except Queue.Empty:
+                return
+            # the client may have gone away.
+            conn = self.keys.get(key)
+            if isinstance(data, list):
+                # part of a batch; ckey has the (index, cache key) of each.
+                for (i, k), r in zip(ckey, data):
+                    if k is not None and not r.startswith("ERROR:"):
+                        self.cache.put(k, r)
+                    if conn is not None: conn.done[idx].add(i, r)
+                if conn is not None: conn.flush()
+                continue
+            if ckey is not None and not data.startswith("ERROR:"):
+                self.cache.put(ckey, data)
+            if conn is None: continue
+            conn.add_result(idx, data)
+
+    def stats(self):
+        s = {'connections': len(self.conns)}
+        if self.cache is not None:
+            s['cache'] = self.cache.stats()
+        return s
+
+    def serve_forever(self):
+        self.running = True
+        try:
+            while self.running:
+                rlist = [self.server, self.wake_r]
+                rlist.extend(s for s, c in self.conns.iteritems()
+                             if not c.closing and c.pending() < MAX_PENDING)
+                wlist = [s for s, c in self.conns.iteritems() if c.outbuf]
                 try:
-                    client.send("ERROR:" + str(e))
-                except socket.error:
-                    # they already closed...
-                    client.close()
-                    break
+                    readable, writable, _ = select.select(rlist, wlist, [])
+                except select.error, e:
+                    if e.args[0] == errno.EINTR: continue
+                    raise
+                for s in readable:
+                    if s is self.server:
+                        self._accept()
+                    elif s == self.wake_r:
+                        self._drain_results()
+                    elif s in self.conns:
+                        self._read(self.conns[s])
+                for s in writable:
+                    if s in self.conns:
+                        self._write(self.conns[s])
+        finally:
+            self.close()
 
+    def close(self):
+        for conn in self.conns.values():
+            self._close(conn)
+        self.server.close()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        for fd in (self.wake_r, self.wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
 
-    client.close()
 
-    atexit.register(server.close)
+def main(port=1233, processes=None, host='localhost',
+         cache_bytes=64 * 1024 * 1024):
+    server = Server(host, port, processes, cache_bytes)
+    print >>sys.stderr, "\nstarted server on %s:%i\n" % server.address
+    server.serve_forever()
+    print >>sys.stderr, "EXITING service"
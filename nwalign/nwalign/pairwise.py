@@ -0,0 +1,545 @@
+"""
+a numpy version of the aligners in cnwalign, which nwalign uses when the
+extension can't be imported (e.g. where there is no compiler). it gives the
+same results as cnwalign, but is much slower, so it's meant for sequences
+of up to a few thousand characters.
+
+each row of the DP is filled with array operations. the cell to the left
+is the only dependency within a row, and when it's taken, the score is
+the best of a run of cells, each plus the gaps after it, so a row is a
+cumulative max restarted at the cells that take the diagonal. those cells
+are guessed, then the guess is checked and fixed from the first cell that
+was wrong until it is consistent. the traceback pointers are kept for the
+whole matrix (1 byte per cell), so `band` and `linear_threshold` are
+accepted but the whole matrix is always filled.
+
+    >>> from nwalign.pairwise import global_align
+    >>> global_align('COELANCANTH', 'PELICAN')
+    ('COELANCANTH', '-PEL-ICAN--')
+    >>> global_align('CEELECANTH', 'PELICAN', gap_open=-5, gap_extend=-2,
+    ...              matrix='PAM250')
+    ('CEELECANTH', '-PELICAN--')
+
+"""
+import numpy as np
+
+from matrices import load_matrix
+
+__all__ = ['global_align', 'global_align_no_matrix', 'global_score',
+           'semiglobal_align', 'local_align', 'edit_distance',
+           'score_alignment', 'score_alignments', 'Aligner']
+
+UP, LEFT, DIAG, NONE = 1, 2, 3, 4
+STOP = 0
+GLOBAL, SEMIGLOBAL, LOCAL = 0, 1, 2
+NEG = -(1 << 28)
+
+# rows between checks of xdrop, as in cnwalign.
+CUTOFF_EVERY = 8
+
+OP_MATCH, OP_INS, OP_DEL = 0, 1, 2
+_OPS = np.array([255, OP_INS, OP_DEL, OP_MATCH], dtype=np.uint8)
+_OPS_FLIP = np.array([255, OP_DEL, OP_INS, OP_MATCH], dtype=np.uint8)
+_OUTPUTS = ('strings', 'cigar', 'ops')
+
+GAP = ord('-')
+
+def _bytes(s):
+    """
+    the characters of a sequence as a uint8 array.
+    """
+    if isinstance(s, np.ndarray):
+        if s.dtype.itemsize != 1:
+            raise ValueError("sequence buffers must have 1-byte items")
+        return np.ascontiguousarray(s).view(np.uint8).ravel()
+    if not isinstance(s, str):
+        s = bytearray(s) if isinstance(s, (bytearray, memoryview)) else str(s)
+    return np.frombuffer(bytes(s), dtype=np.uint8)
+
+def _segmax(v, reset):
+    """
+    np.maximum.accumulate of v, restarted at each True in reset, which
+    must be True at 0.
+    """
+    off = np.cumsum(reset) * (v.max() - v.min() + 1)
+    return np.maximum.accumulate(v + off) - off
+
+def _row_matrix(prev, mrow, i, max_i, agap_prev, gap_open, gap_extend, col0):
+    """
+    row i of the DP for global_align given row i - 1 in prev. `mrow` has
+    the score of seqi[i - 1] vs each character of seqj and col0 is the
+    score of column 0 (see _col0). returns the
+    scores, the pointers and the gap flag of the row. this makes the same
+    choices as cnwalign._row_matrix: the score of a cell is the diagonal
+    if it ties with up or left, otherwise the best of the 3.
+    """
+    W = len(prev)
+    cur = np.empty(W, dtype=np.int64)
+    ptr = np.empty(W, dtype=np.uint8)
+    cur[0] = col0
+    ptr[0] = UP
+    if W == 1:
+        return cur, ptr, 1
+    d = prev[:-1] + mrow
+    u = prev[1:] + (gap_open if agap_prev == 0 else gap_extend)
+    g = np.empty(W - 1, dtype=np.int64)
+    g[:] = gap_extend
+    g[0] = gap_open
+    G = np.concatenate(([0], np.cumsum(g)))
+    # a cell where diag ties up scores the diagonal whatever is to its left.
+    tie = d == u
+    # the only other cells that don't score the best of the 3 are where left
+    # ties the diagonal but up is better. which they are is guessed.
+    odd = np.zeros(W - 1, dtype=bool)
+    l = np.empty(W - 1, dtype=np.int64)
+    s = 0
+    while True:
+        reset = np.concatenate(([True], tie[s:] | odd[s:]))
+        val = np.concatenate(([cur[s]], np.where(reset[1:], d[s:], np.maximum(d[s:], u[s:]))))
+        cur[s:] = G[s:] + _segmax(val - G[s:], reset)
+        l[s:] = cur[s:-1] + g[s:]
+        check = ~tie[s:] & (l[s:] == d[s:]) & (u[s:] > d[s:])
+        wrong = np.flatnonzero(check != odd[s:])
+        if not len(wrong): break
+        # the cells before the first wrong one are right, and the check of
+        # the others is the next guess.
+        s += wrong[0]
+        odd[s:] = check[wrong[0]:]
+
+    tie_left = LEFT if (i == max_i or i == 1) else DIAG
+    tie_up = np.empty(W - 1, dtype=np.uint8)
+    tie_up[:] = DIAG
+    tie_up[0] = tie_up[-1] = UP
+    p = np.where(u > d, np.where(u > l, UP, LEFT), np.where(l > d, LEFT, DIAG))
+    p = np.where(d == u, tie_up, p)
+    p = np.where(d == l, tie_left, p)
+    ptr[1:] = p
+    return cur, ptr, int(not (p == DIAG).any())
+
+def _row_no_matrix(prev, eq, i, match, agap_prev, gap_open, gap_extend,
+                   col0):
+    """
+    row i of the DP for global_align_no_matrix. `eq` is where seqj matches
+    seqi[i - 1]. see _row_matrix and cnwalign._row_no_matrix: here, the
+    gap penalties (and a mismatch) depend on whether the cell to the left
+    took the diagonal, so the guess is of the cells that take it.
+    """
+    W = len(prev)
+    cur = np.empty(W, dtype=np.int64)
+    ptr = np.empty(W, dtype=np.uint8)
+    cur[0] = col0
+    ptr[0] = UP
+    if W == 1:
+        return cur, ptr, 1
+    u = prev[1:] + (gap_extend if agap_prev == 1 else gap_open)
+    # the diagonal when the cell to the left took it (d0) or didn't (d1).
+    d0 = prev[:-1] + np.where(eq, match, gap_open)
+    d1 = prev[:-1] + np.where(eq, match, gap_extend if agap_prev == 1 else gap_open)
+    if gap_open == gap_extend:
+        # every gap costs the same, so each cell is just the best of the 3.
+        G = gap_open * np.arange(W, dtype=np.int64)
+        cur[:] = G + np.maximum.accumulate(
+                    np.concatenate(([cur[0]], np.maximum(d0, u))) - G)
+        l = cur[:-1] + gap_open
+        diag = (d0 >= u) & (d0 >= l)
+        ptr[1:] = np.where(diag, DIAG, np.where((d0 < u) & (u >= l), UP, LEFT))
+        return cur, ptr, int(not diag.any())
+    diag = d1 >= u
+    d = np.empty(W - 1, dtype=np.int64)
+    l = np.empty(W - 1, dtype=np.int64)
+    s = 0
+    while True:
+        # column 0 counts as a diagonal.
+        agap_left = np.concatenate(([s > 0 and not diag[s - 1]], ~diag[s:-1]))
+        d[s:] = np.where(agap_left, d1[s:], d0[s:])
+        g = np.where(agap_left, gap_extend, gap_open)
+        G = np.concatenate(([0], np.cumsum(g)))
+        val = np.concatenate(([cur[s]], np.where(diag[s:], d[s:],
+                                           np.where(u[s:] > d[s:], u[s:], NEG))))
+        cur[s:] = G + _segmax(val - G, np.concatenate(([True], diag[s:])))
+        l[s:] = cur[s:-1] + g
+        check = (d[s:] >= u[s:]) & (d[s:] >= l[s:])
+        wrong = np.flatnonzero(check != diag[s:])
+        if not len(wrong): break
+        diag[s + wrong[0]:] = check[wrong[0]:]
+        s += wrong[0]
+        # a wrong guess usually makes the next few cells wrong too, so they
+        # are done one at a time before trying the rest of the row again.
+        e = min(s + WALK, W - 1)
+        _walk(cur, diag, d, l, d0, d1, u, s, e, gap_open, gap_extend)
+        s = e
+        if s == W - 1: break
+    ptr[1:] = np.where(diag, DIAG, np.where((d < u) & (u >= l), UP, LEFT))
+    return cur, ptr, int(not diag.any())
+
+# cells _row_no_matrix fills one at a time after a wrong guess.
+WALK = 64
+
+def _walk(cur, diag, d, l, d0, d1, u, s, e, gap_open, gap_extend):
+    """
+    fill cells s .. e - 1 of a row for _row_no_matrix in a loop, as
+    cnwalign._row_no_matrix does.
+    """
+    agap_left = s > 0 and not diag[s - 1]
+    v = cur[s]
+    for k, dk0, dk1, uk in zip(range(s, e), d0[s:e].tolist(),
+                               d1[s:e].tolist(), u[s:e].tolist()):
+        dk = dk1 if agap_left else dk0
+        lk = v + (gap_extend if agap_left else gap_open)
+        if dk >= uk and dk >= lk:
+            v = dk
+            agap_left = False
+        else:
+            v = uk if (dk < uk and uk >= lk) else lk
+            agap_left = True
+        d[k] = dk
+        l[k] = lk
+        cur[k + 1] = v
+        diag[k] = not agap_left
+
+def _col0(i, gap_open, gap_extend, use_matrix, mode):
+    """
+    the score of column 0 of row i (or row 0 of column i), as in cnwalign.
+    """
+    if mode != GLOBAL or i == 0:
+        return 0
+    if use_matrix:
+        return gap_open + gap_extend * (i - 1)
+    return gap_open * i
+
+def _dp(sj, si, table, match, gap_open, gap_extend, traceback, xdrop=None,
+        mode=GLOBAL):
+    """
+    the DP of seqj (along j) vs seqi. returns the final score, the pointers
+    for every cell if traceback (or None) and the (i, j) of the cell where
+    the alignment ends, or None if it was stopped by xdrop. see
+    cnwalign._align and cnwalign._align_local for the modes.
+    """
+    assert xdrop is None or xdrop >= 0, "xdrop must be >= 0"
+    max_j, max_i = len(sj), len(si)
+    use_matrix = table is not None
+    prev = np.array([_col0(j, gap_open, gap_extend, use_matrix, mode)
+                     for j in range(max_j + 1)], dtype=np.int64)
+    ptrs = None
+    if traceback:
+        ptrs = np.empty((max_i + 1, max_j + 1), dtype=np.uint8)
+        ptrs[0] = STOP if mode == LOCAL else LEFT
+    agap = 0
+    best = NEG
+    end = (max_i, max_j)
+    # the best cell of the last column for SEMIGLOBAL, or the best cell for
+    # LOCAL.
+    top, top_i = 0, 0
+    for i in range(1, max_i + 1):
+        col0 = _col0(i, gap_open, gap_extend, use_matrix, mode)
+        if use_matrix:
+            prev, ptr, agap = _row_matrix(prev, table[si[i - 1]][sj], i,
+                                          max_i, agap, gap_open, gap_extend,
+                                          col0)
+        else:
+            prev, ptr, agap = _row_no_matrix(prev, sj == si[i - 1], i, match,
+                                             agap, gap_open, gap_extend, col0)
+        if mode == LOCAL:
+            stop = prev <= 0
+            prev[stop] = 0
+            ptr[stop] = STOP
+            agap = int(not (ptr == DIAG).any())
+            if prev.max() > top:
+                top, end = int(prev.max()), (i, int(prev.argmax()))
+        elif mode == SEMIGLOBAL and i < max_i and prev[-1] > top:
+            top, top_i = int(prev[-1]), i
+        if traceback:
+            ptrs[i] = ptr
+        if xdrop is not None and i % CUTOFF_EVERY == 0:
+            row_max = prev.max()
+            if row_max > best:
+                best = row_max
+            elif row_max < best - xdrop:
+                return None
+    score = int(prev[-1])
+    if mode == LOCAL:
+        score = top
+    elif mode == SEMIGLOBAL:
+        if top > score:
+            score, end = top, (top_i, max_j)
+        if max_j and prev[:-1].max() > score:
+            score, end = int(prev[:-1].max()), (max_i, int(prev[:-1].argmax()))
+    return score, ptrs, end
+
+def _traceback(ptrs, end=None):
+    """
+    the pointers from the end of the alignment back to the start, from the
+    cell `end` (default: the last), and the cell where the alignment
+    starts: (0, 0) or a cell with the pointer STOP.
+    """
+    i, j = end or (ptrs.shape[0] - 1, ptrs.shape[1] - 1)
+    ops = []
+    while i != 0 or j != 0:
+        p = ptrs[0, j] if i == 0 else ptrs[i, j]
+        if p == STOP: break
+        ops.append(p)
+        if p != LEFT: i -= 1
+        if p != UP: j -= 1
+    return np.array(ops, dtype=np.uint8), (i, j)
+
+def _cigar(ops):
+    """
+    the run-length CIGAR string of an array of ops.
+
+    >>> _cigar(np.array([0, 0, 1, 0, 2, 2], dtype=np.uint8))
+    '2M1I1M2D'
+
+    """
+    if len(ops) == 0:
+        return ""
+    starts = np.flatnonzero(ops[1:] != ops[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.append(starts, len(ops)))
+    return "".join(["%i%s" % (n, "MID"[o]) for n, o
+                                          in zip(lengths, ops[starts])])
+
+def _output(ptrs, score, sj, si, flip, output):
+    ops = ptrs[::-1]
+    if output == 'strings':
+        aj = np.empty(len(ops), dtype=np.uint8)
+        ai = np.empty(len(ops), dtype=np.uint8)
+        aj[:] = ai[:] = GAP
+        aj[ops != UP] = sj
+        ai[ops != LEFT] = si
+        aj, ai = aj.tostring(), ai.tostring()
+        return (ai, aj) if flip else (aj, ai)
+    ops = (_OPS_FLIP if flip else _OPS)[ops]
+    if output == 'ops':
+        return score, ops
+    return score, _cigar(ops)
+
+def _check_output(output):
+    if output not in _OUTPUTS:
+        raise ValueError("output must be one of %s, not %r" % (
+                         ", ".join(_OUTPUTS), output))
+
+def _align(sj, si, table, match, gap_open, gap_extend, min_score, xdrop,
+           flip, output):
+    r = _dp(sj, si, table, match, gap_open, gap_extend, 1, xdrop)
+    if r is None: return None
+    score, ptrs, _ = r
+    if min_score is not None and score < min_score:
+        return None
+    ptrs = _traceback(ptrs)[0]
+    if table is not None and output != 'strings':
+        a, b = _output(ptrs, score, sj, si, flip, 'strings')
+        score = score_alignment(a, b, gap_open, gap_extend, table)
+    return _output(ptrs, score, sj, si, flip, output)
+
+def global_align(seqj, seqi, match=1, gap_open=-1, gap_extend=-1,
+                 matrix=None, linear_threshold=None, band=None,
+                 min_score=None, xdrop=None, output='strings'):
+    """
+    see cnwalign.global_align.
+    """
+    if matrix is None:
+        return global_align_no_matrix(seqj, seqi, match, gap_open,
+                                      gap_extend, linear_threshold, band,
+                                      min_score, xdrop, output)
+    _check_output(output)
+    sj, si = _bytes(seqj), _bytes(seqi)
+    flip = len(sj) > len(si)
+    if flip:
+        sj, si = si, sj
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    table = load_matrix(matrix).astype(np.int64)
+    return _align(sj, si, table, 0, gap_open, gap_extend, min_score, xdrop,
+                  flip, output)
+
+def global_align_no_matrix(seqj, seqi, match, gap_open, gap_extend,
+                           linear_threshold=None, band=None, min_score=None,
+                           xdrop=None, output='strings'):
+    """
+    see cnwalign.global_align_no_matrix.
+    """
+    _check_output(output)
+    sj, si = _bytes(seqj), _bytes(seqi)
+    assert gap_extend <= 0, "gap penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    return _align(sj, si, None, match, gap_open, gap_extend, min_score, xdrop,
+                  False, output)
+
+def global_score(seqj, seqi, match=1, gap_open=-1, gap_extend=-1,
+                 matrix=None, min_score=None, xdrop=None):
+    """
+    see cnwalign.global_score.
+
+    >>> global_score('COELANCANTH', 'PELICAN')
+    -1
+
+    """
+    sj, si = _bytes(seqj), _bytes(seqi)
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    table = None
+    if matrix is not None:
+        table = load_matrix(matrix).astype(np.int64)
+        if len(sj) > len(si):
+            sj, si = si, sj
+    r = _dp(sj, si, table, match, gap_open, gap_extend, 0, xdrop)
+    if r is None or min_score is not None and r[0] < min_score:
+        return None
+    return r[0]
+
+def semiglobal_align(seqj, seqi, match=1, gap_open=-1, gap_extend=-1,
+                     matrix=None, linear_threshold=None, output='strings'):
+    """
+    see cnwalign.semiglobal_align.
+
+    >>> semiglobal_align('TTTTACGTACGT', 'ACGTACGTGGGG')
+    ('TTTTACGTACGT----', '----ACGTACGTGGGG')
+
+    """
+    _check_output(output)
+    sj, si = _bytes(seqj), _bytes(seqi)
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    table = None if matrix is None else load_matrix(matrix).astype(np.int64)
+    score, ptrs, (i, j) = _dp(sj, si, table, match if table is None else 0,
+                              gap_open, gap_extend, 1, mode=SEMIGLOBAL)
+    # the free gaps after the end cell.
+    ends = [UP] * (len(si) - i) + [LEFT] * (len(sj) - j)
+    ops = np.concatenate((np.array(ends, dtype=np.uint8),
+                          _traceback(ptrs, (i, j))[0]))
+    if table is not None and output != 'strings':
+        a, b = _output(ops, score, sj, si, False, 'strings')
+        both = np.flatnonzero((np.frombuffer(a, dtype=np.uint8) != GAP) &
+                              (np.frombuffer(b, dtype=np.uint8) != GAP))
+        score = 0
+        if len(both):
+            k0, k1 = both[0], both[-1] + 1
+            score = score_alignment(a[k0:k1], b[k0:k1], gap_open,
+                                    gap_extend, table)
+    return _output(ops, score, sj, si, False, output)
+
+def local_align(seqj, seqi, match=1, gap_open=-1, gap_extend=-1,
+                matrix=None, output='strings'):
+    """
+    see cnwalign.local_align.
+
+    >>> local_align('GGGGACGTACGTCC', 'TTACGTACGTAA')
+    ('ACGTACGT', 'ACGTACGT', (4, 2), (12, 10))
+
+    """
+    _check_output(output)
+    sj, si = _bytes(seqj), _bytes(seqi)
+    assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+    assert gap_open <= 0, "gap_open must be <= 0"
+    table = None if matrix is None else load_matrix(matrix).astype(np.int64)
+    score, ptrs, (i1, j1) = _dp(sj, si, table, match if table is None else 0,
+                                gap_open, gap_extend, 1, mode=LOCAL)
+    if score == 0:
+        i1 = j1 = 0
+    ops, (i0, j0) = _traceback(ptrs, (i1, j1))
+    if table is not None and output != 'strings':
+        a, b = _output(ops, score, sj[j0:j1], si[i0:i1], False, 'strings')
+        score = score_alignment(a, b, gap_open, gap_extend, table)
+    r = _output(ops, score, sj[j0:j1], si[i0:i1], False, output)
+    return r + ((j0, i0), (j1, i1))
+
+def edit_distance(seqj, seqi):
+    """
+    the levenshtein distance between 2 sequences.
+
+    >>> edit_distance('kitten', 'sitting')
+    3
+
+    """
+    return -global_score(seqj, seqi, 0, -1, -1)
+
+def score_alignment(a, b, gap_open, gap_extend, matrix):
+    return int(score_alignments([a], [b], gap_open, gap_extend, matrix)[0])
+
+def _rows(x):
+    """
+    a 2-D uint8 array of aligned rows, padded with NULs, and the length of
+    each row.
+    """
+    if isinstance(x, np.ndarray) and x.dtype.itemsize == 1:
+        rows = x.view(np.uint8)
+        if rows.ndim == 1: rows = rows[None]
+        if rows.ndim != 2:
+            raise ValueError("aligned rows must be a 1-D or 2-D array")
+        return rows, np.repeat(rows.shape[1], rows.shape[0])
+    if isinstance(x, basestring):
+        x = [x]
+    x = [_bytes(r).tostring() for r in x]
+    lengths = np.array([len(r) for r in x], dtype=np.intp)
+    L = max(lengths.max() if len(x) else 0, 1)
+    return np.array(x, dtype='S%i' % L).view(np.uint8).reshape(len(x), L), lengths
+
+def score_alignments(a, b, gap_open, gap_extend, matrix):
+    """
+    see cnwalign.score_alignments. the scores of the substitutions are
+    looked up for all columns at once and a gap is opened at each column
+    that starts a run of gap columns.
+
+    >>> score_alignments(['COELANCANTH', 'CEELECANTH'],
+    ...                  ['-PEL-ICAN--', '-PELICAN--'], -5, -2, 'PAM250')
+    array([ 7, 11], dtype=int32)
+
+    """
+    A, la = _rows(a)
+    B, lb = _rows(b)
+    if len(A) != len(B) and 1 not in (len(A), len(B)):
+        raise ValueError("a and b must have the same number of rows")
+    assert A.shape[1] == B.shape[1] and (la == lb).all(), \
+            "alignment lengths must be the same"
+    m = load_matrix(matrix).astype(np.int32).ravel()
+    lengths = la if len(la) >= len(lb) else lb
+    gap = (A == GAP) | (B == GAP)
+    nopen = np.count_nonzero(gap[:, 1:] > gap[:, :-1], axis=1) + gap[:, 0]
+    # the NULs that pad shorter rows score nothing.
+    pad = np.arange(A.shape[1]) >= lengths[:, None]
+    sub = np.where(gap | pad, 0, m[(A.astype(np.intp) << 8) | B])
+    return (sub.sum(axis=1) + gap_open * nopen +
+            gap_extend * (np.count_nonzero(gap, axis=1) - nopen)).astype(np.int32)
+
+
+class Aligner(object):
+    """
+    see cnwalign.Aligner. here, it only holds the arguments.
+    """
+    def __init__(self, query, matrix=None, match=1, gap_open=-1,
+                 gap_extend=-1, band=None, linear_threshold=None,
+                 min_score=None, xdrop=None, output='strings'):
+        assert gap_extend <= 0, "gap_extend penalty must be <= 0"
+        assert gap_open <= 0, "gap_open must be <= 0"
+        _check_output(output)
+        self.query = query
+        self.matrix = matrix
+        self.match = match
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+        self.band = band
+        self.linear_threshold = linear_threshold
+        self.min_score = min_score
+        self.xdrop = xdrop
+        self.output = output
+
+    def align(self, target):
+        return global_align(self.query, target, self.match, self.gap_open,
+                            self.gap_extend, self.matrix,
+                            self.linear_threshold, self.band, self.min_score,
+                            self.xdrop, self.output)
+
+    def score(self, target):
+        return global_score(self.query, target, self.match, self.gap_open,
+                            self.gap_extend, self.matrix, self.min_score,
+                            self.xdrop)
+
+    def align_many(self, targets, score_only=False, ordered=True,
+                   threads=None, chunksize=8):
+        from nwalign.batch import aligner_many
+        return aligner_many(self, targets, score_only, ordered, threads,
+                            chunksize)
+
+if __name__ == "__main__":
+    import sys
+    print "\n".join(global_align(sys.argv[1], sys.argv[2]))
@@ -1,36 +1,109 @@
-import socket
+"""
+benchmark a running nwserver: for each level of concurrency, that many
+connections each send --requests requests (keeping up to --pipeline in
+flight) and the requests per second and latency percentiles are reported.
+with --batch, the pairs are sent in BATCH requests of that many pairs and
+the latency is that of a whole batch.
 
-PORT = 1233
-CHUNK = 32768 * 8
+    $ nwalign --server 1233 &
+    $ python nwclient.py --concurrency 1,4,16 --pipeline 8
+    $ python nwclient.py --concurrency 1,4 --batch 1000
+"""
+import sys
+import time
+import random
+import threading
+import optparse
+import collections
 
-def main():
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client_socket.connect(('localhost', PORT))
+from nwalign.client import Client
+
+def random_pair(length, rng):
+    a = "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in xrange(length))
+    b = list(a)
+    for _ in xrange(max(1, length // 10)):
+        b[rng.randint(0, length - 1)] = rng.choice("ACDEFGHIKLMNPQRSTVWY")
+    return a, "".join(b)
 
-    for i in xrange(100000):
-        client_socket.send('ASDFFFG ADFFFFG')
-        a = client_socket.recv(CHUNK)
+def run_connection(address, requests, pipeline, batch, params, latencies):
+    c = Client(*address)
+    if batch:
+        for start in xrange(0, requests, batch):
+            pairs = [pairs_data[i % len(pairs_data)]
+                     for i in xrange(start, min(requests, start + batch))]
+            t = time.time()
+            for r in c.align_batch(pairs, ordered=False, batch_size=batch,
+                                   **params):
+                pass
+            latencies.append(time.time() - t)
+        c.close()
+        return
+    sent = collections.deque()
+    nsent = 0
+    for _ in xrange(requests):
+        while len(sent) < pipeline and nsent < requests:
+            c.send(*pairs_data[nsent % len(pairs_data)], **params)
+            sent.append(time.time())
+            nsent += 1
+        if not sent: break
+        c.recv()
+        latencies.append(time.time() - sent.popleft())
+    c.close()
 
-    client_socket.close()
+def percentile(values, p):
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect(('localhost', PORT))
-    print "DONE"
+def run_level(address, concurrency, requests, pipeline, batch, params):
+    latencies = []
+    threads = [threading.Thread(target=run_connection,
+                                args=(address, requests, pipeline, batch,
+                                      params, latencies))
+               for _ in range(concurrency)]
+    t = time.time()
+    for th in threads: th.start()
+    for th in threads: th.join()
+    elapsed = time.time() - t
+    latencies.sort()
+    return (concurrency * requests / elapsed,
+            [1000 * percentile(latencies, p) for p in (50, 95, 99)])
 
-    for i in xrange(100):
-        s.send("--matrix PAM250 --gap_open -10 ASDFFFG ADFFFFGZ")
-        a = s.recv(CHUNK)
-        #print a
+pairs_data = []
+
+def main():
+    p = optparse.OptionParser(__doc__)
+    p.add_option("--host", dest="host", default="localhost")
+    p.add_option("--port", dest="port", type="int", default=1233)
+    p.add_option("--concurrency", dest="concurrency", default="1,2,4,8,16",
+                 help="comma-separated numbers of connections")
+    p.add_option("--requests", dest="requests", type="int", default=1000,
+                 help="requests per connection")
+    p.add_option("--pipeline", dest="pipeline", type="int", default=1,
+                 help="requests in flight per connection")
+    p.add_option("--batch", dest="batch", type="int", default=0,
+                 help="send the pairs in BATCH requests of this many")
+    p.add_option("--length", dest="length", type="int", default=100,
+                 help="length of the sequences")
+    p.add_option("--matrix", dest="matrix", default=None)
+    p.add_option("--exit", dest="exit", action="store_true", default=False,
+                 help="stop the server when done")
+    options, args = p.parse_args()
 
-    s.send('ASDF')
-    print s.recv(CHUNK)
-    s.send('ASDFFFG ADFFFFGZ')
-    print s.recv(CHUNK)
+    rng = random.Random(42)
+    pairs_data.extend(random_pair(options.length, rng) for _ in xrange(100))
+    params = {'matrix': options.matrix}
+    address = (options.host, options.port)
 
-    s.send('a')
-    print s.recv(CHUNK)
+    print "%12s %12s %10s %10s %10s" % ("concurrency", "requests/s",
+                                        "p50 ms", "p95 ms", "p99 ms")
+    for c in [int(c) for c in options.concurrency.split(",")]:
+        rate, (p50, p95, p99) = run_level(address, c, options.requests,
+                                          options.pipeline, options.batch,
+                                          params)
+        print "%12i %12.1f %10.2f %10.2f %10.2f" % (c, rate, p50, p95, p99)
+        sys.stdout.flush()
 
-    s.send('EXIT')
+    if options.exit:
+        Client(*address).shutdown()
 
 if __name__ == "__main__":
     main()
@@ -29,7 +29,7 @@ setup(name='nwalign',
       zip_safe=False,
       packages=['nwalign'],
       #package_dir={'': 'nwalign'},
-      package_data = {'nwalign': ['*.pyx', "*.c"]},
+      package_data = {'nwalign': ['*.pyx', "*.c", "data/*.npy"]},
       install_requires=[
           'numpy', 'cython'
       ],
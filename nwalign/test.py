@@ -88,8 +88,615 @@ def test_no_string():
     r2 = nw.global_align("", "", gap_extend=-10, gap_open=-20, matrix='BLOSUM62')
     r2 = nw.global_align("", "TT", gap_extend=-10, gap_open=-20)
     r2 = nw.global_align("TT", "", gap_extend=-10, gap_open=-20)
+    assert r2 == ("TT", "--"), r2
     r2 = nw.global_align("", "", gap_extend=-10, gap_open=-20)
 
+def test_linear():
+    import random
+    random.seed(42)
+    for i in range(200):
+        a = "".join(random.choice("ACGTN") for _ in range(random.randint(1, 60)))
+        b = "".join(random.choice("ACGTN") for _ in range(random.randint(1, 60)))
+        for kwargs in ({}, dict(gap_open=-3, gap_extend=-1, match=2),
+                       dict(gap_open=-5, gap_extend=-2, matrix='BLOSUM62')):
+            r = nw.global_align(a, b, **kwargs)
+            rl = nw.global_align(a, b, linear_threshold=0, **kwargs)
+            assert r == rl, (a, b, kwargs, r, rl)
+
+def test_global_score():
+    assert nw.global_score("ACGT", "ACGT", match=3) == 12
+    assert nw.global_score("", "ACG", gap_open=-2) == -6
+    assert nw.global_score("", "", matrix='BLOSUM62') == 0
+    s = nw.global_score("CEELECANTH", "PELICAN", gap_open=-5, gap_extend=-2,
+                        matrix='PAM250')
+    assert s == 8, s
+    # the longer sequence goes along i, as in global_align.
+    assert s == nw.global_score("PELICAN", "CEELECANTH", gap_open=-5,
+                                gap_extend=-2, matrix='PAM250')
+    a = "WWWWQDNVSLFYISAILNDMKEMPGIISRMPPLPVSINNDLASSLVTSATEPRN"
+    assert nw.global_score(a, a, matrix='BLOSUM62') == \
+            nw.score_alignment(a, a, gap_open=-1, gap_extend=-1, matrix='BLOSUM62')
+
+    # the score-only kernels make the same choices, ties included, as the
+    # DP of global_align (done here by the pure-python version).
+    import random
+    from nose.tools import assert_raises
+    from nwalign import cnwalign, pairwise as pw
+    random.seed(8)
+    old = cnwalign.SPLIT_MIN_LEN
+    try:
+        for i in range(100):
+            alpha = random.choice(["AC", "ACGT", "ACDEFGHIKLMNPQRSTVWY"])
+            a = "".join(random.choice(alpha) for _ in range(random.randint(0, 50)))
+            b = "".join(random.choice(alpha) for _ in range(random.randint(0, 50)))
+            for kwargs in (dict(gap_open=-5, gap_extend=-1, matrix='BLOSUM62'),
+                           dict(gap_open=-1, gap_extend=0, matrix='PAM250'),
+                           dict(gap_open=-3, gap_extend=-1, match=2),
+                           dict(gap_open=-2, gap_extend=-2, match=1)):
+                expected = pw.global_score(a, b, **kwargs)
+                for split in (0, 10**9):
+                    cnwalign.SPLIT_MIN_LEN = split
+                    assert nw.global_score(a, b, **kwargs) == expected, (a, b, kwargs)
+    finally:
+        cnwalign.SPLIT_MIN_LEN = old
+    assert_raises(AssertionError, nw.global_score, "A", "C", match=0,
+                  gap_open=1, gap_extend=1)
+
+def test_split_kernel():
+    import random
+    from nwalign import cnwalign
+    random.seed(5)
+    old = cnwalign.SPLIT_MIN_LEN
+    try:
+        for i in range(100):
+            a = "".join(random.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(random.randint(0, 80)))
+            b = "".join(random.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(random.randint(0, 80)))
+            for lt in (None, 0):
+                cnwalign.SPLIT_MIN_LEN = 10**9
+                r = nw.global_align(a, b, gap_open=-5, gap_extend=-1,
+                                    matrix='BLOSUM62', linear_threshold=lt)
+                cnwalign.SPLIT_MIN_LEN = 0
+                rs = nw.global_align(a, b, gap_open=-5, gap_extend=-1,
+                                     matrix='BLOSUM62', linear_threshold=lt)
+                assert r == rs, (a, b, r, rs)
+    finally:
+        cnwalign.SPLIT_MIN_LEN = old
+
+def test_band():
+    import random
+    random.seed(3)
+    for i in range(200):
+        a = "".join(random.choice("ACGT") for _ in range(random.randint(1, 100)))
+        # a few substitutions and indels.
+        b = list(a)
+        for k in range(random.randint(0, 4)):
+            pos = random.randint(0, len(b))
+            op = random.choice("sid")
+            if op == "s" and pos < len(b): b[pos] = random.choice("ACGT")
+            elif op == "i": b.insert(pos, random.choice("ACGT"))
+            elif pos < len(b): del b[pos]
+        b = "".join(b)
+        for kwargs in ({}, dict(gap_open=-5, gap_extend=-2, matrix='BLOSUM62')):
+            r = nw.global_align(a, b, **kwargs)
+            for band in (0, 2, True):
+                assert nw.global_align(a, b, band=band, **kwargs) == r, (a, b, band)
+
+    # very different sequences make the band grow until it's the full matrix.
+    a, b = "AAAAAAAAAACCCCCCCCCC", "CCCCCCCCCCGGGGGGGGGGTTTT"
+    assert nw.global_align(a, b, band=1) == nw.global_align(a, b)
+
+    # for dissimilar pairs, the band is a heuristic, but without a matrix it
+    # never finds a better score than the full DP, and a band as wide as the
+    # matrix gives the full alignment.
+    for i in range(300):
+        a = "".join(random.choice("ACGT") for _ in range(random.randint(0, 40)))
+        b = "".join(random.choice("ACGT") for _ in range(random.randint(0, 40)))
+        for kwargs in (dict(match=2, gap_open=-3, gap_extend=-1),
+                       dict(match=1, gap_open=-1, gap_extend=-1),
+                       dict(match=3, gap_open=-4, gap_extend=-2)):
+            score = nw.global_score(a, b, **kwargs)
+            for band in (0, 1, 4):
+                r = nw.global_align(a, b, band=band, output='cigar', **kwargs)
+                assert r[0] <= score, (a, b, band, kwargs)
+            for kw in (kwargs, dict(gap_open=-5, gap_extend=-1, matrix='BLOSUM62')):
+                assert nw.global_align(a, b, band=40, **kw) == nw.global_align(a, b, **kw)
+
+def test_edit_distance():
+    def lev(a, b):
+        prev = range(len(b) + 1)
+        for i, ca in enumerate(a):
+            cur = [i + 1]
+            for j, cb in enumerate(b):
+                cur.append(min(prev[j] + (ca != cb), prev[j + 1] + 1, cur[j] + 1))
+            prev = cur
+        return prev[-1]
+
+    import random
+    random.seed(4)
+    for i in range(100):
+        # long enough to need several 64-bit words.
+        a = "".join(random.choice("ACGT") for _ in range(random.randint(0, 200)))
+        b = "".join(random.choice("ACGT") for _ in range(random.randint(0, 200)))
+        d = lev(a, b)
+        assert nw.edit_distance(a, b) == d
+        assert nw.global_score(a, b, match=0, gap_open=-2, gap_extend=-2) == -2 * d
+        # the bit-parallel traceback matches the DP kernel.
+        r = nw.global_align(a, b, match=0, gap_open=-1, gap_extend=-1)
+        assert r == nw.global_align(a, b, match=0, gap_open=-1, gap_extend=-1,
+                                    linear_threshold=0), (a, b)
+
+def test_align_many():
+    import random
+    random.seed(1)
+    pairs = [("".join(random.choice("ACGT") for _ in range(random.randint(1, 50))),
+              "".join(random.choice("ACGT") for _ in range(random.randint(1, 50))))
+             for i in range(100)]
+    expected = [nw.global_align(a, b, gap_open=-5, gap_extend=-2,
+                                matrix='BLOSUM62') for a, b in pairs]
+    r = list(nw.align_many(pairs, gap_open=-5, gap_extend=-2, matrix='BLOSUM62'))
+    assert r == expected
+    r = dict(nw.align_many(pairs, gap_open=-5, gap_extend=-2,
+                           matrix='BLOSUM62', ordered=False, processes=2))
+    assert [r[i] for i in range(len(pairs))] == expected
+    scores = list(nw.align_many(pairs, score_only=True, threads=3))
+    assert scores == [nw.global_score(a, b) for a, b in pairs]
+
+def test_all_vs_all():
+    seqs = ["ACGTAGT", "ACGGT", "TTAGT", "ACGTAGTT"]
+    for kwargs in ({}, dict(processes=2)):
+        m = nw.align_all_vs_all(seqs, gap_open=-2, **kwargs)
+        assert m.shape == (4, 4)
+        assert (m == m.T).all()
+        for i in range(4):
+            for j in range(i, 4):
+                assert m[i, j] == nw.global_score(seqs[i], seqs[j], gap_open=-2)
+    d = nw.align_all_vs_all(seqs, distance=True)
+    assert (d.diagonal() == 0).all()
+
+def test_aligner():
+    import random
+    random.seed(7)
+    aa = "ACDEFGHIKLMNPQRSTVWY"
+    for qlen in (0, 30, 600):
+        q = "".join(random.choice(aa) for _ in range(qlen))
+        targets = ["".join(random.choice(aa) for _ in range(random.randint(0, 2 * qlen + 5)))
+                   for i in range(20)]
+        for kwargs in (dict(matrix='BLOSUM62'), dict(match=2),
+                       dict(matrix='PAM250', linear_threshold=0)):
+            a = nw.Aligner(q, gap_open=-5, gap_extend=-1, **kwargs)
+            expected = [nw.global_align(q, t, gap_open=-5, gap_extend=-1, **kwargs)
+                        for t in targets]
+            assert [a.align(t) for t in targets] == expected
+            kwargs.pop('linear_threshold', None)
+            scores = [nw.global_score(q, t, gap_open=-5, gap_extend=-1, **kwargs)
+                      for t in targets]
+            assert [a.score(t) for t in targets] == scores
+            assert list(a.align_many(targets, score_only=True, threads=2)) == scores
+            assert sorted(a.align_many(targets, ordered=False)) == \
+                    sorted(enumerate(expected))
+
+def test_buffers():
+    import numpy as np
+    a, b = "CEELECANTH", "PELICAN"
+    for kwargs in (dict(matrix='PAM250'), dict(match=2), dict(match=0)):
+        expected = nw.global_align(a, b, **kwargs)
+        score = nw.global_score(a, b, **kwargs)
+        for conv in (bytearray, memoryview, lambda s: np.array(list(s), dtype='S1'),
+                     lambda s: np.frombuffer(s, dtype=np.uint8),
+                     lambda s: np.array(list("".join(c + "x" for c in s)), dtype='S1')[::2]):
+            assert nw.global_align(conv(a), conv(b), **kwargs) == expected
+            assert nw.global_score(conv(a), b, **kwargs) == score
+            assert nw.Aligner(conv(b), **kwargs).align(conv(a)) == expected[::-1]
+    assert nw.edit_distance(bytearray("kitten"), memoryview("sitting")) == 3
+    # NUL is a character like any other.
+    assert nw.global_align("AC\0GT", "ACGT") == ("AC\0GT", "AC-GT")
+    assert nw.edit_distance("A\0\0", "A") == 2
+    from nose.tools import assert_raises
+    assert_raises(ValueError, nw.global_align, np.arange(3), "ACG")
+
+def test_server():
+    import socket
+    import threading
+    from nwalign import nwserver
+    for processes in (0, 2):
+        server = nwserver.Server(port=0, processes=processes)
+        t = threading.Thread(target=server.serve_forever)
+        t.start()
+        try:
+            reqs = ["--gap_open -%i TTAAT%s TT" % (i % 3 + 1, "A" * i)
+                    for i in range(50)] + ["TT", "x" * 300000 + " " + "x"]
+            s = socket.create_connection(server.address)
+            # all the requests are sent before any response is read.
+            s.sendall("".join(nwserver.frame(r) for r in reqs))
+            for r in reqs:
+                assert nwserver.recv_frame(s) == nwserver.handle(r)
+            # the same requests again come from the cache.
+            s.sendall("".join(nwserver.frame(r) for r in reqs[:50]) +
+                      nwserver.frame("STATS"))
+            for r in reqs[:50]:
+                assert nwserver.recv_frame(s) == nwserver.handle(r)
+            import json
+            stats = json.loads(nwserver.recv_frame(s))['cache']
+            assert (stats['hits'], stats['misses']) == (50, 51), stats
+            s.close()
+        finally:
+            nwserver.send_frame(socket.create_connection(server.address), "EXIT")
+            t.join()
+
+def test_server_task_error():
+    from nwalign import nwserver
+    # a task that raises outside handle() still fills its slot.
+    for processes in (0, 2):
+        server = nwserver.Server(port=0, processes=processes)
+        try:
+            server.submit(nwserver._handle_batch,
+                          ((0, 1, [(0, None), (1, None)]), {}, [("A", "C", "G"), ("A", "C")]))
+            server.submit(nwserver._handle, ((0, 2, None), None))
+            r = dict((k[1], (k, data)) for k, data in
+                     (server.results.get(timeout=30) for i in range(2)))
+            assert r[1][0] == (0, 1, [(0, None), (1, None)])
+            assert [d[:6] for d in r[1][1]] == ["ERROR:"] * 2
+            assert r[2][0] == (0, 2, None) and r[2][1].startswith("ERROR:")
+        finally:
+            server.close()
+
+def test_cache():
+    from nwalign.cache import AlignmentCache, ENTRY_OVERHEAD
+    calls = []
+    def f(a, b, *args):
+        calls.append(args)
+        return a + b
+    # room for 3 entries of 20 bytes.
+    align = AlignmentCache(maxbytes=3 * (20 + ENTRY_OVERHEAD), func=f)
+    pairs = [("ACGTA" * 2, "TTTTTTTTTT"[i:] + "A" * i) for i in range(5)]
+    for a, b in pairs + pairs[-2:]:
+        assert align(a, b, gap_open=-2) == a + b
+    assert len(calls) == 5
+    stats = align.stats()
+    assert stats['entries'] == len(align) == 3, stats
+    assert stats['evictions'] == 2
+    assert stats['bytes'] <= stats['maxbytes']
+    # pairs[0] was evicted.
+    align(*pairs[0], gap_open=-2)
+    assert len(calls) == 6
+    # different parameters are a different entry.
+    align(*pairs[-1])
+    assert len(calls) == 7
+    assert AlignmentCache()("ACGT", "AGT") == nw.global_align("ACGT", "AGT")
+
+    align = AlignmentCache()
+    for i in range(2):
+        assert align("COELANCANTH", "PELICAN", output='cigar') == (-1, '1D3M1D4M2D')
+        score, ops = align("COELANCANTH", "PELICAN", output='ops')
+        assert score == -1 and (ops == nw.global_align("COELANCANTH", "PELICAN",
+                                                       output='ops')[1]).all()
+        # a pair cut off by min_score is cached as None.
+        assert align("COELANCANTH", "PELICAN", min_score=0) is None
+    stats = align.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (3, 3, 3), stats
+
+def test_client():
+    import random
+    import threading
+    from nwalign import nwserver
+    from nwalign.client import Client, ServerError
+    from nose.tools import assert_raises
+    random.seed(2)
+    pairs = [("".join(random.choice("ACGT") for _ in range(random.randint(1, 40))),
+              "".join(random.choice("ACGT") for _ in range(random.randint(1, 40))))
+             for i in range(300)]
+    expected = [nw.global_align(a, b, gap_open=-3) for a, b in pairs]
+    for processes in (0, 2):
+        server = nwserver.Server(port=0, processes=processes)
+        t = threading.Thread(target=server.serve_forever)
+        t.start()
+        try:
+            c = Client(*server.address)
+            assert c.align("TTAAT", "TT", gap_open=-2) == ("TTAAT", "TT---")
+            assert list(c.align_batch(pairs, batch_size=64, gap_open=-3)) == expected
+            # a single request sent before a batch is answered first.
+            c.send(*pairs[0])
+            r = dict(c.align_batch(pairs[:100], ordered=False, gap_open=-3))
+            assert c.recv() == nw.global_align(*pairs[0])
+            assert [r[i] for i in range(100)] == expected[:100]
+            assert list(c.align_batch([])) == []
+            assert_raises(ServerError, list, c.align_batch(pairs[:5], matrix="NOTAMATRIX"))
+            assert_raises(ServerError, c.align, "A", "T", matrix="NOTAMATRIX")
+            stats = c.stats()['cache']
+            assert stats['hits'] >= 100, stats
+            c.close()
+        finally:
+            Client(*server.address).shutdown()
+            t.join()
+
+def test_min_score():
+    import random
+    random.seed(4)
+    for it in range(150):
+        a = "".join(random.choice("ACGT") for _ in range(random.randint(0, 100)))
+        b = "".join(random.choice("ACGT") for _ in range(random.randint(0, 100)))
+        if it % 2: b = a[random.randint(0, 5):] + b[:10]
+        for kw in (dict(matrix='BLOSUM62', gap_open=-5, gap_extend=-1),
+                   dict(matrix=nw.load_matrix('PAM250'), gap_open=-3),
+                   dict(match=2, gap_open=-3, gap_extend=-1), dict(match=0),
+                   dict(match=1, gap_open=-2, linear_threshold=0),
+                   dict(match=1, gap_open=-2, band=True)):
+            full = nw.global_align(a, b, **kw)
+            score = nw.global_score(a, b, **dict((k, v) for k, v in kw.items()
+                                                 if k not in ('linear_threshold', 'band')))
+            for t in (score - 3, score, score + 1, score + 50):
+                expected = full if score >= t else None
+                assert nw.global_align(a, b, min_score=t, **kw) == expected, (a, b, kw, t)
+                if 'band' in kw or 'linear_threshold' in kw: continue
+                assert nw.global_score(a, b, min_score=t, **kw) == \
+                        (score if score >= t else None)
+                assert nw.Aligner(a, min_score=t, **kw).align(b) == expected
+            assert nw.global_align(a, b, xdrop=10**6, **kw) == full
+    a = "ACGT" * 50
+    assert nw.global_score(a, "T" * 200, xdrop=10) is None
+    assert nw.global_score(a, a, xdrop=10) == 200
+
+def _expand(cigar):
+    import re
+    return "".join(op * int(n) for n, op in re.findall(r"(\d+)([MID])", cigar))
+
+def test_output():
+    import random
+    from nose.tools import assert_raises
+    random.seed(5)
+    for it in range(100):
+        a = "".join(random.choice("ACGT") for _ in range(random.randint(0, 60)))
+        b = "".join(random.choice("ACGT") for _ in range(random.randint(0, 60)))
+        for kw in (dict(matrix='BLOSUM62', gap_open=-5, gap_extend=-1),
+                   dict(match=2, gap_open=-3, gap_extend=-1), dict(match=0),
+                   dict(match=1, gap_open=-2, linear_threshold=0),
+                   dict(match=1, gap_open=-2, band=True)):
+            aj, ai = nw.global_align(a, b, **kw)
+            expected = "".join("I" if x == "-" else "D" if y == "-" else "M"
+                               for x, y in zip(aj, ai))
+            score, cigar = nw.global_align(a, b, output='cigar', **kw)
+            assert _expand(cigar) == expected, (a, b, kw)
+            score2, ops = nw.global_align(a, b, output='ops', **kw)
+            assert score2 == score
+            assert "".join("MID"[o] for o in ops) == expected
+            if 'matrix' in kw:
+                assert score == nw.score_alignment(aj, ai, kw['gap_open'],
+                                                   kw['gap_extend'], kw['matrix'])
+            elif 'band' not in kw:
+                assert score == nw.global_score(a, b, **dict((k, v) for k, v in kw.items()
+                                                          if k != 'linear_threshold'))
+            assert nw.Aligner(a, output='cigar', **kw).align(b) == (score, cigar)
+    kw = dict(gap_open=-5, gap_extend=-2, matrix='PAM250')
+    assert nw.global_score("CEELECANTH", "PELICAN", **kw) == 8
+    assert nw.global_align("CEELECANTH", "PELICAN", output='cigar', **kw) == (11, '1D7M2D')
+    assert nw.global_align("", "", output='cigar') == (0, "")
+    assert_raises(ValueError, nw.global_align, "A", "A", output='sam')
+
+def test_matrices():
+    import os, tempfile, shutil
+    import numpy as np
+    from nose.tools import assert_raises
+    from nwalign import matrices
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ('BLOSUM62', 'PAM250'):
+        m = matrices.load_matrix(name)
+        assert m.dtype == np.int8 and m.shape == (256, 256)
+        assert (m == matrices.parse_matrix(os.path.join(here, name))).all()
+    a, b = "CEELECANTHHHPELICAN", "PELICANCEELECANTH"
+    expected = nw.global_align(a, b, gap_open=-3, matrix='PAM250')
+    pam = matrices.load_matrix('PAM250')
+    assert nw.global_align(a, b, gap_open=-3, matrix=os.path.join(here, 'PAM250')) == expected
+    assert nw.global_align(a, b, gap_open=-3, matrix=np.array(pam, dtype=np.int64)) == expected
+    assert nw.Aligner(a, gap_open=-3, matrix=pam).align(b) == expected
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "pam.npy")
+        matrices.save_matrix('PAM250', path)
+        assert nw.global_align(a, b, gap_open=-3, matrix=path) == expected
+        matrices.register_matrix('MYPAM', path)
+        assert nw.global_score(a, b, gap_open=-3, matrix='MYPAM') == \
+                nw.global_score(a, b, gap_open=-3, matrix='PAM250')
+    finally:
+        shutil.rmtree(tmp)
+    # a name can be given a new matrix.
+    matrices.register_matrix('MYPAM', np.ones((256, 256), dtype=np.int8))
+    assert nw.global_score("AC", "GT", matrix='MYPAM') == 2
+
+    assert_raises(ValueError, nw.global_align, a, b, matrix='NOSUCH')
+    assert_raises(ValueError, matrices.load_matrix, np.ones((3, 4)))
+    assert_raises(ValueError, matrices.load_matrix, np.ones((4, 4)) * 2 ** 40)
+
+    # wider scores are kept in an int16 or int32 matrix.
+    from nwalign import pairwise as pw
+    aj, ai = expected
+    for scale, dtype in ((1000, np.int16), (100000, np.int32)):
+        m = matrices.load_matrix(pam.astype(np.int64) * scale)
+        assert m.dtype == dtype
+        kw = dict(gap_open=-3 * scale, gap_extend=-scale, matrix=m)
+        assert nw.global_align(a, b, **kw) == expected
+        assert nw.Aligner(a, **kw).align(b) == expected
+        assert nw.Aligner(a, **kw).score(b) == pw.global_score(a, b, **kw) == \
+                scale * nw.global_score(a, b, gap_open=-3, matrix=pam)
+        assert nw.score_alignment(aj, ai, -3 * scale, -scale, m) == \
+                scale * nw.score_alignment(aj, ai, -3, -1, pam)
+
+    # a file is read before a built-in matrix of the same name.
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmp)
+        matrices._LOADED.pop("BLOSUM62", None)
+        fh = open("BLOSUM62", "w")
+        fh.write("   A    C\nA 300 -200\nC -200 900\n")
+        fh.close()
+        m = matrices.load_matrix("BLOSUM62")
+        assert m.dtype == np.int16 and m[ord('C'), ord('C')] == 900
+        assert nw.global_score("AC", "AC", matrix="BLOSUM62") == 1200
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+        matrices._LOADED.pop("BLOSUM62", None)
+
+def test_score_alignments():
+    import random
+    import numpy as np
+    random.seed(6)
+    pairs = []
+    for it in range(200):
+        a = "".join(random.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(random.randint(0, 40)))
+        b = "".join(random.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(random.randint(0, 40)))
+        pairs.append(nw.global_align(a, b, gap_open=-3, matrix='BLOSUM62'))
+    a, b = zip(*pairs)
+    expected = [nw.score_alignment(x, y, -7, -2, 'BLOSUM62') for x, y in pairs]
+    assert list(nw.score_alignments(a, b, -7, -2, 'BLOSUM62')) == expected
+    assert list(nw.score_alignments(map(bytearray, a), np.array(b), -7, -2, 'BLOSUM62')) == expected
+
+    rows = np.array([list(x) for x, y in pairs if len(x) == len(pairs[0][0])], dtype='S1')
+    ref = rows[0]
+    assert list(nw.score_alignments(rows, ref, -7, -2, 'PAM250')) == \
+            [nw.score_alignment(r.tostring(), ref.tostring(), -7, -2, 'PAM250') for r in rows]
+    assert list(nw.score_alignments(rows.view(np.uint8), rows, -7, -2, 'PAM250')) == \
+            [nw.score_alignment(r.tostring(), r.tostring(), -7, -2, 'PAM250') for r in rows]
+    from nose.tools import assert_raises
+    assert_raises(AssertionError, nw.score_alignments, ["AC-"], ["AC"], -1, -1, 'PAM250')
+
+def test_pairwise():
+    import random
+    import numpy as np
+    from nwalign import pairwise as pw
+    random.seed(7)
+    for it in range(60):
+        alpha = random.choice(["ACGT", "ACDEFGHIKLMNPQRSTVWY"])
+        a = "".join(random.choice(alpha) for _ in range(random.randint(0, 50)))
+        b = "".join(random.choice(alpha) for _ in range(random.randint(0, 50)))
+        if it % 2: b = a[random.randint(0, 5):] + b[:5]
+        for kw in (dict(matrix='BLOSUM62', gap_open=-5, gap_extend=-1),
+                   dict(match=2, gap_open=-3, gap_extend=-1), dict(match=0),
+                   dict(gap_open=-2, xdrop=5), dict(gap_open=-3, min_score=-10)):
+            for x, y in ((a, b), (b, a)):
+                assert pw.global_align(x, y, **kw) == nw.global_align(x, y, **kw), (x, y, kw)
+                assert pw.global_score(x, y, **kw) == nw.global_score(x, y, **kw)
+            assert pw.Aligner(a, output='cigar', **kw).align(b) == \
+                    nw.Aligner(a, output='cigar', **kw).align(b)
+        assert pw.edit_distance(a, b) == nw.edit_distance(a, b)
+        aj, ai = nw.global_align(a, b, gap_open=-3, matrix='PAM250')
+        assert pw.score_alignment(aj, ai, -4, -1, 'PAM250') == \
+                nw.score_alignment(aj, ai, -4, -1, 'PAM250')
+    assert pw.global_align(bytearray("ACGT"), np.array(list("AGT"), dtype="S1")) == ("ACGT", "A-GT")
+
+def test_align_files_pyfasta():
+    import os, sys, tempfile, StringIO
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(here, "..", "pyfasta"))
+    try:
+        import pyfasta
+    finally:
+        sys.path.pop(0)
+    d = tempfile.mkdtemp()
+    q, t, p = [os.path.join(d, f) for f in ("q.fa", "t.fa", "pairs.txt")]
+    open(q, "w").write(">q2 second\nTTAGT\n>q1 a read\nACGTAGT\nAC\n")
+    open(t, "w").write(">t1\nACGGTAC\n>t2 x\nACGTAGTAC\n")
+    open(p, "w").write("q2 t2\nq1 t1\n")
+    results = []
+    for fasta in (None, pyfasta.Fasta):
+        nw.fasta.Fasta, old = fasta, nw.fasta.Fasta
+        try:
+            out = StringIO.StringIO()
+            assert nw.align_files(out, q, t, threads=2) == 4
+            nw.align_files(out, q, t, pairs=p)
+        finally:
+            nw.fasta.Fasta = old
+        results.append(out.getvalue())
+    assert results[0] == results[1], results
+    assert [l.split("\t")[:2] for l in results[1].splitlines()][1:3] == \
+            [["q2", "t1"], ["q2", "t2"]]
+    # pyfasta flattened the files next to them.
+    assert os.path.exists(q + ".flat")
+
+def test_local_semiglobal():
+    import random
+    from nwalign import pairwise as pw
+    random.seed(11)
+    for it in range(40):
+        alpha = random.choice(["ACGT", "ACDEFGHIKLMNPQRSTVWY"])
+        a = "".join(random.choice(alpha) for _ in range(random.randint(0, 60)))
+        b = "".join(random.choice(alpha) for _ in range(random.randint(0, 20)))
+        b = b + a[random.randint(0, 20):random.randint(20, 60)] + b[:8]
+        for kw in (dict(matrix='BLOSUM62', gap_open=-5, gap_extend=-1),
+                   dict(match=2, gap_open=-3, gap_extend=-1)):
+            for x, y in ((a, b), (b, a)):
+                sj, si = nw.semiglobal_align(x, y, **kw)
+                assert (sj.replace("-", ""), si.replace("-", "")) == (x, y)
+                score, cigar = nw.semiglobal_align(x, y, output='cigar', **kw)
+                if 'matrix' in kw:
+                    both = [k for k in range(len(sj)) if "-" not in sj[k] + si[k]]
+                    k0, k1 = (both[0], both[-1] + 1) if both else (0, 0)
+                    assert score == (nw.score_alignment(sj[k0:k1], si[k0:k1], -5, -1, 'BLOSUM62') if both else 0)
+                else:
+                    assert score >= nw.global_score(x, y, **kw)
+                assert pw.semiglobal_align(x, y, output='cigar', **kw) == (score, cigar)
+                assert nw.semiglobal_align(x, y, linear_threshold=0, **kw) == (sj, si)
+                assert pw.semiglobal_align(x, y, **kw) == (sj, si)
+
+                lj, li, start, end = nw.local_align(x, y, **kw)
+                assert lj.replace("-", "") == x[start[0]:end[0]]
+                assert li.replace("-", "") == y[start[1]:end[1]]
+                score, cigar, s2, e2 = nw.local_align(x, y, output='cigar', **kw)
+                assert (s2, e2) == (start, end) and score >= 0
+                if 'matrix' in kw and lj:
+                    assert score == nw.score_alignment(lj, li, -5, -1, 'BLOSUM62')
+                else:
+                    assert (score == 0) == (lj == "")
+                assert pw.local_align(x, y, output='cigar', **kw) == (score, cigar, s2, e2)
+                assert pw.local_align(x, y, **kw) == (lj, li, start, end)
+    # a long query makes the forward pass keep more than one row.
+    a = "".join(random.choice("ACGT") for _ in range(3000))
+    b = a[1000:1400] + "TTTTT" + a[1400:1800]
+    lj, li, start, end = nw.local_align(a, b, match=2, gap_open=-4)
+    assert start == (1000, 0) and end == (1800, 805)
+
+def test_fallback():
+    import os, sys, subprocess
+    # with the extension hidden, nwalign uses pairwise.
+    code = "import sys; sys.modules['cnwalign'] = sys.modules['nwalign.cnwalign'] = None; " \
+           "import nwalign; print nwalign.global_align.__module__, nwalign.global_align('ACGT', 'AGT')"
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=here)
+    assert out.strip() == "nwalign.pairwise ('ACGT', 'A-GT')", out
+
+def test_align_files():
+    import os, tempfile, StringIO
+    d = tempfile.mkdtemp()
+    q, t, p = [os.path.join(d, f) for f in ("q.fa", "t.fa", "pairs.txt")]
+    open(q, "w").write(">q1 a read\nACGTAGT\nAC\n>q2\nTTAGT\n")
+    open(t, "w").write(">t1\nACGGTAC\n>t2\nACGTAGTAC\n>t3\nGT\n")
+    open(p, "w").write("q2 t3\n\nq1 t2\n")
+    out = StringIO.StringIO()
+    assert nw.align_files(out, q, t, threads=2, chunksize=2, window=1) == 6
+    rows = [l.split("\t") for l in out.getvalue().splitlines()]
+    assert rows[0] == ["query", "target", "score", "identity", "cigar"]
+    assert [r[:2] for r in rows[1:]] == [["q1", "t1"], ["q1", "t2"], ["q1", "t3"],
+                                         ["q2", "t1"], ["q2", "t2"], ["q2", "t3"]]
+    assert rows[2][2:] == ["9", "1.0000", "9M"]
+    for r in rows[1:]:
+        a = dict(nw.fasta.read_fasta(q))[r[0]]
+        b = dict(nw.fasta.read_fasta(t))[r[1]]
+        assert nw.global_align(a, b, output='cigar') == (int(r[2]), r[4])
+
+    out = StringIO.StringIO()
+    assert nw.align_files(out, q, t, pairs=p, processes=2) == 2
+    assert [l.split("\t")[:3] for l in out.getvalue().splitlines()[1:]] == \
+            [["q2", "t3", "-1"], ["q1", "t2", "9"]]
+
+    open(p, "w").write("ACGT AGT\nAAAA TTTT\n")
+    rows = list(nw.align_stream([("ACGT", "AGT"), ("AAAA", "TTTT")]))
+    out = StringIO.StringIO()
+    nw.align_files(out, pairs=p)
+    assert out.getvalue().splitlines()[1:] == [
+            "%i\t%i\t%i\t%.4f\t%s" % ((i + 1, i + 1) + r) for i, r in enumerate(rows)]
+    assert rows[1] == (-4, 0.0, "4M")
+
 if __name__ == "__main__":
     import nose
     nose.main()
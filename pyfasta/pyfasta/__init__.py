@@ -2,6 +2,8 @@ import sys
 from fasta import Fasta, complement
 from records import *
 from split_fasta import split
+from writer import FastaWriter
+from metrics import Metrics
 import optparse
 
 def main():
@@ -11,6 +13,7 @@ def main():
         `info`: show info about the fasta file and exit.
         `split`: split a large fasta file into separate files
                  and/or into K-mers.
+        `dedup`: write each distinct sequence once.
         `flatten`: flatten a fasta file inplace so that later
                    command-line (and programmattic) access via
                    pyfasta will use the inplace flattened version
@@ -100,6 +103,48 @@ def flatten(args):
     for fa in fasta:
         f = Fasta(fa, flatten_inplace=True)
 
+def dedup(args):
+    """
+    >>> dedup(['tests/data/three_chrs.fasta']) # doctest: +ELLIPSIS
+    >chr1
+    ACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTGACTG
+    >chr2
+    TAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAT
+    >chr3
+    ACGCA...
+    """
+    parser = optparse.OptionParser("""\
+   write each distinct sequence in a fasta file once, in the order of the
+   original file, with the header of its first occurrence. e.g.:
+        pyfasta dedup --map dups.txt some.fasta > some.dedup.fasta""")
+    parser.add_option("--map", dest="map", help="write lines of "
+                      "'kept_header<TAB>duplicate_header' to this file")
+    parser.add_option("--width", dest="width", type="int", default=0,
+                      help="wrap sequence lines at this many basepairs. "
+                           "default of 0 means no wrapping")
+    parser.add_option("--gzip", dest="gzip", action="store_true",
+                      default=False, help="gzip the output")
+    options, fastas = parser.parse_args(args)
+    if len(fastas) != 1:
+        sys.exit(parser.print_help())
+
+    f = Fasta(fastas[0])
+    # file order. with a dedup'ed flat file, duplicates share a start.
+    keys = sorted(f.iterkeys(), key=lambda k: (f.index[k][0], k))
+    kept = {}
+    mapfh = options.map and open(options.map, 'w')
+    writer = FastaWriter(sys.stdout, width=options.width,
+                         compress=options.gzip)
+    for k in keys:
+        d = f.digest(k)
+        if d in kept:
+            if mapfh: print >>mapfh, "%s\t%s" % (kept[d], k)
+            continue
+        kept[d] = k
+        writer.write(k, f[k])
+    writer.close()
+    if mapfh: mapfh.close()
+
 def extract(args):
     """
     >>> extract(['--fasta', 'tests/data/three_chrs.fasta', 'chr2'])
@@ -115,6 +160,11 @@ def extract(args):
                       "if this flag is used, the sequences to extract" \
                       "are read from the file specified in args"
                       , action="store_true", default=False)
+    parser.add_option("--width", dest="width", type="int", default=0,
+                      help="wrap sequence lines at this many basepairs. "
+                           "default of 0 means no wrapping")
+    parser.add_option("--gzip", dest="gzip", action="store_true",
+                      default=False, help="gzip the output")
     options, seqs = parser.parse_args(args)
     if not (options.fasta and len(seqs)):
         sys.exit(parser.print_help())
@@ -125,11 +175,11 @@ def extract(args):
     if options.exclude:
         seqs = sorted(frozenset(f.iterkeys()).difference(seqs))
 
+    writer = FastaWriter(sys.stdout, width=options.width,
+                         compress=options.gzip)
     for seqname in seqs:
-        seq = f[seqname]
-        if options.header:
-            print ">%s" % seqname
-        print seq
+        writer.write(seqname if options.header else None, f[seqname])
+    writer.close()
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
 import string
 import os.path
+import time
 import numpy as np
 
-from records import NpyFastaRecord
+from records import NpyFastaRecord, digest
+from metrics import Metrics, MeteredRecord
 
 _complement = string.maketrans('ATCGatcgNnXx', 'TAGCtagcNnXx')
 complement  = lambda s: s.translate(_complement)
@@ -11,7 +13,7 @@ class FastaNotFound(Exception): pass
 
 class Fasta(dict):
     def __init__(self, fasta_name, record_class=NpyFastaRecord,
-                flatten_inplace=False):
+                flatten_inplace=False, metrics=None, dedup=False):
         """
             >>> from pyfasta import Fasta, FastaRecord
 
@@ -32,14 +34,32 @@ class Fasta(dict):
             >>> f['chr1'][0:10:3]
             'AGTC'
 
+        `metrics` turns on timing of prepare, index loads, slices and
+        reverse-complements; it can be True, a `Metrics` instance or a
+        callback(op, seconds, key, nbytes). the collected values are
+        available from f.metrics.snapshot().
+
+        with `dedup`, records with identical sequence are stored only once
+        in the flattened file (when it's created, and not for inplace
+        flattening) and their index entries share the same start, stop.
+
         """
         if not os.path.exists(fasta_name):
             raise FastaNotFound('"' + fasta_name + '"')
         self.fasta_name = fasta_name
         self.record_class = record_class
+        if metrics is True:
+            metrics = Metrics()
+        elif metrics is not None and not isinstance(metrics, Metrics):
+            metrics = Metrics(callback=metrics)
+        self.metrics = metrics
+        self.dedup = dedup
+        t = time.time()
         self.index, self.prepared = self.record_class.prepare(self,
                                               self.gen_seqs_with_headers(),
                                               flatten_inplace)
+        if metrics is not None:
+            metrics.record('prepare', time.time() - t)
 
         self.chr = {}
 
@@ -89,13 +109,45 @@ class Fasta(dict):
     def __contains__(self, key):
         return key in self.index
 
+    def digest(self, key):
+        """
+        md5 hex digest of the sequence of `key`. it's read from the index
+        when the record class stores it there.
+
+            >>> f = Fasta('tests/data/three_chrs.fasta')
+            >>> f.digest('chr2')
+            'bd9697b69afd97a1d2fd84c1084f2afd'
+        """
+        c = self.index[key]
+        if len(c) > 2 and c[2] is not None:
+            return c[2]
+        return digest(str(self[key]))
+
+    def duplicates(self):
+        """
+        groups (sorted lists) of the keys whose sequences are identical.
+        only groups with more than one key are returned.
+
+            >>> Fasta('tests/data/three_chrs.fasta').duplicates()
+            []
+        """
+        groups = {}
+        for k in self.iterkeys():
+            groups.setdefault(self.digest(k), []).append(k)
+        return sorted(sorted(g) for g in groups.itervalues() if len(g) > 1)
+
     def __getitem__(self, i):
         # this implements the lazy loading
         if i in self.chr:
+            if self.metrics is not None:
+                self.metrics.count('chr_cache.hit')
             return self.chr[i]
 
         c = self.index[i]
         self.chr[i] = self.record_class(self.prepared, c[0], c[1])
+        if self.metrics is not None:
+            self.metrics.count('chr_cache.miss')
+            self.chr[i] = MeteredRecord(self.chr[i], i, self.metrics)
         return self.chr[i]
 
     def sequence(self, f, asstring=True, auto_rc=True
@@ -117,8 +169,8 @@ class Fasta(dict):
             >>> f.sequence({'start':1, 'stop':2, 'strand': -1, 'chr': 'chr1'})
             'GT'
 
-            >>> f.index
-            {'chr3': (160, 3760), 'chr2': (80, 160), 'chr1': (0, 80)}
+            >>> sorted((k, v[:2]) for k, v in f.index.items())
+            [('chr1', (0, 80)), ('chr2', (80, 160)), ('chr3', (160, 3760))]
 
         NOTE: these 2 are reverse-complement-ary because of strand
         #>>> f.sequence({'start':10, 'stop':12, 'strand': -1, 'chr': 'chr1'})
@@ -171,7 +223,12 @@ class Fasta(dict):
             sequence = fasta[(f['start'] - 1): f['stop']]
 
         if auto_rc and f.get('strand') in (-1, '-1', '-'):
-            sequence = complement(sequence)[::-1]
+            if self.metrics is None:
+                sequence = complement(sequence)[::-1]
+            else:
+                t = time.time()
+                sequence = complement(sequence)[::-1]
+                self.metrics.record('revcomp', time.time() - t)
 
         if asstring: return sequence
         return np.array(sequence, dtype='c')
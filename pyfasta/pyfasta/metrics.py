@@ -0,0 +1,127 @@
+import time
+import math
+import collections
+import operator
+
+__all__ = ['Metrics', 'MeteredRecord']
+
+class Metrics(object):
+    """
+    collect counters, latency histograms and bytes served per record for
+    a Fasta object. it's only used when passed to the Fasta constructor
+    (metrics=True, a Metrics instance or a callback). if `callback` is
+    given, it's called as callback(op, seconds, key, nbytes) for every
+    timed operation.
+
+        >>> from pyfasta import Fasta
+        >>> m = Metrics()
+        >>> f = Fasta('tests/data/three_chrs.fasta', metrics=m)
+        >>> f['chr1'][:10], f['chr1'][10:15]
+        ('ACTGACTGAC', 'TGACT')
+        >>> s = m.snapshot()
+        >>> s['ops']['slice']['count'], s['bytes']['chr1']
+        (2, 15)
+        >>> s['counters']['chr_cache.hit'], s['counters']['chr_cache.miss']
+        (1, 1)
+        >>> m.hottest(1)
+        [('chr1', 15)]
+
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.counters = collections.defaultdict(int)
+        self.ops = {}
+        self.nbytes = collections.defaultdict(int)
+        self.reads = collections.defaultdict(int)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def record(self, op, seconds, key=None, nbytes=0):
+        """
+        add a timing for `op`. if `key` is given, the bytes (and number
+        of reads) are also attributed to that record.
+        """
+        try:
+            stats = self.ops[op]
+        except KeyError:
+            stats = self.ops[op] = [0, 0.0, 0.0, collections.defaultdict(int)]
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]: stats[2] = seconds
+        # log2 buckets of microseconds. bucket b holds times < 2**b us.
+        stats[3][math.frexp(seconds * 1e6)[1]] += 1
+        if key is not None:
+            self.nbytes[key] += nbytes
+            self.reads[key] += 1
+        if self.callback is not None:
+            self.callback(op, seconds, key, nbytes)
+
+    def hottest(self, n=10):
+        """
+        the `n` records that have served the most bytes.
+        """
+        return sorted(self.nbytes.iteritems(), key=operator.itemgetter(1),
+                      reverse=True)[:n]
+
+    def snapshot(self):
+        """
+        a dict (of plain python types) of everything collected so far.
+        histograms map the upper-bound in microseconds to a count.
+        """
+        ops = {}
+        for op, (n, total, tmax, hist) in self.ops.iteritems():
+            ops[op] = {'count': n, 'total_seconds': total,
+                       'mean_seconds': total / n, 'max_seconds': tmax,
+                       'histogram_us': dict((2 ** b, c) for b, c
+                                                         in hist.iteritems())}
+        hits = self.counters.get('chr_cache.hit', 0)
+        misses = self.counters.get('chr_cache.miss', 0)
+        return {'ops': ops,
+                'counters': dict(self.counters),
+                'bytes': dict(self.nbytes),
+                'reads': dict(self.reads),
+                'chr_cache_hit_rate': hits / float(hits + misses)
+                                            if hits + misses else None}
+
+
+class MeteredRecord(object):
+    """
+    wraps a record so each slice is timed and the bytes it returns are
+    attributed to the record's key. everything else is delegated to the
+    wrapped record.
+    """
+    __slots__ = ('record', 'key', 'metrics')
+
+    def __init__(self, record, key, metrics):
+        object.__setattr__(self, 'record', record)
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, 'metrics', metrics)
+
+    def __getitem__(self, islice):
+        t = time.time()
+        seq = self.record[islice]
+        self.metrics.record('slice', time.time() - t, self.key, len(seq))
+        return seq
+
+    def __len__(self):
+        return len(self.record)
+
+    def __str__(self):
+        return self[:]
+
+    def __repr__(self):
+        return repr(self.record)
+
+    @property
+    def __array_interface__(self):
+        return self.record.__array_interface__
+
+    def __getattr__(self, attr):
+        return getattr(self.record, attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.record, attr, value)
@@ -2,8 +2,12 @@ import cPickle
 import numpy as np
 import sys
 import os
+import time
+import tempfile
+import hashlib
 
-__all__ = ['FastaRecord', 'NpyFastaRecord', 'MemoryRecord']
+__all__ = ['FastaRecord', 'NpyFastaRecord', 'MemoryRecord',
+           'SharedMemoryRecord']
 
 MAGIC = "@flattened@"
 
@@ -11,6 +15,17 @@ def is_up_to_date(a, b):
     return os.path.exists(a) and os.stat(a).st_mtime >= os.stat(b).st_mtime
 
 
+def digest(seq):
+    """
+    the content digest stored as the 3rd item of each index entry. it's
+    on the sequence exactly as it is in the file (case matters).
+
+    >>> digest('ACTG')
+    '86bfb9f78dd8b6cd35962bb7324fdbf8'
+    """
+    return hashlib.md5(seq).hexdigest()
+
+
 def ext_is_flat(ext):
     fh = open(ext)
     t = fh.read(len(MAGIC))
@@ -44,9 +59,13 @@ class FastaRecord(object):
         """
         f = fasta_obj.fasta_name
         if klass.is_current(f):
+            t = time.time()
             fh = open(f + klass.idx)
             idx = cPickle.load(fh)
             fh.close()
+            metrics = getattr(fasta_obj, 'metrics', None)
+            if metrics is not None:
+                metrics.record('index_load', time.time() - t)
             if flatten_inplace or ext_is_flat(f + klass.ext): flat = klass.modify_flat(f)
             else: flat = klass.modify_flat(f + klass.ext)
             if flatten_inplace and not ext_is_flat(f + klass.ext):
@@ -54,9 +73,17 @@ class FastaRecord(object):
             else:
                 return idx, flat
 
+        # with dedup, a sequence that's already in the flat file is not
+        # written again; its index entry points at the first copy.
+        dedup = getattr(fasta_obj, 'dedup', False) and not flatten_inplace
+        seen = {}
         idx = {}
         flatfh = open(f + klass.ext, 'wb')
         for i, (seqid, seq) in enumerate(seqinfo_generator):
+            d = digest(seq)
+            if dedup and d in seen:
+                idx[seqid] = seen[d]
+                continue
             if flatten_inplace:
                 if i == 0:
                     flatfh.write('>%s\n' % seqid)
@@ -65,7 +92,7 @@ class FastaRecord(object):
             start = flatfh.tell()
             flatfh.write(seq)
             stop = flatfh.tell() 
-            idx[seqid] = (start, stop)
+            idx[seqid] = seen[d] = (start, stop, d)
         flatfh.close()
             
         if flatten_inplace:
@@ -242,6 +269,89 @@ class MemoryRecord(FastaRecord):
 
 
 
+class SharedMemoryRecord(NpyFastaRecord):
+    """
+    like NpyFastaRecord, but the flattened sequence and the index are kept
+    in named shared-memory segments (files in /dev/shm) instead of next to
+    the fasta file. the first process to open a fasta file creates them,
+    every other process (e.g. forked workers) that opens the same file just
+    maps them, so the genome is in memory once per machine and slices are
+    zero-copy views into it. use SharedMemoryRecord.unlink(fasta_name) to
+    remove the segments.
+    """
+    shm_dir = os.path.isdir("/dev/shm") and "/dev/shm" or tempfile.gettempdir()
+    ext = ".seq"
+    idx = ".idx"
+
+    @classmethod
+    def segment_name(klass, fasta_name):
+        """
+        the name of the segments is derived from the absolute path so
+        all processes agree on it.
+        """
+        path = os.path.abspath(fasta_name)
+        return "pyfasta-%s-%s" % (os.path.basename(path),
+                                  hashlib.md5(path).hexdigest()[:12])
+
+    @classmethod
+    def _segment(klass, fasta_name):
+        return os.path.join(klass.shm_dir, klass.segment_name(fasta_name))
+
+    @classmethod
+    def is_current(klass, fasta_name):
+        seg = klass._segment(fasta_name)
+        return is_up_to_date(seg + klass.idx, fasta_name) and \
+               is_up_to_date(seg + klass.ext, fasta_name)
+
+    @classmethod
+    def prepare(klass, fasta_obj, seqinfo_generator, flatten_inplace=False):
+        """
+        attach to the segments if they exist, otherwise create them.
+        `flatten_inplace` is ignored, the fasta file is never touched.
+        """
+        f = fasta_obj.fasta_name
+        seg = klass._segment(f)
+        if klass.is_current(f):
+            t = time.time()
+            fh = open(seg + klass.idx, 'rb')
+            idx = cPickle.load(fh)
+            fh.close()
+            metrics = getattr(fasta_obj, 'metrics', None)
+            if metrics is not None:
+                metrics.record('index_load', time.time() - t)
+            return idx, klass.modify_flat(seg + klass.ext)
+
+        # write to private names and rename so other processes never see
+        # a partial segment. the index goes last as is_current checks it.
+        tmp = ".%i.tmp" % os.getpid()
+        idx = {}
+        flatfh = open(seg + klass.ext + tmp, 'wb')
+        dedup = getattr(fasta_obj, 'dedup', False)
+        seen = {}
+        for seqid, seq in seqinfo_generator:
+            d = digest(seq)
+            if dedup and d in seen:
+                idx[seqid] = seen[d]
+                continue
+            start = flatfh.tell()
+            flatfh.write(seq)
+            idx[seqid] = seen[d] = (start, flatfh.tell(), d)
+        flatfh.close()
+        fh = open(seg + klass.idx + tmp, 'wb')
+        cPickle.dump(idx, fh, -1)
+        fh.close()
+        os.rename(seg + klass.ext + tmp, seg + klass.ext)
+        os.rename(seg + klass.idx + tmp, seg + klass.idx)
+        return idx, klass.modify_flat(seg + klass.ext)
+
+    @classmethod
+    def unlink(klass, fasta_name):
+        seg = klass._segment(fasta_name)
+        for ext in (klass.ext, klass.idx):
+            if os.path.exists(seg + ext):
+                os.unlink(seg + ext)
+
+
 try:
     import tc
     class HDB(tc.HDB):
@@ -259,8 +369,12 @@ try:
         def prepare(klass, fasta_obj, seqinfo_generator, flatten_inplace):
             f = fasta_obj.fasta_name
             if klass.is_current(f):
+                t = time.time()
                 idx = HDB()
                 idx.open(f + klass.idx, tc.HDBOREADER)
+                metrics = getattr(fasta_obj, 'metrics', None)
+                if metrics is not None:
+                    metrics.record('index_load', time.time() - t)
                 if flatten_inplace or ext_is_flat(f + klass.ext): flat = klass.modify_flat(f)
                 else: flat = klass.modify_flat(f + klass.ext)
                 return idx, flat
@@ -277,7 +391,7 @@ try:
                 start = flatfh.tell()
                 flatfh.write(seq)
                 stop = flatfh.tell() 
-                db[seqid] = (start, stop)
+                db[seqid] = (start, stop, digest(seq))
 
             db.sync()
             flatfh.close()
@@ -1,4 +1,5 @@
 from pyfasta import Fasta
+from writer import FastaWriter
 import operator
 import collections
 import string
@@ -7,7 +8,7 @@ import optparse
 from cStringIO import StringIO
 
 
-def newnames(oldname, n, kmers=None, overlap=None, header=None):
+def newnames(oldname, n, kmers=None, overlap=None, header=None, gzip=False):
     """
     >>> newnames('some.fasta', 1)
     ['some.split.fasta']
@@ -27,6 +28,9 @@ def newnames(oldname, n, kmers=None, overlap=None, header=None):
     >>> newnames('some.fasta', 1, kmers=100000, overlap=2000)
     ['some.split.100Kmer.2Koverlap.fasta']
 
+    >>> newnames('some.fasta', 2, gzip=True)
+    ['some.a.fasta.gz', 'some.b.fasta.gz']
+
     """
     if kmers and kmers % 1000 == 0: kmers = "%iK" % (kmers/1000)
     if overlap and overlap % 1000 == 0: overlap = "%iK" % (overlap/1000)
@@ -46,6 +50,8 @@ def newnames(oldname, n, kmers=None, overlap=None, header=None):
         names = [pattern % "split"]
     else:
         names = [pattern % string.letters[i] for i in range(n)]
+    if gzip:
+        names = [name + ".gz" for name in names]
     print >>sys.stderr, "creating new files:"
     print >>sys.stderr, "\n".join(names)
     return names
@@ -55,9 +61,8 @@ def print_to_fh(fh, fasta, lens, seqinfo):
     key, seqlen = seqinfo
     lens[fh.name] += seqlen
     f = fasta
-    assert len(str(f[key])) == seqlen, (key, seqlen, len(str(f[key])))
-    print >>fh, ">%s" % key
-    print >>fh, str(f[key])
+    assert len(f[key]) == seqlen, (key, seqlen, len(f[key]))
+    fh.write(key, f[key])
 
 
 def format_kmer(seqid, start):
@@ -93,6 +98,12 @@ def split(args):
     split big files into pieces of this size in basepairs. default
     default of -1 means do not split the sequence up into k-mers, just
     split based on the headers. a reasonable value would be 10Kbp""")
+    parser.add_option("--width", dest="width", type="int", default=0,
+                      help="wrap sequence lines at this many basepairs. "
+                           "default of 0 means no wrapping")
+    parser.add_option("--gzip", dest="gzip", action="store_true",
+                      default=False, help="gzip the new files (and add "
+                                          "a .gz extension)")
     options, fasta = parser.parse_args(args)
     if not (fasta and (options.nsplits or options.header)):
         sys.exit(parser.print_help())
@@ -114,51 +125,53 @@ def split(args):
         fhs = dict([(seqid, open(fn, 'wb')) for seqid, fn in names[:200]])
         fhs.extend([(seqid, StringIO(), fn) for seqid, fn in names[200:]])
         """
-        return with_header_names(f, names)
+        if options.gzip:
+            names = dict((k, v + ".gz") for k, v in names.iteritems())
+        return with_header_names(f, names, options.width, options.gzip)
     else:
         names = newnames(fasta, options.nsplits, kmers=kmer, overlap=overlap, 
-                     header=options.header)
+                     header=options.header, gzip=options.gzip)
 
         #fhs = [open(n, 'wb') for n in names]
     if options.kmers == -1:
-        return without_kmers(f, names)
+        return without_kmers(f, names, options.width, options.gzip)
     else: 
-        return with_kmers(f, names, options.kmers, options.overlap)
+        return with_kmers(f, names, options.kmers, options.overlap,
+                          options.width, options.gzip)
 
-def with_header_names(f, names):
+def with_header_names(f, names, width=0, gzip=False):
     """
     split the fasta into the files in fhs by headers.
     """
     for seqid, name in names.iteritems():
-        fh = open(name, 'wb')
-        print >>fh, ">%s" % seqid
-        print >>fh, str(f[seqid])
+        fh = FastaWriter(name, width=width, compress=gzip)
+        fh.write(seqid, f[seqid])
         fh.close()
 
-def with_kmers(f, names, k, overlap):
+def with_kmers(f, names, k, overlap, width=0, gzip=False):
     """
     split the sequences in Fasta object `f` into pieces of length `k` 
     with the given `overlap` the results are written to the array of files
     `fhs`
     """
-    fhs = [open(name, 'wb') for name in names]
+    fhs = [FastaWriter(name, width=width, compress=gzip) for name in names]
     i = 0
     for seqid in f.keys():
         seq = f[seqid]
         for (start0, subseq) in Fasta.as_kmers(seq, k, overlap=overlap):
 
             fh = fhs[i % len(fhs)]
-            print >>fh, ">%s" % format_kmer(seqid, start0)
-            print >>fh, subseq
+            fh.write(format_kmer(seqid, start0), subseq)
             i += 1
+    for fh in fhs: fh.close()
 
-def without_kmers(f, names):
+def without_kmers(f, names, width=0, gzip=False):
     """
     long crappy function that does not solve the bin-packing problem.
     but attempts to distribute the sequences in Fasta object `f` evenly
     among the file handles in fhs.
     """
-    fhs = [open(name, 'wb') for name in names]
+    fhs = [FastaWriter(name, width=width, compress=gzip) for name in names]
     name2fh = dict([(fh.name, fh) for fh in fhs])
     items = sorted([(key, len(f[key])) for key in f.keys()], 
                    key=operator.itemgetter(1))
@@ -211,6 +224,7 @@ def without_kmers(f, names):
     if l0 == l1:
         fh = fhs[l0 % len(fhs)]
         print_to_fh(fh, f, lens, items[l0])
+    for fh in fhs: fh.close()
 
 
 def find_name_from_len(lmin, lens):
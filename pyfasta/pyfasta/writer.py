@@ -0,0 +1,154 @@
+import zlib
+import numpy as np
+
+from records import NpyFastaRecord, MemoryRecord
+from metrics import MeteredRecord
+
+__all__ = ['FastaWriter']
+
+NEWLINE = ord("\n")
+
+def _as_array(seq):
+    """
+    get a uint8 view of the sequence without making a python string
+    where possible. accepts records, (memmap) arrays, strings and
+    anything else that supports the buffer interface.
+    """
+    if isinstance(seq, MeteredRecord):
+        seq = seq.record
+    if isinstance(seq, NpyFastaRecord):
+        seq = seq.getdata(slice(None))
+    elif isinstance(seq, MemoryRecord):
+        seq = seq.seq
+    if isinstance(seq, np.ndarray):
+        return np.ascontiguousarray(seq).view(np.uint8).ravel()
+    if not isinstance(seq, (str, buffer, bytearray)):
+        seq = str(seq)
+    return np.frombuffer(seq, dtype=np.uint8)
+
+
+class FastaWriter(object):
+    """
+    buffered writer for fasta records. the sequence is wrapped to `width`
+    basepairs per line (use 0 to put each sequence on a single line).
+    the newlines are inserted by reshaping the sequence into a 2-D array
+    with an extra column, so no per-line python strings are created.
+    output is collected into blocks of about `buffer_size` bytes before
+    it is written. if `compress` is True, each block is gzipped (as a
+    separate gzip member) on a pool of `threads` threads.
+
+        >>> import sys
+        >>> from pyfasta import Fasta, FastaWriter
+        >>> f = Fasta('tests/data/three_chrs.fasta')
+        >>> w = FastaWriter(sys.stdout, width=30)
+        >>> w.write('chr2', f['chr2'])
+        >>> w.write('chr3:1-5', f['chr3'][:5])
+        >>> w.close()
+        >chr2
+        TAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
+        AAAAAAAAAAAAAAAAAAAAAAAAAAAAAA
+        AAAAAAAAAAAAAAAAAAAT
+        >chr3:1-5
+        ACGCA
+
+    """
+    def __init__(self, fh, width=60, buffer_size=4 * 1024 * 1024,
+                 compress=False, threads=None, level=6):
+        self._own_fh = isinstance(fh, basestring)
+        if self._own_fh:
+            fh = open(fh, 'wb')
+        self.fh = fh
+        self.name = getattr(fh, 'name', None)
+        self.width = width or 0
+        self.buffer_size = buffer_size
+        self.compress = compress
+        self.level = level
+        self._buf = []
+        self._nbuf = 0
+        self._pool = None
+        self._pending = []
+        if compress and threads != 1:
+            from multiprocessing import cpu_count
+            from multiprocessing.pool import ThreadPool
+            threads = threads or cpu_count()
+            self._pool = ThreadPool(threads)
+            self._max_pending = 2 * threads
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, header, seq):
+        """
+        write a single record. `header` is written without the leading
+        '>'. if it is None, only the sequence is written.
+        """
+        if header is not None:
+            self._add(">%s\n" % header)
+        self.write_seq(seq)
+
+    def write_seq(self, seq):
+        a = _as_array(seq)
+        n = len(a)
+        w = self.width
+        if w == 0 or n <= w:
+            self._add(a.tostring() + "\n")
+            return
+        # do the wrapping in chunks so a whole chromosome is never
+        # copied at once.
+        rows = max(1, self.buffer_size // (w + 1))
+        nfull = n // w
+        for r0 in xrange(0, nfull, rows):
+            r1 = min(r0 + rows, nfull)
+            block = np.empty((r1 - r0, w + 1), dtype=np.uint8)
+            block[:, :w] = a[r0 * w: r1 * w].reshape(r1 - r0, w)
+            block[:, w] = NEWLINE
+            self._add(block.tostring())
+        if nfull * w < n:
+            self._add(a[nfull * w:].tostring() + "\n")
+
+    def _add(self, s):
+        self._buf.append(s)
+        self._nbuf += len(s)
+        if self._nbuf >= self.buffer_size:
+            self._flush_buffer()
+
+    def _flush_buffer(self):
+        if not self._buf: return
+        data = "".join(self._buf)
+        self._buf = []
+        self._nbuf = 0
+        if not self.compress:
+            self.fh.write(data)
+        elif self._pool is None:
+            self.fh.write(_gzip_block(data, self.level))
+        else:
+            self._pending.append(self._pool.apply_async(_gzip_block,
+                                                   (data, self.level)))
+            # keep order, but dont let the queue grow without bound.
+            while len(self._pending) > self._max_pending:
+                self.fh.write(self._pending.pop(0).get())
+
+    def flush(self):
+        self._flush_buffer()
+        while self._pending:
+            self.fh.write(self._pending.pop(0).get())
+        self.fh.flush()
+
+    def close(self):
+        self.flush()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._own_fh:
+            self.fh.close()
+
+
+def _gzip_block(data, level):
+    # wbits=31 gives a complete gzip member. concatenated members are
+    # a valid gzip file.
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return z.compress(data) + z.flush()
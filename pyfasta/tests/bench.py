@@ -1,48 +1,274 @@
+"""
+benchmark pyfasta record classes and CLI actions.
+
+each case runs in its own process so the reported peak RSS belongs to
+that case alone. results are written as JSON and can be compared to a
+saved baseline:
+
+    $ python tests/bench.py --out bench.json
+    $ python tests/bench.py --baseline bench.json --tolerance 0.25
+
+the exit status is 1 if any case is slower (or uses more memory) than
+the baseline by more than `tolerance`. use --scale to shrink or grow the
+generated inputs.
+"""
 import sys
 import os
 sys.path.insert(0, os.path.abspath("."))
 import pyfasta
-from pyfasta import Fasta
+from pyfasta import Fasta, FastaWriter
+from pyfasta.records import NpyFastaRecord, MemoryRecord, FastaRecord, \
+        SharedMemoryRecord
 
 import time
 import random
-random.seed(1234)
+import resource
+import optparse
+import subprocess
+import tempfile
+import shutil
+import cPickle
+import numpy as np
+try:
+    import json
+except ImportError:
+    import simplejson as json
 
-SEQLEN = 100000
-def make_long_fasta(filename="t.fasta", nrecs=2500, seqlen=SEQLEN):
-    fh = open(filename, 'w')
-        #0123456789"
-    s = "ACTGACTGAC"
-    for i in range(nrecs):
-        print >>fh, ">header%i" % i
-        print >>fh, (s * (seqlen/10))
+record_classes = [NpyFastaRecord, MemoryRecord, FastaRecord,
+                  SharedMemoryRecord]
+try:
+    from pyfasta.records import TCRecord
+    record_classes.append(TCRecord)
+except ImportError:
+    pass
 
-    fh.close()
-    return filename
+CLASSES = dict((k.__name__, k) for k in record_classes)
 
-def read(f, nreads=40000, seqlen=SEQLEN):
+# per record-class cases, then cases that only use the default class.
+RECORD_CASES = ('open_cold', 'open_warm', 'index_load', 'random_slices',
+                'sequential_slices', 'revcomp')
+CLI_CASES = ('split', 'info_gc')
 
-    for k in f.keys()[:10]:
-        for i in range(nreads):
-            start = random.randint(0, seqlen)
-            end = min(seqlen, start + random.randint(1000, 2000))
-            str(f[k][start:end])
-        
+NREADS = 20000
 
+def make_seq(n, rng):
+    """
+    random sequence with a mix of upper and lower-case and runs of N.
+    """
+    a = np.array(list('ACGTacgt'), dtype='S1')[rng.randint(0, 8, size=n)]
+    nruns = n // 50000
+    for start in rng.randint(0, max(1, n - 1000), size=nruns):
+        a[start:start + rng.randint(10, 1000)] = 'N'
+    return a
 
-def main():
-    fa = make_long_fasta()
+def make_inputs(bench_dir, scale=1.0):
+    """
+    create (if needed) the inputs:
+        contigs: many short records of variable length, wrapped at 60.
+        chroms: a few very long records, wrapped at 80.
+    """
+    if not os.path.exists(bench_dir): os.makedirs(bench_dir)
+    rng = np.random.RandomState(42)
+    inputs = {}
+    specs = (('contigs', [int(x) for x in
+                          rng.randint(200, 5000, size=int(20000 * scale))], 60),
+             ('chroms', [int(20000000 * scale)] * 3, 80))
+    for name, lengths, width in specs:
+        path = os.path.join(bench_dir, "%s.%s.fasta" % (name, scale))
+        inputs[name] = path
+        if os.path.exists(path): continue
+        w = FastaWriter(path + ".tmp", width=width)
+        for i, l in enumerate(lengths):
+            w.write("%s%i some description" % (name[:-1], i), make_seq(l, rng))
+        w.close()
+        os.rename(path + ".tmp", path)
+    return inputs
 
-    t = time.time()
-    f = Fasta(fa)
-    print "flatten:", time.time() - t 
+def remove_flat(path, klass):
+    if hasattr(klass, 'unlink'):
+        return klass.unlink(path)
+    for ext in (klass.ext, klass.idx):
+        if os.path.exists(path + ext): os.unlink(path + ext)
+
+def regions(f, n, rng):
+    keys = sorted(f.keys())
+    lens = dict((k, len(f[k])) for k in keys)
+    for i in xrange(n):
+        k = keys[rng.randint(0, len(keys) - 1)]
+        start = rng.randint(0, max(0, lens[k] - 1))
+        yield k, start, min(lens[k], start + rng.randint(100, 2000))
 
-    
+def run_case(klass_name, path, case):
+    """
+    run a single case in this process and return a dict of the stats.
+    """
+    klass = CLASSES.get(klass_name, NpyFastaRecord)
+    rng = random.Random(1234)
+    if case == 'open_cold':
+        remove_flat(path, klass)
+    elif case not in CLI_CASES:
+        # make sure the flattened file + index exist before timing.
+        f = Fasta(path, record_class=klass)
+        del f
+
+    stats = {}
     t = time.time()
-    read(f)
-    print "read:", time.time() - t 
+    if case in ('open_cold', 'open_warm'):
+        f = Fasta(path, record_class=klass)
+    elif case == 'index_load':
+        # only for the classes that keep the index in a pickle.
+        if klass.prepare.im_func is not FastaRecord.prepare.im_func:
+            return None
+        fh = open(path + klass.idx, 'rb')
+        idx = cPickle.load(fh)
+        fh.close()
+        stats['records'] = len(idx)
+    elif case == 'random_slices':
+        f = Fasta(path, record_class=klass)
+        for k, start, stop in regions(f, NREADS, rng):
+            f[k][start:stop]
+    elif case == 'sequential_slices':
+        f = Fasta(path, record_class=klass)
+        for k in f.keys():
+            seq = f[k]
+            for start in xrange(0, len(seq), 10000):
+                seq[start:start + 10000]
+    elif case == 'revcomp':
+        f = Fasta(path, record_class=klass)
+        for k, start, stop in regions(f, NREADS, rng):
+            f.sequence({'chr': k, 'start': start + 1, 'stop': stop,
+                        'strand': -1})
+    elif case == 'split':
+        tmp = tempfile.mkdtemp()
+        try:
+            new = os.path.join(tmp, os.path.basename(path))
+            os.symlink(os.path.abspath(path), new)
+            for ext in (".flat", ".gdx"):
+                if os.path.exists(path + ext):
+                    os.symlink(os.path.abspath(path + ext), new + ext)
+            devnull = open(os.devnull, 'w')
+            stderr, sys.stderr = sys.stderr, devnull
+            try:
+                pyfasta.split(['-n', '4', new])
+            finally:
+                sys.stderr = stderr
+        finally:
+            shutil.rmtree(tmp)
+    elif case == 'info_gc':
+        devnull = open(os.devnull, 'w')
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            pyfasta.info(['--gc', '-n', '-1', path])
+        finally:
+            sys.stdout = stdout
+    else:
+        raise Exception("unknown case: %s" % case)
+
+    stats['seconds'] = time.time() - t
+    stats['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if case in ('open_cold', 'open_warm'):
+        stats['records'] = len(f)
+    return stats
+
+def remove_segments(inputs, klass):
+    """
+    unlink the shared-memory segments (files in /dev/shm) that the cases of
+    `klass` made for `inputs`, if it keeps any. they outlive the processes
+    that made them.
+    """
+    if hasattr(klass, 'unlink'):
+        for path in inputs.values():
+            klass.unlink(path)
+
+def run_job(inputs, klass_name, name, case, results):
+    key = "%s/%s/%s" % (klass_name if case not in CLI_CASES else "cli",
+                        name, case)
+    out = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                            '--case', klass_name, inputs[name], case],
+                            stdout=subprocess.PIPE).communicate()[0]
+    stats = json.loads(out)
+    if stats is None: return
+    results[key] = stats
+    print >>sys.stderr, "%-45s %8.3fs %10iKB" % (key, stats['seconds'],
+                                                 stats['peak_rss_kb'])
+
+def run_all(inputs, classes):
+    """
+    run every case in a fresh interpreter. returns a dict keyed by
+    class/input/case.
+    """
+    results = {}
+    for klass_name in classes:
+        try:
+            for name in sorted(inputs):
+                for case in RECORD_CASES:
+                    run_job(inputs, klass_name, name, case, results)
+        finally:
+            remove_segments(inputs, CLASSES[klass_name])
+    for name in sorted(inputs):
+        for case in CLI_CASES:
+            run_job(inputs, 'NpyFastaRecord', name, case, results)
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    return a list of (key, measure, baseline, new) for everything that
+    got worse by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    for key, stats in sorted(results.iteritems()):
+        if not key in baseline: continue
+        for measure in ('seconds', 'peak_rss_kb'):
+            old, new = baseline[key][measure], stats[measure]
+            # ignore noise in very fast cases.
+            if measure == 'seconds' and max(old, new) < 0.05: continue
+            if new > old * (1 + tolerance):
+                regressions.append((key, measure, old, new))
+    return regressions
+
+def main():
+    parser = optparse.OptionParser(__doc__)
+    parser.add_option("--out", dest="out", help="write results as JSON here")
+    parser.add_option("--baseline", dest="baseline",
+                      help="compare to results saved with --out")
+    parser.add_option("--tolerance", dest="tolerance", type="float",
+                      default=0.25, help="allowed fractional slowdown")
+    parser.add_option("--scale", dest="scale", type="float", default=1.0,
+                      help="multiply the size of the generated inputs")
+    parser.add_option("--dir", dest="dir",
+                      default=os.path.join(tempfile.gettempdir(), "pyfasta-bench"),
+                      help="where to put (and look for) generated inputs")
+    parser.add_option("--classes", dest="classes",
+                      default=",".join(sorted(CLASSES)),
+                      help="comma-separated record classes to benchmark")
+    parser.add_option("--case", dest="case", action="store_true",
+                      default=False, help="(internal) run a single case")
+    options, args = parser.parse_args()
+
+    if options.case:
+        print json.dumps(run_case(*args))
+        return
+
+    inputs = make_inputs(options.dir, options.scale)
+    classes = [c for c in options.classes.split(",") if c in CLASSES]
+    results = run_all(inputs, classes)
+    out = {'meta': {'python': sys.version.split()[0],
+                    'numpy': np.__version__,
+                    'scale': options.scale},
+           'results': results}
+    if options.out:
+        fh = open(options.out, 'w')
+        json.dump(out, fh, indent=1, sort_keys=True)
+        fh.close()
 
-     
+    if options.baseline:
+        baseline = json.load(open(options.baseline))['results']
+        regressions = compare(results, baseline, options.tolerance)
+        for key, measure, old, new in regressions:
+            print >>sys.stderr, "REGRESSION: %s %s: %.3f -> %.3f" % (key,
+                                                      measure, old, new)
+        if regressions:
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
-from pyfasta import Fasta
-from pyfasta.records import NpyFastaRecord, MemoryRecord, FastaRecord
-record_classes = [NpyFastaRecord, MemoryRecord, FastaRecord]
+from pyfasta import Fasta, FastaWriter
+from pyfasta.records import NpyFastaRecord, MemoryRecord, FastaRecord, \
+        SharedMemoryRecord
+record_classes = [NpyFastaRecord, MemoryRecord, FastaRecord,
+                  SharedMemoryRecord]
 try:
     from pyfasta.records import TCRecord
     record_classes.append(TCRecord)
@@ -17,6 +19,7 @@ def _cleanup():
     for f in glob.glob("tests/data/three_chrs.fasta*"):
         if f.endswith(".orig"): continue
         os.unlink(f)
+    SharedMemoryRecord.unlink("tests/data/three_chrs.fasta")
     shutil.copyfile('tests/data/three_chrs.fasta.orig', 'tests/data/three_chrs.fasta')
 
 
@@ -205,6 +208,159 @@ def check_array_copy(f):
     assert a[1:5].tostring() == 'NNNN', a[1:5].tostring()
 
 
+def test_writer():
+    f = Fasta('tests/data/three_chrs.fasta')
+    out = 'tests/data/three_chrs.fasta.written'
+    for width in (0, 7, 60, 100):
+        w = FastaWriter(out, width=width, buffer_size=64)
+        for k in sorted(f.keys()):
+            w.write(k, f[k])
+        w.close()
+        lines = open(out).read().split("\n")
+        if width:
+            assert max(len(l) for l in lines) == width
+        g = Fasta(out)
+        assert sorted(g.keys()) == sorted(f.keys())
+        for k in f.keys():
+            assert str(g[k]) == str(f[k]), (width, k)
+        del g
+        for fn in glob.glob(out + "*"): os.unlink(fn)
+    _cleanup()
+
+def test_writer_gzip():
+    import gzip
+    f = Fasta('tests/data/three_chrs.fasta')
+    out = 'tests/data/three_chrs.fasta.written.gz'
+    for threads in (1, 3):
+        w = FastaWriter(out, width=50, buffer_size=100, compress=True,
+                        threads=threads)
+        for k in sorted(f.keys()):
+            w.write(k, f[k].mm[f[k].start:f[k].stop])
+        w.close()
+
+        expected = FastaWriter(out[:-3], width=50)
+        for k in sorted(f.keys()):
+            expected.write(k, str(f[k]))
+        expected.close()
+        assert gzip.open(out).read() == open(out[:-3]).read()
+        os.unlink(out)
+        os.unlink(out[:-3])
+    _cleanup()
+
+def test_metrics():
+    from pyfasta import Metrics
+    events = []
+    for klass in record_classes:
+        # once to create the index, then to load it.
+        for i in range(2):
+            m = Metrics(callback=lambda *args: events.append(args))
+            f = Fasta('tests/data/three_chrs.fasta', record_class=klass,
+                      metrics=m)
+        assert f['chr3'][:5] == 'ACGCA'
+        assert f.sequence({'chr': 'chr3', 'start': 1, 'stop': 5,
+                           'strand': -1}) == 'TGCGT'
+        assert str(f['chr2']) == f['chr2'][:]
+        assert len(f['chr2']) == 80
+
+        s = m.snapshot()
+        assert s['ops']['slice']['count'] == 4
+        assert s['ops']['revcomp']['count'] == 1
+        assert s['ops']['prepare']['count'] == 1
+        if klass.prepare.im_func is FastaRecord.prepare.im_func:
+            assert s['ops']['index_load']['count'] == 1
+        assert s['bytes'] == {'chr3': 10, 'chr2': 160}
+        assert s['reads'] == {'chr3': 2, 'chr2': 2}
+        assert s['counters'] == {'chr_cache.miss': 2, 'chr_cache.hit': 3}
+        assert s['chr_cache_hit_rate'] == 3 / 5.
+        assert m.hottest(1) == [('chr2', 160)]
+        assert sum(s['ops']['slice']['histogram_us'].values()) == 4
+        del f
+    assert ('slice', events[-1][1], 'chr2', 80) == events[-1]
+    _cleanup()
+
+    # the writer reads a metered record's memmap, not a string copy.
+    from pyfasta.writer import _as_array
+    f = Fasta('tests/data/three_chrs.fasta', metrics=Metrics())
+    a = _as_array(f['chr2'])
+    assert a.tostring() == f['chr2'][:]
+    assert isinstance(a.base.base, np.memmap)
+    del f, a
+    _cleanup()
+
+    # nothing is wrapped when metrics are off.
+    f = Fasta('tests/data/three_chrs.fasta')
+    assert f.metrics is None
+    assert f['chr1'].__class__ == NpyFastaRecord
+    del f
+    _cleanup()
+
+def _shared_worker(fasta_name, q):
+    f = Fasta(fasta_name, record_class=SharedMemoryRecord)
+    q.put((f['chr3'][:5], f['chr2'][-2:]))
+
+def test_shared_memory():
+    import multiprocessing
+    fasta_name = 'tests/data/three_chrs.fasta'
+    f = Fasta(fasta_name, record_class=SharedMemoryRecord)
+    seg = SharedMemoryRecord._segment(fasta_name)
+    assert os.path.exists(seg + ".seq") and os.path.exists(seg + ".idx")
+    # nothing is written next to the fasta.
+    assert not os.path.exists(fasta_name + ".flat")
+    inode = os.stat(seg + ".seq").st_ino
+
+    q = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_shared_worker,
+                                     args=(fasta_name, q)) for i in range(3)]
+    for p in procs: p.start()
+    for p in procs:
+        assert q.get() == ('ACGCA', 'AT')
+        p.join()
+    # the workers attached to the same segment rather than re-creating it.
+    assert os.stat(seg + ".seq").st_ino == inode
+    assert f.sequence({'chr': 'chr1', 'start': 1, 'stop': 2}) == 'AC'
+    assert f['chr1'].mm.filename == seg + ".seq"
+    del f
+    _cleanup()
+    assert not os.path.exists(seg + ".seq")
+
+def test_dedup():
+    import pyfasta
+    import sys
+    from cStringIO import StringIO
+    fasta_name = 'tests/data/dups.fasta'
+    fh = open(fasta_name, 'w')
+    fh.write(">a\nACGT\nAC\n>b\nTTTT\n>c\nACGTAC\n>d\nacgtac\n>e\nTTTT\n")
+    fh.close()
+    try:
+        for klass in (NpyFastaRecord, FastaRecord, SharedMemoryRecord):
+            f = Fasta(fasta_name, record_class=klass, dedup=True)
+            assert f.duplicates() == [['a', 'c'], ['b', 'e']]
+            assert f.index['a'] == f.index['c']
+            assert f.digest('a') == f.digest('c') != f.digest('d')
+            assert f['c'][:] == 'ACGTAC' and f['e'][:] == 'TTTT'
+            assert f['d'][:] == 'acgtac'
+            if klass is not SharedMemoryRecord:
+                assert os.stat(fasta_name + '.flat').st_size == 16
+            del f
+            for fn in glob.glob(fasta_name + ".*"): os.unlink(fn)
+            SharedMemoryRecord.unlink(fasta_name)
+
+        # MemoryRecord doesnt keep digests in the index.
+        f = Fasta(fasta_name, record_class=MemoryRecord)
+        assert f.duplicates() == [['a', 'c'], ['b', 'e']]
+
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            pyfasta.dedup(['--map', fasta_name + '.map', fasta_name])
+            out = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        assert out == ">a\nACGTAC\n>b\nTTTT\n>d\nacgtac\n", out
+        assert open(fasta_name + '.map').read() == "a\tc\nb\te\n"
+    finally:
+        for fn in glob.glob(fasta_name + "*"): os.unlink(fn)
+
+
 if __name__ == "__main__":
     import nose
     nose.main()